@@ -1,14 +1,35 @@
-from flask import Flask, request, jsonify, render_template, Response, stream_with_context
-from router import route_message  # Your existing router
+import sys
+
+# Run as a script this module is __main__; alias it so lazy `from app import app`
+# in background threads doesn't execute app.py a second time
+if __name__ == "__main__":
+    sys.modules.setdefault("app", sys.modules[__name__])
+
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, abort
+from router import route_message_stream  # Your existing router
 from llm import get_available_models  # For model list
 from datetime import datetime, timezone
 from models import db, Conversation, Message, UsageTracking  # ADDED UsageTracking
 import traceback
 from dotenv import load_dotenv
 import os
+import hashlib
+import io
 import json
-import time  # For typewriter delay
-from usage_tracker import record_usage, get_usage_stats  # Updated import
+import time
+from usage_tracker import record_usage, get_usage_stats, get_key_usage  # Updated import
+from usage_feed import usage_feed
+from context_builder import context_builder
+import summarizer
+import bulk_delete
+import chat_transfer
+import archive
+from write_behind import write_behind
+from db_engine import configure_sqlite, tune_engine
+from queries import conversation_page, message_page, parse_timestamp
+from search import search_messages
+from migrations import upgrade as run_migrations
+from rate_limiter import RateLimited, client_id, user_limit_message, user_limiter
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,8 +38,11 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here-change-this'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chat_history.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+configure_sqlite(app)  # WAL, busy timeout, pool settings
 
 db.init_app(app)
+with app.app_context():
+    tune_engine(db.engine)  # Pragmas on every new connection
 
 # Import and initialize music player routes
 try:
@@ -35,8 +59,27 @@ except Exception as e:
 # Create tables (including new UsageTracking table)
 with app.app_context():
     db.create_all()
+    # create_all() can't alter existing tables - versioned migrations add columns/indexes
+    run_migrations(db.engine)
+    archive.reserve_archived_ids()  # New conversation ids stay clear of archived ones
     print("✅ Database tables created (including UsageTracking)")
 
+def on_message_saved(conversation_id, message_id, role, content):
+    """Write-behind hook: runs on the writer thread once a message is committed"""
+    context_builder.record(conversation_id, message_id, role, content)
+    if role == "assistant":
+        # Compact long conversations in the background
+        summarizer.maybe_schedule(conversation_id)
+
+write_behind.init_app(app)
+write_behind.add_listener(on_message_saved)
+archive.start_retention_worker(app)  # No-op unless RETENTION_DAYS is set
+
+CONVERSATIONS_PAGE_SIZE = 50
+MESSAGES_PAGE_SIZE = 50
+SEARCH_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -61,41 +104,117 @@ def get_models():
             "error": str(e)
         })
 
-# Get all conversations
+# Get conversations, newest first - keyset paginated with ?before=<updated_at>&before_id=&limit=
 @app.route("/api/conversations", methods=["GET"])
 def get_conversations():
-    conversations = Conversation.query.order_by(Conversation.updated_at.desc()).all()
+    try:
+        limit = min(max(int(request.args.get("limit", CONVERSATIONS_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        before = parse_timestamp(request.args.get("before"))
+        before_id = request.args.get("before_id", type=int)
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid pagination parameters"}), 400
+
+    # Counted per row in the same statement - no message bodies are loaded
+    rows = [{**row._asdict(), "archived": False}
+            for row in db.session.execute(conversation_page(before, before_id, limit))]
+    # Conversations moved to the archive are listed too, merged in on the same cursor
+    hot_ids = {row["id"] for row in rows}
+    rows += [{**row, "archived": True} for row in archive.archived_conversation_page(before, before_id, limit)
+             if row["id"] not in hot_ids]
+    rows.sort(key=lambda row: (row["updated_at"], row["id"]), reverse=True)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
     return jsonify({
         "conversations": [{
-            "id": conv.id,
-            "title": conv.title,
-            "created_at": conv.created_at.isoformat(),
-            "updated_at": conv.updated_at.isoformat(),
-            "message_count": len(conv.messages)
-        } for conv in conversations]
+            "id": row["id"],
+            "title": row["title"],
+            "created_at": row["created_at"].isoformat(),
+            "updated_at": row["updated_at"].isoformat(),
+            "message_count": row["message_count"],
+            "archived": row["archived"]
+        } for row in rows],
+        "has_more": has_more,
+        "next_before": rows[-1]["updated_at"].isoformat() if has_more else None,
+        "next_before_id": rows[-1]["id"] if has_more else None
     })
 
-# Get messages from a conversation
+# Get messages from a conversation - latest page first, ?before=<timestamp>&before_id=<id> for older
 @app.route("/api/conversations/<int:conversation_id>/messages", methods=["GET"])
 def get_messages(conversation_id):
-    conversation = Conversation.query.get_or_404(conversation_id)
-    messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.timestamp).all()
-    
-    return jsonify({
-        "messages": [{
+    try:
+        limit = min(max(int(request.args.get("limit", MESSAGES_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        before = parse_timestamp(request.args.get("before"))
+        before_id = request.args.get("before_id", type=int)
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid pagination parameters"}), 400
+
+    # Read-your-writes: messages still queued for this conversation land first
+    write_behind.wait_for(conversation_id)
+
+    if db.session.get(Conversation, conversation_id) is not None:
+        # Walks ix_messages_conversation_timestamp_id backwards from the cursor
+        messages = [{
             "id": msg.id,
             "role": msg.role,
             "content": msg.content,
-            "timestamp": msg.timestamp.isoformat()
-        } for msg in messages]
+            "timestamp": msg.timestamp
+        } for msg in db.session.execute(message_page(conversation_id, before, before_id, limit)).scalars()]
+        archived = False
+    else:
+        # Moved to the archive file by the retention policy
+        messages = archive.archived_message_page(conversation_id, before, before_id, limit)
+        if messages is None:
+            abort(404)
+        archived = True
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    messages.reverse()  # Oldest first within the page
+    
+    return jsonify({
+        "messages": [{**msg, "timestamp": msg["timestamp"].isoformat()} for msg in messages],
+        "has_more": has_more,
+        "next_before": messages[0]["timestamp"].isoformat() if has_more else None,
+        "next_before_id": messages[0]["id"] if has_more else None,
+        "archived": archived
+    })
+
+# Full-text search over all messages - ?q=<terms, prefix*>&limit=&offset=&conversation_id=
+@app.route("/api/search", methods=["GET"])
+def search():
+    query = request.args.get("q", "").strip()
+    try:
+        limit = min(max(int(request.args.get("limit", SEARCH_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        offset = max(int(request.args.get("offset", 0)), 0)
+        conversation_id = request.args.get("conversation_id", type=int)
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid pagination parameters"}), 400
+    if not query:
+        return jsonify({"success": False, "error": "Query cannot be empty"}), 400
+
+    started = time.perf_counter()
+    results, has_more, ranking = search_messages(query, limit, offset, conversation_id)
+
+    return jsonify({
+        "success": True,
+        "query": query,
+        "results": results,
+        "ranking": ranking,
+        "has_more": has_more,
+        "next_offset": offset + limit if has_more else None,
+        # Archived conversations (retention policy) are not in the full-text index
+        "archived_not_searched": archive.archive_stats()["conversations"],
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
     })
 
-# Delete conversation
+# Delete conversation - set-based, child rows are never loaded
 @app.route("/api/conversations/<int:conversation_id>", methods=["DELETE"])
 def delete_conversation(conversation_id):
-    conversation = Conversation.query.get_or_404(conversation_id)
-    db.session.delete(conversation)
-    db.session.commit()
+    write_behind.wait_for(conversation_id)  # Don't leave queued messages orphaned
+    deleted = bulk_delete.delete_conversation(conversation_id)
+    archived_deleted = archive.delete_archived(conversation_id)  # Also a stale copy left by a crash
+    if not (deleted or archived_deleted):
+        abort(404)
     return jsonify({"success": True})
 
 # Rename conversation
@@ -116,15 +235,71 @@ def rename_conversation(conversation_id):
         "title": conversation.title
     })
 
-# Clear all conversations
+# Clear all conversations - chunked short transactions; ?background=1 returns a pollable job
 @app.route("/api/clear", methods=["POST"])
 def clear_all():
-    db.session.query(Message).delete()
-    db.session.query(Conversation).delete()
-    db.session.commit()
-    return jsonify({"success": True})
+    write_behind.flush()
+    archived_deleted = archive.clear_archive()
+    if request.args.get("background") == "1":
+        job = bulk_delete.start_clear_job()
+        return jsonify({"success": True, "job": job.to_dict(), "archived_deleted": archived_deleted}), 202
+
+    conversations_deleted, messages_deleted = bulk_delete.clear_history()
+    return jsonify({
+        "success": True,
+        "conversations_deleted": conversations_deleted,
+        "messages_deleted": messages_deleted,
+        "archived_deleted": archived_deleted
+    })
+
+# Progress of a background clear
+@app.route("/api/clear/<job_id>", methods=["GET"])
+def clear_status(job_id):
+    job = bulk_delete.get_clear_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job"}), 404
+    return jsonify({"success": True, "job": job.to_dict()})
+
+# Export history as streamed NDJSON - constant memory however large it is
+@app.route("/api/export", methods=["GET"])
+def export_history():
+    conversation_id = request.args.get("conversation_id", type=int)
+    if conversation_id is not None:
+        write_behind.wait_for(conversation_id)
+    else:
+        write_behind.flush()
+    filename = f"xeergpt-export-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.ndjson"
+    return Response(
+        stream_with_context(chat_transfer.export_ndjson(conversation_id)),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Import an NDJSON export - read line by line, inserted in batches as new conversations
+@app.route("/api/import", methods=["POST"])
+def import_history():
+    try:
+        # Raw request.stream reads in tiny chunks - buffer it for line iteration
+        conversations, messages = chat_transfer.import_ndjson(
+            io.BufferedReader(request.stream, chat_transfer.READ_BUFFER))
+    except Exception as e:
+        print(f"❌ Import failed: {e}")
+        return jsonify({"success": False, "error": str(e)}), 400
+    print(f"📥 Imported {conversations} conversations, {messages} messages")
+    return jsonify({
+        "success": True,
+        "conversations_imported": conversations,
+        "messages_imported": messages
+    })
+
+def _error_event(message, retry_after=None):
+    """SSE error event; retry_after (seconds) when the request was refused by a rate limit"""
+    payload = {'type': 'error', 'message': message}
+    if retry_after is not None:
+        payload['retry_after'] = max(1, round(retry_after))
+    return f"data: {json.dumps(payload)}\n\n"
 
-# Chat endpoint - WITH PROPER STREAMING TYPEWRITER EFFECT
+# Chat endpoint - streams provider tokens as SSE
 @app.route("/api/chat", methods=["POST"])
 def chat():
     try:
@@ -132,11 +307,23 @@ def chat():
         message = data.get("message", "")
         conversation_id = data.get("conversation_id")
         model = data.get("model", "llama-3.3-70b")  # Default model
+        cache = data.get("cache", True) is not False  # False on a resend - ask for a fresh answer
         
         print(f"📨 Message: '{message[:50]}...'")
         print(f"📋 Conversation ID: {conversation_id}")
         print(f"🤖 Model: {model}")
 
+        # Per-user limit (Config.RATE_LIMIT per hour) - refused before any DB or provider work.
+        # Sent as an SSE error like provider failures, so the chat UI shows it in place.
+        retry_after = user_limiter.check(client_id(request.remote_addr, request.headers.get("X-Forwarded-For")))
+        if retry_after:
+            print(f"⛔ User rate limit reached, retry in {retry_after:.0f}s")
+            return Response(
+                _error_event(user_limit_message(retry_after), retry_after),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'Retry-After': str(max(1, round(retry_after)))}
+            )
+
         # Only create NEW conversation if conversation_id is None
         if conversation_id is None:
             title = message[:50] + "..." if len(message) > 50 else message
@@ -147,6 +334,10 @@ def chat():
             print(f"✨ Created NEW conversation: {conversation_id}")
         else:
             conversation = db.session.get(Conversation, conversation_id)
+            if not conversation and archive.restore_archived(conversation_id):
+                # Archived by the retention policy - writing to it brings it back
+                print(f"🗄️ Restored archived conversation {conversation_id}")
+                conversation = db.session.get(Conversation, conversation_id)
             if not conversation:
                 print(f"❌ Conversation {conversation_id} not found!")
                 return jsonify({
@@ -155,28 +346,37 @@ def chat():
                 }), 404
             print(f"✅ Continuing conversation: {conversation_id}")
 
-        # Save user message
-        user_message = Message(
-            conversation_id=conversation_id,
-            role="user",
-            content=message
-        )
-        db.session.add(user_message)
-        db.session.commit()
+        # Prior turns that fit the model's token budget (before this message is saved)
+        write_behind.wait_for(conversation_id)
+        history = context_builder.build(conversation_id, model, message)
 
-        # Stream the response with typewriter effect
+        # Save user message (committed by the write-behind thread)
+        write_behind.save_message(conversation_id, "user", message)
+
+        # Stream the response straight from the provider
         def generate():
             usage_tracked = False  # Flag to ensure we only track once
             
             try:
-                # Get full AI response
-                ai_response = route_message(message, model=model)
+                # Open the provider stream (the first chunk arrives at provider TTFT)
+                stream = route_message_stream(message, model=model, history=history, cache=cache)
+                
+                # Send conversation_id first
+                yield f"data: {json.dumps({'type': 'conversation_id', 'conversation_id': conversation_id})}\n\n"
+                
+                # Forward provider deltas as they arrive - no artificial delay
+                chunks = []
+                for delta in stream:
+                    chunks.append(delta)
+                    yield f"data: {json.dumps({'type': 'content', 'content': delta})}\n\n"
+                ai_response = "".join(chunks)
                 
-                # FIXED: Track usage ONCE per message (not per chunk)
-                if not usage_tracked:
+                # FIXED: Track usage ONCE per message (not per chunk) - cache hits are free
+                if not usage_tracked and not stream.cached:
                     try:
                         from llm import AVAILABLE_MODELS
-                        model_info = AVAILABLE_MODELS.get(model, {})
+                        # Fallback routing may have served this from another model
+                        model_info = AVAILABLE_MODELS.get(stream.model or model, {})
                         provider = model_info.get("provider", "unknown")
                         if provider in ("groq", "openrouter"):
                             count = record_usage(provider)
@@ -186,31 +386,11 @@ def chat():
                         print(f"⚠️ Usage tracking error: {e}")
                         traceback.print_exc()
                 
-                # Send conversation_id first
-                yield f"data: {json.dumps({'type': 'conversation_id', 'conversation_id': conversation_id})}\n\n"
-                
-                # FIXED: Stream with proper delays for typewriter effect
-                words = ai_response.split(' ')
-                for i, word in enumerate(words):
-                    chunk = word + (' ' if i < len(words) - 1 else '')
-                    yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
-                    
-                    # CRITICAL: Add delay for typewriter effect
-                    time.sleep(0.03)  # 30ms per word
-                
-                # Save AI message to database
-                ai_message = Message(
-                    conversation_id=conversation_id,
-                    role="assistant",
-                    content=ai_response
-                )
-                db.session.add(ai_message)
+                # Queue AI message + conversation timestamp bump (written in the next batch)
+                write_behind.save_message(conversation_id, "assistant", ai_response)
+                write_behind.touch_conversation(conversation_id)
                 
-                # Update conversation timestamp
-                conversation.updated_at = datetime.now(timezone.utc)
-                db.session.commit()
-                
-                print(f"💾 Saved messages to conversation {conversation_id}")
+                print(f"💾 Queued messages for conversation {conversation_id}")
                 
                 # Send done signal
                 yield f"data: {json.dumps({'type': 'done', 'success': True})}\n\n"
@@ -225,7 +405,7 @@ def chat():
                 if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str or "quota" in error_str.lower():
                     error_message = f"⚠️ **{model}** has hit its rate limit. Please wait a moment or switch to a different model."
                 
-                yield f"data: {json.dumps({'type': 'error', 'message': error_message})}\n\n"
+                yield _error_event(error_message, e.retry_after if isinstance(e, RateLimited) else None)
         
         return Response(
             stream_with_context(generate()),
@@ -250,23 +430,42 @@ def chat():
 @app.route("/api/test-keys")
 def test_keys():
     """Test endpoint to check how many keys are loaded"""
-    from llm import groq_clients, openrouter_clients
+    from llm import groq_clients, openrouter_clients, KEY_POOLS
+    from router import get_routing_stats
     return jsonify({
         "groq_keys": len(groq_clients),
         "openrouter_keys": len(openrouter_clients),
+        "key_pools": {name: pool.snapshot() for name, pool in KEY_POOLS.items()},
+        "routing": get_routing_stats(),
+        "conversation_memory": context_builder.memory.stats(),
+        "write_behind": write_behind.stats(),
+        "user_rate_limit": user_limiter.stats(),
+        "usage_feed": usage_feed.stats(),
         "status": "working"
     })
 
 # Usage bar endpoint - FIXED
 @app.route("/api/usage", methods=["GET"])
 def get_usage():
-    """Return current API usage stats for the usage bar"""
+    """
+    Return current API usage stats for the usage bar
+    Stats are memoized in usage_tracker; the body carries a strong ETag, so a
+    client revalidating with If-None-Match gets a bodiless 304 until it changes.
+    """
     try:
+        from response_cache import response_cache
+        from semantic_cache import semantic_cache
         stats = get_usage_stats()
-        return jsonify({
+        response = jsonify({
             "success": True,
-            "stats": stats
+            "stats": stats,
+            "keys": get_key_usage(),  # Per API key and model, with token counts
+            "cache": response_cache.stats(),
+            "semantic_cache": semantic_cache.stats()
         })
+        response.set_etag(hashlib.sha256(response.get_data()).hexdigest())
+        response.headers["Cache-Control"] = "no-cache"  # Cacheable, but revalidate every time
+        return response.make_conditional(request)
     except Exception as e:
         print(f"❌ Usage stats error: {e}")
         traceback.print_exc()
@@ -275,6 +474,10 @@ def get_usage():
             "error": str(e)
         }), 500
 
+# /api/usage/stream (usage bar push updates) is served by asgi.py only - under
+# WSGI each open tab would hold a worker thread for as long as it stays open.
+# Here it 404s and usage_bar.js polls /api/usage (ETag revalidation) instead.
+
 # DEBUG: Check usage tracking database
 @app.route("/api/usage/debug", methods=["GET"])
 def usage_debug():
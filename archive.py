@@ -0,0 +1,469 @@
+"""
+Archive - retention policy and cold storage for old conversations
+Conversations untouched for RETENTION_DAYS are moved out of the hot tables
+into a separate SQLite file (ARCHIVE_DATABASE_PATH), one row per
+conversation holding all of its messages as a single compressed JSON blob.
+The main DB then gives the freed pages back with PRAGMA incremental_vacuum
+in small steps.
+
+Archived conversations stay readable: app.py falls back to
+archived_message_page() when a conversation is no longer in the hot tables,
+and restore_archived() moves one back when the user writes to it again.
+Conversation ids are never reused (AUTOINCREMENT, migration 5), so an
+archived id can't collide with a newer conversation.
+With RETENTION_DAYS > 0 a background thread runs the policy every
+RETENTION_INTERVAL_HOURS; it can also be run by hand:
+
+    python archive.py run [days]     archive now
+    python archive.py vacuum         one full VACUUM (turns on incremental vacuum for an old DB file)
+    python archive.py status
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import (DateTime, Integer, LargeBinary, String, bindparam, column, create_engine,
+                        delete, insert, select, table, text)
+
+from compression import compress_body, decompress_body, pack_text
+from context_builder import context_builder
+from db_engine import tune_engine
+from migrations import DATABASE_PATH
+from models import db, Conversation, ConversationSummary, Message
+from queries import keyset
+from write_behind import write_behind
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 0))        # 0 = keep everything hot
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", 6))
+ARCHIVE_DATABASE_PATH = os.getenv(
+    "ARCHIVE_DATABASE_PATH", os.path.join(os.path.dirname(DATABASE_PATH), "chat_archive.db"))
+CONVERSATIONS_PER_BATCH = 20
+VACUUM_PAGES_PER_STEP = 1000    # ~4 MB per step at the default page size
+BATCH_PAUSE = 0.005             # Seconds between batches - lets queued writers in
+
+_ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS archived_conversations (
+        id INTEGER PRIMARY KEY,
+        title VARCHAR(200) NOT NULL,
+        created_at DATETIME,
+        updated_at DATETIME,
+        archived_at DATETIME NOT NULL,
+        message_count INTEGER NOT NULL,
+        messages_z BLOB NOT NULL
+    )
+"""
+
+# Sidebar pages merge these in by (updated_at, id), like queries.conversation_page()
+_ARCHIVE_INDEX = """
+    CREATE INDEX IF NOT EXISTS ix_archived_conversations_updated_at_id
+    ON archived_conversations (updated_at, id)
+"""
+
+# Typed view of the archive table for SQLAlchemy statements (datetimes in and out)
+_archived = table(
+    "archived_conversations",
+    column("id", Integer), column("title", String), column("created_at", DateTime),
+    column("updated_at", DateTime), column("archived_at", DateTime), column("message_count", Integer),
+    column("messages_z", LargeBinary),
+)
+
+# Rows archived before writes went through _archived lack the ".000000" SQLAlchemy
+# always writes, which breaks text comparison against a cursor - pad them once
+_NORMALIZE_TIMESTAMPS = """
+    UPDATE archived_conversations
+    SET created_at = CASE WHEN length(created_at) = 19 THEN created_at || '.000000' ELSE created_at END,
+        updated_at = CASE WHEN length(updated_at) = 19 THEN updated_at || '.000000' ELSE updated_at END
+    WHERE length(created_at) = 19 OR length(updated_at) = 19
+"""
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def archive_engine():
+    """Engine on the archive file, created (with its table) on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            os.makedirs(os.path.dirname(ARCHIVE_DATABASE_PATH), exist_ok=True)
+            engine = tune_engine(create_engine(f"sqlite:///{ARCHIVE_DATABASE_PATH}"))
+            with engine.begin() as conn:
+                conn.exec_driver_sql(_ARCHIVE_SCHEMA)
+                conn.exec_driver_sql(_ARCHIVE_INDEX)
+                conn.exec_driver_sql(_NORMALIZE_TIMESTAMPS)
+            _engine = engine
+        return _engine
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _parse(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+# ── Archiving ───────────────────────────────────────────────────────────────
+
+def _id_collisions(rows):
+    """
+    Ids among `rows` (hot conversations) already in the archive. A copy of the
+    same conversation (same created_at) is a leftover from a crash between the
+    two commits and may be replaced; any other is a different conversation
+    that got a reused id (a DB from before migration 5) and must not be.
+    Returns (stale copies, foreign ids).
+    """
+    if not os.path.exists(ARCHIVE_DATABASE_PATH):
+        return set(), set()
+    created = {row.id: row.created_at for row in rows}
+    with archive_engine().connect() as conn:
+        archived = conn.execute(
+            text("SELECT id, created_at FROM archived_conversations WHERE id IN :ids")
+            .bindparams(bindparam("ids", expanding=True)), {"ids": list(created)}
+        ).all()
+    stale = {row.id for row in archived if _parse(row.created_at) == created[row.id]}
+    return stale, {row.id for row in archived} - stale
+
+
+def _archive_batch(conversation_ids, cutoff):
+    """
+    Move one batch into the archive. The hot-side DELETE runs first, so the
+    write lock is held while the messages are read and nothing can be appended
+    to a conversation in between; the archive row is committed before the hot
+    rows are. A crash between the two leaves a copy in both files, which the
+    next run replaces. A conversation whose id is already archived for a
+    different conversation is left in the hot tables. Returns (conversations,
+    messages) archived.
+    """
+    candidates = db.session.execute(
+        select(Conversation.id, Conversation.created_at)
+        .where(Conversation.id.in_(conversation_ids), Conversation.updated_at < cutoff)
+    ).all()
+    stale, foreign = _id_collisions(candidates)
+    for conversation_id in sorted(foreign):
+        print(f"⚠️ Not archiving conversation {conversation_id}: its id is already archived for another conversation")
+    conversation_ids = [row.id for row in candidates if row.id not in foreign]
+    if not conversation_ids:
+        db.session.rollback()
+        return 0, 0
+
+    moved = db.session.execute(
+        delete(Conversation)
+        .where(Conversation.id.in_(conversation_ids), Conversation.updated_at < cutoff)
+        .returning(Conversation.id, Conversation.title, Conversation.created_at, Conversation.updated_at)
+    ).all()
+    if not moved:
+        db.session.rollback()
+        return 0, 0
+    moved_ids = [row.id for row in moved]
+
+    messages = {conversation_id: [] for conversation_id in moved_ids}
+    for row in db.session.execute(
+            select(Message.conversation_id, Message.id, Message.role, Message.content, Message.timestamp)
+            .where(Message.conversation_id.in_(moved_ids))
+            .order_by(Message.conversation_id, Message.timestamp, Message.id)):
+        messages[row.conversation_id].append([row.id, row.role, row.content, _iso(row.timestamp)])
+
+    archived_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    with archive_engine().begin() as conn:
+        replaced = [conversation_id for conversation_id in moved_ids if conversation_id in stale]
+        if replaced:
+            conn.execute(text("DELETE FROM archived_conversations WHERE id IN :ids")
+                         .bindparams(bindparam("ids", expanding=True)), {"ids": replaced})
+        conn.execute(insert(_archived), [{
+            "id": row.id, "title": row.title, "created_at": row.created_at, "updated_at": row.updated_at,
+            "archived_at": archived_at, "message_count": len(messages[row.id]),
+            "messages_z": pack_text(json.dumps(messages[row.id], ensure_ascii=False))
+        } for row in moved])
+
+    message_count = db.session.execute(delete(Message).where(Message.conversation_id.in_(moved_ids))).rowcount
+    db.session.execute(delete(ConversationSummary).where(ConversationSummary.conversation_id.in_(moved_ids)))
+    db.session.commit()
+    for conversation_id in moved_ids:
+        context_builder.invalidate(conversation_id)
+    return len(moved_ids), message_count
+
+
+def archive_old_conversations(days=None, progress=None):
+    """
+    Archive every conversation not updated in `days` days (needs an app
+    context), then incrementally vacuum. progress(conversations, messages)
+    is called after each batch. Returns (conversations, messages, pages freed).
+    """
+    days = RETENTION_DAYS if days is None else days
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).replace(tzinfo=None)
+    conversations_archived = 0
+    messages_archived = 0
+    after_id = 0
+
+    while True:
+        conversation_ids = db.session.execute(
+            select(Conversation.id)
+            .where(Conversation.id > after_id, Conversation.updated_at < cutoff)
+            .order_by(Conversation.id)
+            .limit(CONVERSATIONS_PER_BATCH)
+        ).scalars().all()
+        if not conversation_ids:
+            break
+        after_id = conversation_ids[-1]
+
+        conversations, messages = _archive_batch(conversation_ids, cutoff)
+        conversations_archived += conversations
+        messages_archived += messages
+        if progress:
+            progress(conversations_archived, messages_archived)
+        time.sleep(BATCH_PAUSE)
+
+    pages_freed = incremental_vacuum(db.engine) if conversations_archived else 0
+    return conversations_archived, messages_archived, pages_freed
+
+
+def incremental_vacuum(engine):
+    """Return free pages to the OS a step at a time; 0 unless auto_vacuum=INCREMENTAL"""
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            print("ℹ️ Main DB predates incremental vacuum - run `python archive.py vacuum` once")
+            return 0
+        free_before = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        free = free_before
+        raw = conn.connection.dbapi_connection
+        while free > 0:
+            # executescript steps the pragma to completion (execute() frees only one page)
+            raw.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP});")
+            remaining = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if remaining >= free:
+                break
+            free = remaining
+            time.sleep(BATCH_PAUSE)
+    return free_before - free
+
+
+# ── Reading / restoring / deleting archived conversations ───────────────────
+
+def _archived_row(conversation_id):
+    if not os.path.exists(ARCHIVE_DATABASE_PATH):
+        return None
+    with archive_engine().connect() as conn:
+        return conn.execute(
+            text("SELECT * FROM archived_conversations WHERE id = :id"), {"id": conversation_id}
+        ).first()
+
+
+def archived_message_page(conversation_id, before=None, before_id=None, limit=50):
+    """
+    Same page as queries.message_page() but from the archive: newest first,
+    limit + 1 rows, as dicts. None when the conversation isn't archived.
+    """
+    row = _archived_row(conversation_id)
+    if row is None:
+        return None
+    page = []
+    for message_id, role, content, timestamp in reversed(json.loads(decompress_body(row.messages_z))):
+        timestamp = _parse(timestamp)
+        if before is not None:
+            if before_id is None and timestamp >= before:
+                continue
+            if before_id is not None and (timestamp, message_id) >= (before, before_id):
+                continue
+        page.append({"id": message_id, "role": role, "content": content, "timestamp": timestamp})
+        if len(page) > limit:
+            break
+    return page
+
+
+def archived_conversation_page(before=None, before_id=None, limit=50):
+    """
+    Sidebar rows for archived conversations, in the order and with the cursor
+    of queries.conversation_page() so app.py can merge the two pages; limit + 1
+    rows, as dicts
+    """
+    if not os.path.exists(ARCHIVE_DATABASE_PATH):
+        return []
+    stmt = (select(_archived.c.id, _archived.c.title, _archived.c.created_at,
+                   _archived.c.updated_at, _archived.c.message_count)
+            .order_by(_archived.c.updated_at.desc(), _archived.c.id.desc())
+            .limit(limit + 1))
+    if before is not None:
+        stmt = stmt.where(keyset(_archived.c.updated_at, _archived.c.id, before, before_id))
+    with archive_engine().connect() as conn:
+        return [row._asdict() for row in conn.execute(stmt)]
+
+
+def archived_conversations(conversation_id=None):
+    """Yield (conversation row, [[message_id, role, content, timestamp], ...]) oldest id first, one at a time"""
+    if not os.path.exists(ARCHIVE_DATABASE_PATH):
+        return
+    stmt = select(_archived).order_by(_archived.c.id)
+    if conversation_id is not None:
+        stmt = stmt.where(_archived.c.id == conversation_id)
+    with archive_engine().connect() as conn:
+        for row in conn.execute(stmt.execution_options(yield_per=CONVERSATIONS_PER_BATCH)):
+            yield row, json.loads(decompress_body(row.messages_z))
+
+
+def restore_archived(conversation_id):
+    """
+    Move one archived conversation back into the hot tables under its own id
+    (needs an app context), e.g. when the user writes to it again. Its
+    messages get new ids. False if it isn't archived or the id is taken.
+    """
+    row = _archived_row(conversation_id)
+    if row is None:
+        return False
+    if db.session.get(Conversation, conversation_id) is not None:
+        print(f"⚠️ Not restoring conversation {conversation_id}: the id is in use by another conversation")
+        return False
+    db.session.execute(insert(Conversation), [{
+        "id": row.id, "title": row.title,
+        "created_at": _parse(row.created_at), "updated_at": _parse(row.updated_at)
+    }])
+    messages = []
+    for _, role, content, timestamp in json.loads(decompress_body(row.messages_z)):
+        blob = compress_body(content)
+        messages.append({
+            "conversation_id": row.id, "role": role,
+            "content": "" if blob is not None else content, "content_z": blob,
+            "timestamp": _parse(timestamp)
+        })
+    if messages:
+        db.session.execute(insert(Message.__table__), messages)
+    # Hot copy first: a crash before the archive row goes leaves a stale copy the next run replaces
+    db.session.commit()
+    delete_archived(conversation_id)
+    context_builder.invalidate(conversation_id)
+    return True
+
+
+def reserve_archived_ids():
+    """
+    Keep the conversations id sequence above every archived id (needs an app
+    context). Only an archive written before migration 5 can hold ids above
+    it - since then AUTOINCREMENT never hands an id out twice.
+    """
+    if not os.path.exists(ARCHIVE_DATABASE_PATH):
+        return
+    with archive_engine().connect() as conn:
+        max_id = conn.exec_driver_sql("SELECT MAX(id) FROM archived_conversations").scalar()
+    if not max_id:
+        return
+    seq = db.session.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'conversations'")).scalar()
+    if seq is None:
+        db.session.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('conversations', :id)"),
+                           {"id": max_id})
+    elif seq < max_id:
+        db.session.execute(text("UPDATE sqlite_sequence SET seq = :id WHERE name = 'conversations'"),
+                           {"id": max_id})
+    db.session.commit()
+
+
+def delete_archived(conversation_id):
+    """Drop one archived conversation; False if it wasn't archived"""
+    if not os.path.exists(ARCHIVE_DATABASE_PATH):
+        return False
+    with archive_engine().begin() as conn:
+        return conn.execute(text("DELETE FROM archived_conversations WHERE id = :id"),
+                            {"id": conversation_id}).rowcount > 0
+
+
+def clear_archive():
+    """Drop every archived conversation; returns how many there were"""
+    if not os.path.exists(ARCHIVE_DATABASE_PATH):
+        return 0
+    with archive_engine().begin() as conn:
+        return conn.exec_driver_sql("DELETE FROM archived_conversations").rowcount
+
+
+def archive_stats():
+    if not os.path.exists(ARCHIVE_DATABASE_PATH):
+        return {"conversations": 0, "messages": 0, "bytes": 0}
+    with archive_engine().connect() as conn:
+        conversations, messages = conn.exec_driver_sql(
+            "SELECT COUNT(*), COALESCE(SUM(message_count), 0) FROM archived_conversations").one()
+    return {"conversations": conversations, "messages": messages,
+            "bytes": os.path.getsize(ARCHIVE_DATABASE_PATH)}
+
+
+# ── Background policy ───────────────────────────────────────────────────────
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _retention_loop(app):
+    while True:
+        try:
+            # A queued message bumps its conversation's updated_at only once committed -
+            # archiving before that would leave the message orphaned in the hot tables
+            if not write_behind.flush():
+                print("⚠️ Retention run skipped: write-behind queue didn't drain")
+            else:
+                with app.app_context():
+                    conversations, messages, pages = archive_old_conversations()
+                if conversations:
+                    print(f"🗄️ Archived {conversations} conversations ({messages} messages) "
+                          f"older than {RETENTION_DAYS} days, freed {pages} pages")
+        except Exception as e:
+            print(f"⚠️ Retention run failed: {e}")
+            traceback.print_exc()
+        time.sleep(RETENTION_INTERVAL_HOURS * 3600)
+
+
+def start_retention_worker(app):
+    """Start the periodic archiver once if RETENTION_DAYS is set; returns the thread or None"""
+    global _worker
+    if RETENTION_DAYS <= 0:
+        return None
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_retention_loop, args=(app,), name="retention", daemon=True)
+            _worker.start()
+            print(f"🗄️ Retention: archiving conversations idle > {RETENTION_DAYS} days "
+                  f"every {RETENTION_INTERVAL_HOURS:g}h")
+    return _worker
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+    if command == "vacuum":
+        # Plain engine - the pragma listener sets auto_vacuum=INCREMENTAL before VACUUM applies it
+        engine = tune_engine(create_engine(f"sqlite:///{DATABASE_PATH}"))
+        size_before = os.path.getsize(DATABASE_PATH)
+        with engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+            mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        engine.dispose()
+        print(f"📦 DB file: {size_before:,} → {os.path.getsize(DATABASE_PATH):,} bytes "
+              f"(auto_vacuum={mode})")
+        return
+
+    from app import app
+    from write_behind import write_behind
+
+    with app.app_context():
+        if command == "run":
+            days = int(sys.argv[2]) if len(sys.argv) > 2 else RETENTION_DAYS
+            if days <= 0:
+                print("Usage: python archive.py run <days>   (or set RETENTION_DAYS)")
+                sys.exit(1)
+            write_behind.flush()
+            conversations, messages, pages = archive_old_conversations(
+                days, progress=lambda c, m: print(f"  … {c} conversations, {m} messages"))
+            print(f"✅ Archived {conversations} conversations ({messages} messages), freed {pages} pages")
+        elif command == "status":
+            hot = db.session.execute(select(db.func.count(Conversation.id))).scalar()
+            print(f"🔥 Hot: {hot} conversations in {DATABASE_PATH}")
+            print(f"🗄️ Archive: {archive_stats()} in {ARCHIVE_DATABASE_PATH}")
+        else:
+            print("Usage: python archive.py [status|run [days]|vacuum]")
+            sys.exit(1)
+    write_behind.stop()
+
+
+if __name__ == "__main__":
+    main()
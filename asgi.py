@@ -0,0 +1,212 @@
+"""
+ASGI Entry Point - serves XeerGPT on asyncio
+/api/chat runs natively async (AsyncGroq / AsyncOpenAI / genai .aio clients
+plus an async DB session), so one process can hold hundreds of open SSE
+streams without pinning a thread per stream.
+Every other route is served by the existing Flask app mounted underneath.
+
+Run with:  uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import contextlib
+import json
+import traceback
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import archive
+from app import app as flask_app
+from context_builder import context_builder
+from db_engine import ENGINE_OPTIONS, tune_engine
+from llm import AVAILABLE_MODELS
+from models import db, Conversation
+from rate_limiter import RateLimited, client_id, user_limit_message, user_limiter
+from router import route_message_astream
+from usage_feed import usage_feed
+from usage_tracker import record_usage
+from write_behind import write_behind
+
+
+def _async_database_url():
+    """Same SQLite file the Flask app uses, but through the aiosqlite driver"""
+    with flask_app.app_context():
+        url = db.engine.url
+    return url.set(drivername="sqlite+aiosqlite")
+
+
+async_engine = create_async_engine(_async_database_url(), **ENGINE_OPTIONS)
+tune_engine(async_engine.sync_engine)
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+def _build_history(conversation_id, model, message):
+    """Context builder runs sync SQLAlchemy - call it from a worker thread"""
+    write_behind.wait_for(conversation_id)
+    with flask_app.app_context():
+        return context_builder.build(conversation_id, model, message)
+
+
+def _restore_archived(conversation_id):
+    """Archived conversations are read with sync SQLAlchemy too - call from a worker thread"""
+    with flask_app.app_context():
+        return archive.restore_archived(conversation_id)
+
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def _error_event(message, retry_after=None):
+    payload = {'type': 'error', 'message': message}
+    if retry_after is not None:
+        payload['retry_after'] = max(1, round(retry_after))
+    return _sse(payload)
+
+
+async def chat(request):
+    """Async twin of app.chat() - same request body and SSE events"""
+    try:
+        data = await request.json()
+        message = data.get("message", "")
+        conversation_id = data.get("conversation_id")
+        model = data.get("model", "llama-3.3-70b")  # Default model
+        cache = data.get("cache", True) is not False  # False on a resend - ask for a fresh answer
+
+        print(f"📨 [asgi] Message: '{message[:50]}...'")
+        print(f"🤖 [asgi] Model: {model}")
+
+        # Per-user limit (Config.RATE_LIMIT per hour) - refused before any DB or provider work
+        peer = request.client.host if request.client else None
+        retry_after = user_limiter.check(client_id(peer, request.headers.get("x-forwarded-for")))
+        if retry_after:
+            print(f"⛔ [asgi] User rate limit reached, retry in {retry_after:.0f}s")
+            return Response(
+                _error_event(user_limit_message(retry_after), retry_after),
+                media_type='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'Retry-After': str(max(1, round(retry_after)))}
+            )
+
+        history = []
+        async with AsyncSession() as session:
+            # Only create NEW conversation if conversation_id is None
+            if conversation_id is None:
+                title = message[:50] + "..." if len(message) > 50 else message
+                conversation = Conversation(title=title)
+                session.add(conversation)
+                await session.flush()
+                conversation_id = conversation.id
+                print(f"✨ Created NEW conversation: {conversation_id}")
+            else:
+                conversation = await session.get(Conversation, conversation_id)
+                if not conversation and await asyncio.to_thread(_restore_archived, conversation_id):
+                    # Archived by the retention policy - writing to it brings it back
+                    print(f"🗄️ [asgi] Restored archived conversation {conversation_id}")
+                    conversation = await session.get(Conversation, conversation_id)
+                if not conversation:
+                    print(f"❌ Conversation {conversation_id} not found!")
+                    return JSONResponse({
+                        "success": False,
+                        "response": "Conversation not found"
+                    }, status_code=404)
+                history = await asyncio.to_thread(_build_history, conversation_id, model, message)
+            await session.commit()
+
+        # Save user message (committed by the write-behind thread)
+        write_behind.save_message(conversation_id, "user", message)
+
+    except Exception as e:
+        print(f"ERROR in /api/chat (asgi): {str(e)}")
+        traceback.print_exc()
+        return JSONResponse({
+            "success": False,
+            "response": "I'm having trouble connecting right now. Please check your connection and try again."
+        }, status_code=500)
+
+    async def generate():
+        try:
+            stream = route_message_astream(message, model=model, history=history, cache=cache)
+
+            # Send conversation_id first
+            yield _sse({'type': 'conversation_id', 'conversation_id': conversation_id})
+
+            chunks = []
+            async for delta in stream:
+                chunks.append(delta)
+                yield _sse({'type': 'content', 'content': delta})
+            ai_response = "".join(chunks)
+
+            # Track usage ONCE per message - the tracker is sync, keep it off the loop.
+            # Cache hits never reached a provider, so they are free.
+            try:
+                served_model = stream.model or model  # fallback routing may have switched models
+                provider = AVAILABLE_MODELS.get(served_model, {}).get("provider", "unknown")
+                if provider in ("groq", "openrouter") and not stream.cached:
+                    count = await asyncio.to_thread(record_usage, provider)
+                    print(f"📊 Tracked usage for {provider} - Total: {count}")
+            except Exception as e:
+                print(f"⚠️ Usage tracking error: {e}")
+                traceback.print_exc()
+
+            # Queue AI message + conversation timestamp bump (written in the next batch)
+            write_behind.save_message(conversation_id, "assistant", ai_response)
+            write_behind.touch_conversation(conversation_id)
+
+            print(f"💾 Queued messages for conversation {conversation_id}")
+
+            yield _sse({'type': 'done', 'success': True})
+
+        except Exception as e:
+            error_str = str(e)
+            print(f"AI Error: {e}")
+            traceback.print_exc()
+
+            error_message = f"❌ {error_str}"
+            if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str or "quota" in error_str.lower():
+                error_message = f"⚠️ **{model}** has hit its rate limit. Please wait a moment or switch to a different model."
+
+            yield _error_event(error_message, e.retry_after if isinstance(e, RateLimited) else None)
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+async def usage_stream(request):
+    """Usage bar push updates - a snapshot, then a delta each time a counter moves. ASGI only: idle tabs cost no thread"""
+    return StreamingResponse(
+        usage_feed.aevents(),
+        media_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    # Drain queued chat writes before the process goes away
+    await asyncio.to_thread(write_behind.stop)
+    await async_engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/chat", chat, methods=["POST"]),
+        Route("/api/usage/stream", usage_stream, methods=["GET"]),
+        # Everything else (pages, history, usage, ...) goes to the Flask app
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
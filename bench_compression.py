@@ -0,0 +1,134 @@
+"""
+Compression Benchmark - DB size and history read latency, plain vs compressed
+Seeds a temp database with chat-like messages (short user prompts, long
+markdown replies with code blocks cut from this repo's own sources), times
+history page reads, then runs compress_messages.compress_existing() plus a
+VACUUM and measures both again.
+
+Run with:  python bench_compression.py [conversations] [zlib|zstd]     (default 1000, zlib)
+"""
+
+import glob
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from compress_messages import compress_existing
+from compression import COMPRESS_MIN_BYTES
+from db_engine import ENGINE_OPTIONS, tune_engine
+from migrations import upgrade
+from models import db, Conversation, Message
+from queries import message_page
+
+PER_CONVERSATION = 20
+PAGE_READS = 500
+PROSE = ["Here's how you can do that.", "The key part is the loop below.",
+         "This keeps the request path fast.", "Let me know if you want the async version.",
+         "Note the error handling around the provider call.", "You can tune the batch size."]
+
+
+def _corpus():
+    sources = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")))
+    return [open(path, encoding="utf-8").read() for path in sources]
+
+
+def _reply(rng, corpus):
+    """Markdown answer of roughly 0.5-6 KB with one or two code blocks"""
+    parts = [rng.choice(PROSE)]
+    for _ in range(rng.randint(1, 2)):
+        source = rng.choice(corpus)
+        start = rng.randrange(max(1, len(source) - 3000))
+        parts.append(f"```python\n{source[start:start + rng.randint(400, 3000)]}\n```")
+        parts.append(rng.choice(PROSE))
+    return "\n\n".join(parts)
+
+
+def _seed(conversations):
+    rng = random.Random(7)
+    corpus = _corpus()
+    start = datetime(2025, 1, 1)
+    db.session.execute(Conversation.__table__.insert(), [
+        {"id": i, "title": f"conversation {i}", "created_at": start, "updated_at": start}
+        for i in range(1, conversations + 1)
+    ])
+    rows = []
+    for n in range(conversations * PER_CONVERSATION):
+        user = n % 2 == 0
+        rows.append({"conversation_id": n // PER_CONVERSATION + 1,
+                     "role": "user" if user else "assistant",
+                     "content": f"How do I fix this? step {n}" if user else _reply(rng, corpus),
+                     "timestamp": start + timedelta(seconds=n)})
+    db.session.execute(Message.__table__.insert(), rows)
+    db.session.commit()
+
+
+def _vacuum():
+    db.session.remove()
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def _read_pages(conversations):
+    """Latency of one 50-message history page, decoded through Message.content"""
+    rng = random.Random(11)
+    timings = []
+    for _ in range(PAGE_READS):
+        started = time.perf_counter()
+        messages = db.session.execute(message_page(rng.randint(1, conversations))).scalars().all()
+        sum(len(m.content) for m in messages)
+        timings.append((time.perf_counter() - started) * 1000)
+        db.session.expire_all()
+    return statistics.median(timings), statistics.quantiles(timings, n=20)[-1]
+
+
+def main():
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    codec = sys.argv[2] if len(sys.argv) > 2 else "zlib"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = ENGINE_OPTIONS
+        db.init_app(app)
+
+        with app.app_context():
+            tune_engine(db.engine)
+            db.create_all()
+            upgrade(db.engine)
+
+            print(f"🏁 Seeding {conversations * PER_CONVERSATION:,} messages...")
+            _seed(conversations)
+            _vacuum()
+            plain_size = os.path.getsize(path)
+            plain_p50, plain_p95 = _read_pages(conversations)
+
+            print(f"🗜️ Compressing bodies >= {COMPRESS_MIN_BYTES} bytes with {codec}...")
+            started = time.perf_counter()
+            rows, before, after = compress_existing(db.engine, codec)
+            took = time.perf_counter() - started
+            _vacuum()
+            packed_size = os.path.getsize(path)
+            packed_p50, packed_p95 = _read_pages(conversations)
+
+            db.session.remove()
+            db.engine.dispose()
+
+    print(f"  {rows:,} rows compressed in {took:.1f}s ({before:,} → {after:,} body bytes, "
+          f"{before / max(after, 1):.1f}x)")
+    print(f"\n{'':12} {'DB size':>12} {'page p50 ms':>12} {'page p95 ms':>12}")
+    print(f"{'plain':12} {plain_size:12,} {plain_p50:12.2f} {plain_p95:12.2f}")
+    print(f"{codec:12} {packed_size:12,} {packed_p50:12.2f} {packed_p95:12.2f}")
+    print(f"\n📈 DB file {plain_size / packed_size:.2f}x smaller, "
+          f"page reads {packed_p50 - plain_p50:+.2f} ms at p50")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Query Plan Benchmark - sidebar and history queries before / after migrations
+Builds a temp database shaped like a busy install (no indexes, as older
+chat_history.db files are), EXPLAINs and times the exact statements from
+queries.py, runs the migrations, then does it again. Exits non-zero if any
+query still needs a full table scan or a temp B-tree sort afterwards.
+
+Run with:  python bench_query_plans.py [conversations] [messages_per_conversation]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import sqlite
+
+from db_engine import tune_engine
+from migrations import upgrade
+from models import db, Conversation, Message
+from queries import conversation_page, message_page
+
+REPEAT = 200
+TIME_BUDGET = 2.0       # Seconds per query - unindexed runs stop early
+
+
+def _seed(engine, conversations, per_conversation):
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # Start from the pre-migration schema: tables only
+        for table in (Message.__table__, Conversation.__table__):
+            for index in table.indexes:
+                conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+        start = datetime(2025, 1, 1)
+        conn.execute(Conversation.__table__.insert(), [
+            {"id": i, "title": f"conversation {i}", "created_at": start,
+             "updated_at": start + timedelta(minutes=(i * 7919) % conversations)}
+            for i in range(1, conversations + 1)
+        ])
+        # Interleaved like real traffic, so one conversation's rows are spread out
+        rows = []
+        for n in range(per_conversation):
+            for i in range(1, conversations + 1):
+                rows.append({"conversation_id": i, "role": "user" if n % 2 == 0 else "assistant",
+                             "content": f"message {n} " * 15,
+                             "timestamp": start + timedelta(seconds=n * conversations + i)})
+        conn.execute(Message.__table__.insert(), rows)
+
+
+def _cases(conversations, per_conversation):
+    middle = datetime(2025, 1, 1) + timedelta(minutes=conversations // 2)
+    target = conversations // 3
+    cursor = datetime(2025, 1, 1) + timedelta(seconds=(per_conversation // 2) * conversations + target)
+    return [
+        ("sidebar first page", conversation_page(limit=50)),
+        ("sidebar older page", conversation_page(before=middle, before_id=conversations, limit=50)),
+        ("history latest page", message_page(target, limit=50)),
+        ("history older page", message_page(target, before=cursor, before_id=10**9, limit=50)),
+    ]
+
+
+def _sql(stmt):
+    return str(stmt.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def _measure(engine, cases):
+    results = []
+    with engine.connect() as conn:
+        for label, stmt in cases:
+            sql = _sql(stmt)
+            plan = [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+            runs = 0
+            start = time.perf_counter()
+            while runs < REPEAT and (runs == 0 or time.perf_counter() - start < TIME_BUDGET):
+                conn.exec_driver_sql(sql).all()
+                runs += 1
+            ms = (time.perf_counter() - start) * 1000 / runs
+            # "SCAN t USING INDEX" walks an index in order; a bare "SCAN t" reads the whole table
+            bad = [step for step in plan
+                   if (step.startswith("SCAN") and "USING" not in step) or "TEMP B-TREE" in step]
+            results.append((label, ms, plan, bad))
+    return results
+
+
+def _report(title, results):
+    print(f"\n{title}")
+    for label, ms, plan, bad in results:
+        flag = "❌" if bad else "✅"
+        print(f"  {flag} {label:22} {ms:8.3f} ms")
+        for step in plan:
+            print(f"       {step}")
+
+
+def main():
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    per_conversation = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"🏁 {conversations} conversations x {per_conversation} messages, up to {REPEAT} runs per query")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = tune_engine(create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}"))
+        _seed(engine, conversations, per_conversation)
+        cases = _cases(conversations, per_conversation)
+
+        before = _measure(engine, cases)
+        _report("Before migrations (no indexes)", before)
+        upgrade(engine)
+        after = _measure(engine, cases)
+        _report("After migrations", after)
+        engine.dispose()
+
+    print()
+    for (label, old_ms, _, _), (_, new_ms, _, _) in zip(before, after):
+        print(f"📈 {label:22} {old_ms / new_ms:7.1f}x faster")
+    if any(bad for _, _, _, bad in after):
+        print("❌ Some queries still scan a table or sort in a temp B-tree")
+        sys.exit(1)
+    print("✅ All sidebar/history queries use index scans")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Search Benchmark - /api/search latency on a large history
+Seeds a temp database (through the real migrations, so the FTS triggers do
+the indexing) with synthetic chat messages, then times search_messages()
+for rare, common, prefix and multi-term queries.
+
+Run with:  python bench_search.py [messages]     (default 1,000,000)
+"""
+
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+from db_engine import ENGINE_OPTIONS, tune_engine
+from migrations import upgrade
+from models import db, Conversation, Message
+from search import search_messages
+
+TARGET_MS = 50
+RUNS = 30
+PER_CONVERSATION = 40
+
+# Zipf-ish vocabulary: a few very common words, a long tail of rare ones
+COMMON = ["the", "to", "and", "a", "of", "in", "is", "you", "that", "it", "for", "with", "this", "can"]
+TOPICS = ["python", "flask", "sqlite", "database", "index", "query", "function", "error", "async",
+          "stream", "token", "model", "cache", "thread", "react", "docker", "deploy", "server"]
+RARE = [f"term{i}" for i in range(20000)]
+
+QUERIES = [
+    ("rare term", "term12345"),
+    ("rare prefix", "term123*"),
+    ("topic term", "sqlite"),
+    ("common word", "the"),
+    ("prefix", "data*"),
+    ("two terms", "python async"),
+    ("three terms + prefix", "flask cache thr*"),
+]
+
+
+def _sentence(rng):
+    words = []
+    for _ in range(rng.randint(8, 60)):
+        roll = rng.random()
+        if roll < 0.55:
+            words.append(rng.choice(COMMON))
+        elif roll < 0.9:
+            words.append(rng.choice(TOPICS))
+        else:
+            words.append(rng.choice(RARE))
+    return " ".join(words)
+
+
+def _seed(count):
+    rng = random.Random(42)
+    start = datetime(2025, 1, 1)
+    conversations = max(1, count // PER_CONVERSATION)
+    db.session.execute(Conversation.__table__.insert(), [
+        {"id": i, "title": f"conversation {i}", "created_at": start, "updated_at": start}
+        for i in range(1, conversations + 1)
+    ])
+    batch = []
+    for n in range(count):
+        batch.append({"conversation_id": n % conversations + 1,
+                      "role": "user" if n % 2 == 0 else "assistant",
+                      "content": _sentence(rng),
+                      "timestamp": start + timedelta(seconds=n)})
+        if len(batch) == 50000:
+            db.session.execute(Message.__table__.insert(), batch)
+            db.session.commit()
+            batch = []
+            print(f"  … {n + 1:,} messages")
+    if batch:
+        db.session.execute(Message.__table__.insert(), batch)
+    db.session.commit()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = ENGINE_OPTIONS
+        db.init_app(app)
+
+        with app.app_context():
+            tune_engine(db.engine)
+            db.create_all()
+            upgrade(db.engine)
+
+            print(f"🏁 Seeding {count:,} messages (indexed by the FTS triggers)...")
+            started = time.perf_counter()
+            _seed(count)
+            print(f"  seeded in {time.perf_counter() - started:.1f}s")
+            db.session.execute(db.text("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')"))
+            db.session.commit()
+
+            print(f"\n{'query':24} {'p50 ms':>8} {'p95 ms':>8}  hits  ranking")
+            worst = 0.0
+            for label, query in QUERIES:
+                timings = []
+                for run in range(RUNS):
+                    started = time.perf_counter()
+                    page, _, ranking = search_messages(query, limit=20, offset=(run % 3) * 20)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    if run == 0:
+                        results, first_ranking = page, ranking
+                p50 = statistics.median(timings)
+                p95 = statistics.quantiles(timings, n=20)[-1]
+                worst = max(worst, p95)
+                flag = "✅" if p95 <= TARGET_MS else "⚠️"
+                print(f"{flag} {label:22} {p50:8.2f} {p95:8.2f}  {len(results):4}  {first_ranking}")
+
+            db.session.remove()
+            db.engine.dispose()
+
+    print(f"\n📈 Worst p95: {worst:.2f} ms (target {TARGET_MS} ms)")
+
+
+if __name__ == "__main__":
+    main()
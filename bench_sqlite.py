@@ -0,0 +1,108 @@
+"""
+SQLite Benchmark - concurrent chat-write throughput, default vs tuned engine
+Each run uses a fresh temp database with the app's tables. WRITERS threads
+insert messages (one transaction each, like the chat path) while READERS
+threads poll a usage-style aggregate, the way open tabs hit /api/usage.
+
+Run with:  python bench_sqlite.py [writers] [messages_per_writer]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import OperationalError
+
+from db_engine import ENGINE_OPTIONS, pragma_report, tune_engine
+from models import db, Conversation, Message
+
+READERS = 4
+
+
+def _engine(path, tuned):
+    url = f"sqlite:///{path}"
+    if not tuned:
+        # What app.py used before: rollback journal, synchronous=FULL, 5s default busy handler
+        return create_engine(url, connect_args={"check_same_thread": False})
+    return tune_engine(create_engine(url, **ENGINE_OPTIONS))
+
+
+def run(tuned, writers, per_writer):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _engine(os.path.join(tmp, "bench.db"), tuned)
+        db.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(Conversation.__table__.insert(), [{"title": f"c{i}"} for i in range(writers)])
+
+        errors = []
+        stop = threading.Event()
+        reads = [0]
+
+        def write(conversation_id):
+            for i in range(per_writer):
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(Message.__table__.insert().values(
+                            conversation_id=conversation_id, role="user", content=f"message {i} " * 20))
+                except OperationalError as e:
+                    errors.append(e)
+
+        def read():
+            query = select(Message.conversation_id, func.count()).group_by(Message.conversation_id)
+            while not stop.is_set():
+                try:
+                    with engine.connect() as conn:
+                        conn.execute(query).all()
+                    reads[0] += 1
+                except OperationalError as e:
+                    errors.append(e)
+
+        readers = [threading.Thread(target=read) for _ in range(READERS)]
+        threads = [threading.Thread(target=write, args=(i + 1,)) for i in range(writers)]
+        for t in readers:
+            t.start()
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for t in readers:
+            t.join()
+
+        with engine.connect() as conn:
+            written = conn.execute(select(func.count()).select_from(Message.__table__)).scalar()
+            pragmas = pragma_report(conn)
+        engine.dispose()
+
+    return {
+        "written": written,
+        "seconds": elapsed,
+        "writes_per_sec": written / elapsed,
+        "reads": reads[0],
+        "lock_errors": len(errors),
+        "journal_mode": pragmas["journal_mode"],
+        "synchronous": pragmas["synchronous"],
+    }
+
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    per_writer = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print(f"🏁 {writers} writer threads x {per_writer} messages, {READERS} polling readers")
+    results = {}
+    for label, tuned in (("default", False), ("tuned", True)):
+        results[label] = r = run(tuned, writers, per_writer)
+        print(f"  {label:8} {r['writes_per_sec']:8.0f} writes/s  {r['seconds']:6.2f}s  "
+              f"reads={r['reads']:<6} lock_errors={r['lock_errors']:<4} "
+              f"journal={r['journal_mode']} synchronous={r['synchronous']}")
+    speedup = results["tuned"]["writes_per_sec"] / results["default"]["writes_per_sec"]
+    print(f"📈 Tuned write throughput: {speedup:.1f}x default")
+
+
+if __name__ == "__main__":
+    main()
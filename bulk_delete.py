@@ -0,0 +1,186 @@
+"""
+Bulk Delete - set-based conversation deletes and a batched history clear
+delete_conversation() removes one conversation with three DELETE statements
+(no ORM loading of child rows). clear_history() walks conversations in
+chunks and deletes their messages in small batches, each in its own short
+transaction, so chat writes keep getting the SQLite write lock in between.
+A clear can run as a background ClearJob that reports progress; finished
+jobs stay pollable for FINISHED_JOB_TTL seconds and are then forgotten.
+"""
+
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, select
+
+from context_builder import context_builder
+from models import db, Conversation, ConversationSummary, Message
+
+CONVERSATIONS_PER_BATCH = 50
+MESSAGES_PER_BATCH = 2000
+BATCH_PAUSE = 0.005     # Seconds between batches - lets queued writers in
+FINISHED_JOB_TTL = 600  # Seconds a done / failed ClearJob can still be polled
+
+
+def delete_conversation(conversation_id):
+    """Delete one conversation and its rows; False if it didn't exist (needs an app context)"""
+    db.session.execute(delete(Message).where(Message.conversation_id == conversation_id))
+    db.session.execute(delete(ConversationSummary).where(ConversationSummary.conversation_id == conversation_id))
+    deleted = db.session.execute(delete(Conversation).where(Conversation.id == conversation_id)).rowcount
+    db.session.commit()
+    context_builder.invalidate(conversation_id)
+    return deleted > 0
+
+
+def _delete_messages(*criteria):
+    """Delete matching messages MESSAGES_PER_BATCH at a time; returns rows deleted"""
+    total = 0
+    while True:
+        batch = (select(Message.id)
+                 .where(*criteria)
+                 .limit(MESSAGES_PER_BATCH)
+                 .scalar_subquery())
+        deleted = db.session.execute(delete(Message).where(Message.id.in_(batch))).rowcount
+        db.session.commit()
+        total += deleted
+        if deleted < MESSAGES_PER_BATCH:
+            return total
+        time.sleep(BATCH_PAUSE)
+
+
+def clear_history(progress=None):
+    """
+    Delete every conversation that existed when the clear started, in short
+    transactions (needs an app context). progress(conversations, messages)
+    is called after each chunk with running totals.
+    """
+    last_id = db.session.execute(select(func.max(Conversation.id))).scalar() or 0
+    last_message_id = db.session.execute(select(func.max(Message.id))).scalar() or 0
+    conversations_deleted = 0
+    messages_deleted = 0
+    after_id = 0
+
+    while True:
+        conversation_ids = db.session.execute(
+            select(Conversation.id)
+            .where(Conversation.id > after_id, Conversation.id <= last_id)
+            .order_by(Conversation.id)
+            .limit(CONVERSATIONS_PER_BATCH)
+        ).scalars().all()
+        if not conversation_ids:
+            break
+        after_id = conversation_ids[-1]
+
+        messages_deleted += _delete_messages(Message.conversation_id.in_(conversation_ids))
+        db.session.execute(delete(ConversationSummary)
+                           .where(ConversationSummary.conversation_id.in_(conversation_ids)))
+        conversations_deleted += db.session.execute(
+            delete(Conversation).where(Conversation.id.in_(conversation_ids))
+        ).rowcount
+        db.session.commit()
+
+        for conversation_id in conversation_ids:
+            context_builder.invalidate(conversation_id)
+        if progress:
+            progress(conversations_deleted, messages_deleted)
+        time.sleep(BATCH_PAUSE)
+
+    # Stragglers whose conversation row was already gone
+    messages_deleted += _delete_messages(
+        Message.id <= last_message_id,
+        Message.conversation_id.not_in(select(Conversation.id))
+    )
+    if progress:
+        progress(conversations_deleted, messages_deleted)
+    return conversations_deleted, messages_deleted
+
+
+class ClearJob:
+    """Background clear_history() run with pollable progress"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "pending"
+        self.total_conversations = 0
+        self.total_messages = 0
+        self.conversations_deleted = 0
+        self.messages_deleted = 0
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    def _progress(self, conversations, messages):
+        self.conversations_deleted = conversations
+        self.messages_deleted = messages
+
+    def run(self):
+        from app import app  # Import here to avoid circular dependency
+
+        self.status = "running"
+        self.started_at = datetime.now(timezone.utc)
+        try:
+            with app.app_context():
+                self.total_conversations = db.session.execute(select(func.count(Conversation.id))).scalar()
+                self.total_messages = db.session.execute(select(func.count(Message.id))).scalar()
+                clear_history(self._progress)
+            self.status = "done"
+            print(f"🧹 Clear job {self.id}: deleted {self.conversations_deleted} conversations, "
+                  f"{self.messages_deleted} messages")
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"❌ Clear job {self.id} failed: {e}")
+            traceback.print_exc()
+        finally:
+            self.finished_at = datetime.now(timezone.utc)
+
+    def to_dict(self):
+        percent = 100.0 if self.status == "done" else (
+            round(100 * self.messages_deleted / self.total_messages, 1) if self.total_messages else 0.0)
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total_conversations": self.total_conversations,
+            "total_messages": self.total_messages,
+            "conversations_deleted": self.conversations_deleted,
+            "messages_deleted": self.messages_deleted,
+            "percent": percent,
+            "error": self.error,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _evict_finished_jobs():
+    """Forget jobs that finished more than FINISHED_JOB_TTL ago (call with _jobs_lock held)"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=FINISHED_JOB_TTL)
+    for job_id in [job_id for job_id, job in _jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]:
+        del _jobs[job_id]
+
+
+def start_clear_job():
+    """Start a background clear, or return the one already running"""
+    with _jobs_lock:
+        _evict_finished_jobs()
+        for job in _jobs.values():
+            if job.status in ("pending", "running"):
+                return job
+        job = ClearJob()
+        _jobs[job.id] = job
+    threading.Thread(target=job.run, name=f"clear-{job.id}", daemon=True).start()
+    return job
+
+
+def get_clear_job(job_id):
+    """The job, or None if it is unknown or finished more than FINISHED_JOB_TTL ago"""
+    with _jobs_lock:
+        _evict_finished_jobs()
+        return _jobs.get(job_id)
@@ -0,0 +1,180 @@
+"""
+Chat Transfer - streaming NDJSON export and import of chat history
+Export is one JOINed SELECT walked with yield_per, so only EXPORT_BATCH rows
+are in memory however large the history is. Each conversation line is
+followed by its messages:
+
+    {"type": "header", "format": "xeergpt-ndjson", "version": 1, ...}
+    {"type": "conversation", "id": 7, "title": "...", "created_at": "...", "updated_at": "..."}
+    {"type": "message", "conversation_id": 7, "role": "user", "content": "...", "timestamp": "..."}
+
+Conversations moved to the archive by the retention policy (archive.py)
+follow the hot ones, marked "archived": true, so an export is the whole
+history. A full export's header says how many ("archived_conversations").
+
+Import reads the same format line by line and inserts IMPORT_BATCH rows at a
+time with executemany, one short transaction per batch. Conversations get
+new ids, so importing never overwrites existing history.
+Both must run inside a Flask app context.
+"""
+
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select
+
+import archive
+from compression import compress_body
+from models import db, Conversation, Message
+from queries import parse_timestamp
+
+FORMAT = "xeergpt-ndjson"
+FORMAT_VERSION = 1
+EXPORT_BATCH = 500
+IMPORT_BATCH = 1000
+READ_BUFFER = 1 << 16     # Bytes buffered from the upload stream
+ROLES = ("user", "assistant")
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _line(record):
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def export_ndjson(conversation_id=None):
+    """Yield the export as NDJSON lines (run under stream_with_context)"""
+    header = {"type": "header", "format": FORMAT, "version": FORMAT_VERSION,
+              "exported_at": datetime.now(timezone.utc).isoformat()}
+    if conversation_id is None:
+        header["archived_conversations"] = archive.archive_stats()["conversations"]
+    yield _line(header)
+
+    stmt = (select(Conversation.id, Conversation.title, Conversation.created_at,
+                   Conversation.updated_at, Message.role, Message.content, Message.timestamp,
+                   Message.id.label("message_id"))
+            .outerjoin(Message, Message.conversation_id == Conversation.id)
+            .order_by(Conversation.id, Message.id))
+    if conversation_id is not None:
+        stmt = stmt.where(Conversation.id == conversation_id)
+
+    current = None
+    hot_ids = set()
+    for row in db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH)):
+        if row.id != current:
+            current = row.id
+            yield _line({"type": "conversation", "id": row.id, "title": row.title,
+                         "created_at": _iso(row.created_at), "updated_at": _iso(row.updated_at)})
+        if row.message_id is not None:
+            yield _line({"type": "message", "conversation_id": row.id, "role": row.role,
+                         "content": row.content, "timestamp": _iso(row.timestamp)})
+        hot_ids.add(row.id)
+
+    for row, messages in archive.archived_conversations(conversation_id):
+        if row.id in hot_ids:
+            continue    # Stale copy of a conversation that is still hot
+        yield _line({"type": "conversation", "id": row.id, "title": row.title, "archived": True,
+                     "created_at": _iso(row.created_at), "updated_at": _iso(row.updated_at)})
+        for _, role, content, timestamp in messages:
+            yield _line({"type": "message", "conversation_id": row.id, "role": role,
+                         "content": content, "timestamp": timestamp})
+
+
+class _Importer:
+    """Buffers parsed lines and writes them IMPORT_BATCH rows at a time"""
+
+    def __init__(self):
+        self.id_map = {}            # Exported conversation id -> new id (after its batch is written)
+        self.seen = set()           # Every exported conversation id read so far
+        self.conversations = []     # (exported id, row)
+        self.messages = []          # (exported conversation id, row)
+        self.conversations_imported = 0
+        self.messages_imported = 0
+
+    def add_conversation(self, record):
+        exported_id = record.get("id")
+        if exported_id is None or exported_id in self.seen:
+            raise Exception(f"Conversation id {exported_id!r} missing or repeated")
+        self.seen.add(exported_id)
+        created_at = parse_timestamp(record.get("created_at")) or datetime.now(timezone.utc)
+        self.conversations.append((exported_id, {
+            "title": (record.get("title") or "Imported chat")[:200],
+            "created_at": created_at,
+            "updated_at": parse_timestamp(record.get("updated_at")) or created_at
+        }))
+
+    def add_message(self, record):
+        exported_id = record.get("conversation_id")
+        if exported_id not in self.seen:
+            raise Exception(f"Message for unknown conversation {exported_id!r}")
+        if record.get("role") not in ROLES:
+            raise Exception(f"Invalid role {record.get('role')!r}")
+        content = record.get("content")
+        if not isinstance(content, str):
+            raise Exception("Message content must be a string")
+        blob = compress_body(content)
+        self.messages.append((exported_id, {
+            "role": record["role"],
+            "content": "" if blob is not None else content,
+            "content_z": blob,
+            "timestamp": parse_timestamp(record.get("timestamp")) or datetime.now(timezone.utc)
+        }))
+
+    def pending(self):
+        return len(self.conversations) + len(self.messages)
+
+    def flush(self):
+        if self.conversations:
+            new_ids = db.session.execute(
+                insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True),
+                [row for _, row in self.conversations]
+            ).scalars().all()
+            for (exported_id, _), new_id in zip(self.conversations, new_ids):
+                self.id_map[exported_id] = new_id
+        if self.messages:
+            db.session.execute(insert(Message.__table__), [
+                {**row, "conversation_id": self.id_map[exported_id]}
+                for exported_id, row in self.messages
+            ])
+        db.session.commit()
+        self.conversations_imported += len(self.conversations)
+        self.messages_imported += len(self.messages)
+        self.conversations = []
+        self.messages = []
+
+
+def import_ndjson(lines):
+    """
+    Import NDJSON lines (str or bytes). Returns (conversations, messages)
+    imported; on a bad line raises Exception naming it, after committing
+    every batch before it.
+    """
+    importer = _Importer()
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            kind = record.get("type") if isinstance(record, dict) else None
+            if kind == "header":
+                if record.get("format") != FORMAT or record.get("version", 0) > FORMAT_VERSION:
+                    raise Exception(f"Unsupported export format {record.get('format')!r} "
+                                    f"v{record.get('version')}")
+            elif kind == "conversation":
+                importer.add_conversation(record)
+            elif kind == "message":
+                importer.add_message(record)
+            else:
+                raise Exception(f"Unknown record type {kind!r}")
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Line {number}: {e} (imported {importer.conversations_imported} "
+                            f"conversations, {importer.messages_imported} messages before it)")
+        if importer.pending() >= IMPORT_BATCH:
+            importer.flush()
+    importer.flush()
+    return importer.conversations_imported, importer.messages_imported
@@ -0,0 +1,87 @@
+"""
+Compress Messages - one-shot migration of existing bodies to compressed storage
+Walks messages in id order and rewrites every plain body of at least
+COMPRESS_MIN_BYTES into content_z (batched executemany, one short
+transaction per batch). The FTS triggers are switched to their
+message_body() variant first, so search keeps indexing the same plain
+text. Safe to re-run or interrupt.
+
+Run with:  python compress_messages.py [zlib|zstd] [--vacuum]
+"""
+
+import os
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+
+from compression import COMPRESSION, COMPRESS_MIN_BYTES, compress_body
+from db_engine import tune_engine
+from migrations import DATABASE_PATH, install_fts_triggers, upgrade
+
+BATCH_SIZE = 500
+
+_SELECT_SQL = text("""
+    SELECT id, content FROM messages
+    WHERE id > :after AND content_z IS NULL AND length(CAST(content AS BLOB)) >= :min_bytes
+    ORDER BY id LIMIT :limit
+""")
+_UPDATE_SQL = text("UPDATE messages SET content = '', content_z = :blob WHERE id = :id")
+
+
+def compress_existing(engine, codec="zlib", batch_size=BATCH_SIZE, progress=None):
+    """Compress plain bodies in place; returns (rows, bytes_before, bytes_after)"""
+    with engine.begin() as conn:
+        install_fts_triggers(conn, use_message_body=True)   # Compressed rows can only be indexed through it
+    after = 0
+    rows = bytes_before = bytes_after = 0
+    while True:
+        with engine.begin() as conn:
+            batch = conn.execute(_SELECT_SQL, {"after": after, "min_bytes": COMPRESS_MIN_BYTES,
+                                               "limit": batch_size}).all()
+            if not batch:
+                break
+            after = batch[-1].id
+            updates = []
+            for row in batch:
+                blob = compress_body(row.content, codec)
+                if blob is None:
+                    continue
+                updates.append({"id": row.id, "blob": blob})
+                bytes_before += len(row.content.encode("utf-8"))
+                bytes_after += len(blob)
+            if updates:
+                conn.execute(_UPDATE_SQL, updates)
+            rows += len(updates)
+        if progress:
+            progress(rows, bytes_before, bytes_after)
+    return rows, bytes_before, bytes_after
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    codec = args[0] if args else (COMPRESSION if COMPRESSION in ("zlib", "zstd") else "zlib")
+    engine = tune_engine(create_engine(f"sqlite:///{DATABASE_PATH}"))
+    upgrade(engine)  # content_z column + FTS view
+
+    size_before = os.path.getsize(DATABASE_PATH)
+    print(f"🗜️ Compressing message bodies >= {COMPRESS_MIN_BYTES} bytes with {codec}...")
+    started = time.perf_counter()
+    rows, before, after = compress_existing(
+        engine, codec,
+        progress=lambda n, b, a: print(f"  … {n} rows, {b:,} → {a:,} bytes")
+    )
+    print(f"✅ Compressed {rows} messages in {time.perf_counter() - started:.1f}s: "
+          f"{before:,} → {after:,} bytes")
+
+    if "--vacuum" in sys.argv:
+        # Freed pages only go back to the OS after a VACUUM
+        with engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")  # VACUUM output sits in the WAL
+        print(f"📦 DB file: {size_before:,} → {os.path.getsize(DATABASE_PATH):,} bytes")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
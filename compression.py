@@ -0,0 +1,74 @@
+"""
+Compression - optional compressed storage for message bodies
+With MESSAGE_COMPRESSION=zlib (or zstd, when the zstandard package is
+installed) bodies of at least COMPRESS_MIN_BYTES are stored compressed in
+messages.content_z and messages.content is left empty. Message.content
+(a hybrid property in models.py) hides this from the rest of the app.
+The codec is detected from the blob's magic bytes, so rows written under
+different settings can always be read back.
+message_body() is also registered as a SQL function on every connection
+(db_engine.py) for the FTS index and SQL-side reads.
+"""
+
+import os
+import zlib
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+COMPRESSION = os.getenv("MESSAGE_COMPRESSION", "off").lower()     # off | zlib | zstd
+COMPRESS_MIN_BYTES = int(os.getenv("MESSAGE_COMPRESS_MIN_BYTES", 1024))
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+if COMPRESSION == "zstd" and not ZSTD_AVAILABLE:
+    print("⚠️ MESSAGE_COMPRESSION=zstd but zstandard is not installed - using zlib")
+    COMPRESSION = "zlib"
+
+if ZSTD_AVAILABLE:
+    _zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+
+
+def compress_body(text: str, codec: str = None):
+    """Compressed blob for text, or None when it should be stored as plain text"""
+    codec = COMPRESSION if codec is None else codec
+    if codec not in ("zlib", "zstd") or text is None:
+        return None
+    raw = text.encode("utf-8")
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return None
+    blob = _compress(raw, codec)
+    # Incompressible text (already-compressed pastes etc.) stays plain
+    return blob if len(blob) < len(raw) else None
+
+
+def pack_text(text: str) -> bytes:
+    """Always-compressed blob with the best available codec (archive rows)"""
+    return _compress(text.encode("utf-8"), "zstd" if ZSTD_AVAILABLE else "zlib")
+
+
+def _compress(raw: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return _zstd_compressor.compress(raw)
+    return zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decompress_body(blob: bytes) -> str:
+    if blob[:4] == _ZSTD_MAGIC:
+        if not ZSTD_AVAILABLE:
+            raise Exception("Message was stored with zstd but zstandard is not installed")
+        return _zstd_decompressor.decompress(blob).decode("utf-8")
+    return zlib.decompress(blob).decode("utf-8")
+
+
+def message_body(content, content_z):
+    """Plain text of a stored message (also the message_body() SQL function)"""
+    if content_z is not None:
+        return decompress_body(content_z)
+    return content
@@ -13,6 +13,7 @@ class Config:
     CHATBOT_VERSION = "1.0.0"
     MAX_MESSAGE_LENGTH = 1000
     MAX_HISTORY_LENGTH = 50
+    CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 3000))  # Prior turns sent with each message
     
     # UI Configuration
     THEME_COLORS = {
@@ -42,7 +43,7 @@ class Config:
     ]
     
     # API Settings
-    RATE_LIMIT = 100  # Requests per hour per user
+    RATE_LIMIT = int(os.environ.get('RATE_LIMIT', 0))  # Requests per hour per client IP (0 = off; needs TRUSTED_PROXY_HOPS behind a proxy)
     
     @staticmethod
     def init_app(app):
@@ -0,0 +1,137 @@
+"""
+Context Builder - assembles prior turns for multi-turn chat
+Loads a conversation's Message rows, estimates tokens per model family and
+packs the most recent turns into Config.CONTEXT_TOKEN_BUDGET. Turns already
+folded into a ConversationSummary are replaced by that summary.
+Turns (with their token counts) live in memory.conversation_memory; the
+chat path records each saved message there, so warm conversations are
+packed without a DB round-trip. Cold ones are loaded once.
+Must be called inside a Flask app context.
+"""
+
+from config import Config
+from llm import AVAILABLE_MODELS
+from memory import conversation_memory
+from models import db, ConversationSummary, Message
+
+MESSAGE_OVERHEAD_TOKENS = 4     # role + separators per chat message
+
+# Average characters per token for each tokenizer family (no tokenizer libs needed)
+CHARS_PER_TOKEN = {
+    "llama": 3.8,
+    "qwen": 3.3,
+    "deepseek": 3.5,
+    "gpt-oss": 4.0,
+    "gemini": 4.0,
+    "default": 3.5
+}
+
+
+def model_family(model: str) -> str:
+    """Tokenizer family for a model key from AVAILABLE_MODELS"""
+    model_id = AVAILABLE_MODELS.get(model, {}).get("model_id", model).lower()
+    for family in ("llama", "qwen", "deepseek", "gpt-oss", "gemini"):
+        if family in model_id:
+            return family
+    # Hermes is a Llama fine-tune
+    if "hermes" in model_id:
+        return "llama"
+    return "default"
+
+
+def count_tokens(text: str, family: str = "default") -> int:
+    """Estimated token count of one chat message for the given family"""
+    ratio = CHARS_PER_TOKEN.get(family, CHARS_PER_TOKEN["default"])
+    return int(len(text) / ratio) + 1 + MESSAGE_OVERHEAD_TOKENS
+
+
+def _turn_tokens(turn, family):
+    """Token estimate for a stored turn, computed once per family"""
+    tokens = turn.tokens.get(family)
+    if tokens is None:
+        tokens = turn.tokens[family] = count_tokens(turn.content, family)
+    return tokens
+
+
+class ContextBuilder:
+    """Budgeted packing over the conversation memory store"""
+
+    def __init__(self, memory=conversation_memory):
+        self.memory = memory
+
+    def _refresh(self, conversation_id):
+        """Summary + unsummarized turns; the DB is only read for cold conversations"""
+        snapshot = self.memory.snapshot(conversation_id)
+        if snapshot is None:
+            stored = db.session.get(ConversationSummary, conversation_id)
+            through_id = stored.covers_through_id if stored else 0
+            rows = (Message.query
+                    .filter(Message.conversation_id == conversation_id, Message.id > through_id)
+                    .order_by(Message.id.desc())
+                    .with_entities(Message.id, Message.role, Message.content)
+                    .limit(Config.MAX_HISTORY_LENGTH)
+                    .all())
+            rows.reverse()
+            self.memory.load(conversation_id, rows, stored.summary if stored else None, through_id)
+            snapshot = self.memory.snapshot(conversation_id)
+            if snapshot is None:
+                return None, []
+        summary, through_id, turns = snapshot
+        return summary, [turn for turn in turns if turn.id > through_id]
+
+    def build(self, conversation_id, model, message="", budget=None):
+        """
+        Most recent turns that fit the token budget, oldest first,
+        as [{"role": ..., "content": ...}]. The new message's own tokens
+        count against the budget.
+        """
+        if conversation_id is None:
+            return []
+        budget = Config.CONTEXT_TOKEN_BUDGET if budget is None else budget
+        family = model_family(model)
+        remaining = budget - count_tokens(message, family)
+
+        summary, turns = self._refresh(conversation_id)
+        summary_message = None
+        if summary:
+            summary_message = {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+            remaining -= count_tokens(summary_message["content"], family)
+
+        packed = []
+        for turn in reversed(turns):
+            tokens = _turn_tokens(turn, family)
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            packed.append({"role": turn.role, "content": turn.content})
+        packed.reverse()
+
+        # Providers expect the history to open with a user turn
+        while packed and packed[0]["role"] != "user":
+            packed.pop(0)
+        if summary_message:
+            packed.insert(0, summary_message)
+        return packed
+
+    def record(self, conversation_id, message_id, role, content):
+        """Chat hook: keep warm conversations current without re-reading the DB"""
+        self.memory.append(conversation_id, message_id, role, content)
+
+    def set_summary(self, conversation_id, summary, through_id):
+        """Summarizer hook: swap turns up to through_id for the new summary"""
+        self.memory.set_summary(conversation_id, summary, through_id)
+
+    def unsummarized_tokens(self, conversation_id):
+        """Estimated tokens of warm turns not yet covered by the summary"""
+        snapshot = self.memory.snapshot(conversation_id)
+        if snapshot is None:
+            return 0
+        _, through_id, turns = snapshot
+        return sum(_turn_tokens(turn, "default") for turn in turns if turn.id > through_id)
+
+    def invalidate(self, conversation_id=None):
+        """Drop cached turns for one conversation (or all of them)"""
+        self.memory.invalidate(conversation_id)
+
+
+context_builder = ContextBuilder()
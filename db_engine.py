@@ -0,0 +1,84 @@
+"""
+DB Engine - SQLite tuning profile for XeerGPT
+Every new SQLite connection gets WAL journaling, synchronous=NORMAL, a page
+cache, mmap reads, in-memory temp tables, a busy timeout and incremental
+auto-vacuum, so chat writes and /api/usage polling stop serialising on the
+rollback-journal lock and archive.py can hand freed pages back.
+Also sets pool options that suit threaded Flask.
+
+configure_sqlite(app) must run before db.init_app(app); tune_engine(db.engine)
+then hooks the pragmas up before the first connection is opened.
+"""
+
+import os
+
+from sqlalchemy import event
+
+from compression import message_body
+
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+# Applied in this order on every connect. auto_vacuum must precede journal_mode: it
+# only takes effect on a still-empty file or at the next VACUUM (archive.py vacuum)
+PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",        # Durable in WAL except for the last txn on power loss
+    "busy_timeout": BUSY_TIMEOUT_MS,
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE_KB", 32 * 1024)) * -1,   # negative = KiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 128 * 1024 * 1024)),
+    "temp_store": "MEMORY",
+}
+
+# Threaded Flask: one pooled connection per busy worker thread, a little overflow for bursts
+ENGINE_OPTIONS = {
+    "pool_size": int(os.getenv("SQLITE_POOL_SIZE", 10)),
+    "max_overflow": int(os.getenv("SQLITE_MAX_OVERFLOW", 20)),
+    "pool_timeout": 30,
+    "connect_args": {
+        "timeout": BUSY_TIMEOUT_MS / 1000,     # sqlite3 busy handler, in seconds
+        "check_same_thread": False,            # Pooled connections move between threads
+    },
+}
+
+
+def apply_pragmas(dbapi_connection, connection_record=None):
+    """"connect" event listener - tune one fresh DBAPI connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def register_functions(dbapi_connection, connection_record=None):
+    """"connect" event listener - SQL functions the schema relies on (FTS triggers, views)"""
+    dbapi_connection.create_function("message_body", 2, message_body, deterministic=True)
+
+
+def tune_engine(engine):
+    """Attach the pragma + function listeners to an Engine (or AsyncEngine.sync_engine)"""
+    if engine.dialect.name != "sqlite":
+        return engine
+    for listener in (apply_pragmas, register_functions):
+        if not event.contains(engine, "connect", listener):
+            event.listen(engine, "connect", listener)
+    return engine
+
+
+def configure_sqlite(app):
+    """Pool + connect options for a Flask app (explicit app settings win)"""
+    if not app.config.get("SQLALCHEMY_DATABASE_URI", "").startswith("sqlite"):
+        return
+    options = dict(ENGINE_OPTIONS)
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+def pragma_report(connection):
+    """Current values of the tuned pragmas on a SQLAlchemy connection"""
+    return {
+        name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+        for name in PRAGMAS
+    }
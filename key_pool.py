@@ -0,0 +1,319 @@
+"""
+Key Pool - per-key health tracking and scheduling for provider API keys
+One KeyPool per provider (groq / openrouter / gemini). Each request asks the
+pool for the least-loaded healthy key instead of always starting at key #1,
+and keys that return 429 sit out the provider-supplied retry window.
+
+Every attempt that reaches the provider is reported to the pool's usage_sink
+with the token counts the caller read from the response. With a daily
+budget set (set_budget), keys with more of it left are preferred.
+
+With per-key RPM/TPM limits set (set_rate_limits), each lease takes one
+request and the estimated tokens from the key's buckets, and keys without
+room are skipped as if they were cooling down. The estimate is corrected
+with the real token count when the lease ends, and refunded when the
+attempt was refused or failed before any usage came back.
+"""
+
+import asyncio
+import re
+import threading
+import time
+from collections import deque
+
+from rate_limiter import minute_bucket
+
+DEFAULT_COOLDOWN = 60.0     # Seconds to bench a key when the 429 carries no retry hint
+LATENCY_WINDOW = 20         # Rolling latency samples kept per key
+
+# "Please try again in 7.66s" / "try again in 1m30.5s" (Groq, OpenAI-style)
+_TRY_AGAIN_RE = re.compile(r"try again in (?:(\d+)m)?(\d+(?:\.\d+)?)s", re.IGNORECASE)
+# "retryDelay": "30s" (Gemini RESOURCE_EXHAUSTED details)
+_RETRY_DELAY_RE = re.compile(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE)
+
+
+def retry_after_from_error(error, default=DEFAULT_COOLDOWN):
+    """Best-effort retry window (seconds) from a provider rate-limit error"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                pass
+
+    text = str(error)
+    match = _TRY_AGAIN_RE.search(text)
+    if match:
+        minutes = int(match.group(1) or 0)
+        return minutes * 60 + float(match.group(2))
+    match = _RETRY_DELAY_RE.search(text)
+    if match:
+        return float(match.group(1))
+    return default
+
+
+class KeySlot:
+    """Health state for one API key"""
+
+    def __init__(self, index, client, async_client=None):
+        self.index = index
+        self.client = client
+        self.async_client = async_client if async_client is not None else client
+        self.in_flight = 0
+        self.last_429 = None            # monotonic time of the last rate limit
+        self.cooldown_until = 0.0       # monotonic time the key becomes usable again
+        self.last_acquired = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.rpm = None                 # TokenBuckets (None = unlimited)
+        self.tpm = None
+
+    def is_healthy(self, now):
+        return now >= self.cooldown_until
+
+    def rate_wait(self, tokens):
+        """Seconds until the RPM/TPM buckets can take one request of `tokens` (0 = now)"""
+        wait = 0.0
+        if self.rpm is not None:
+            wait = self.rpm.wait_time(1)
+        if self.tpm is not None:
+            wait = max(wait, self.tpm.wait_time(tokens))
+        return wait
+
+    def rolling_latency(self):
+        if not self.latencies:
+            return 0.0
+        return sum(self.latencies) / len(self.latencies)
+
+
+class KeyLease:
+    """
+    One attempt on one key. Use as a context manager so the in-flight count
+    is always released, even when a stream is abandoned mid-way.
+    """
+
+    def __init__(self, pool, slot, model=None, reserved_tokens=0):
+        self.pool = pool
+        self.slot = slot
+        self.index = slot.index
+        self.model = model
+        self.client = slot.client
+        self.async_client = slot.async_client
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.reserved_tokens = reserved_tokens     # Estimate taken from the key's TPM bucket
+        self._rate_limited = False
+        self._cancelled = False
+        self._failed = False
+
+    def first_token(self):
+        """Mark time-to-first-token for streaming calls"""
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def tokens(self, prompt_tokens, completion_tokens):
+        """Token counts from the provider's usage fields"""
+        self.prompt_tokens = prompt_tokens or 0
+        self.completion_tokens = completion_tokens or 0
+
+    def rate_limited(self, error):
+        """Bench this key for the provider-supplied retry window"""
+        self._rate_limited = True
+        self.pool._cool_down(self.slot, retry_after_from_error(error))
+
+    def failed(self):
+        """Count this request as failed without benching the key (an upstream error, not a limit)"""
+        self._failed = True
+
+    def cancel(self):
+        """The caller gave up on this request (a hedge loser) - the error it ends with isn't the key's fault"""
+        self._cancelled = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = self.first_token_at or time.monotonic()
+        # A client disconnect (GeneratorExit), a cancelled async task or a cancelled
+        # hedge attempt ends the request early - not the key's fault
+        finished = (exc_type is None or self._cancelled
+                    or issubclass(exc_type, (GeneratorExit, asyncio.CancelledError)))
+        ok = finished and not self._rate_limited and not self._failed
+        self.pool._release(self.slot, end - self.started_at if ok else None, ok)
+        used = self.prompt_tokens + self.completion_tokens
+        if self.slot.tpm is not None:
+            if used:
+                self.slot.tpm.charge(used - self.reserved_tokens)
+            elif not ok:
+                # Refused or failed before any usage came back - give the estimate back
+                self.slot.tpm.charge(-self.reserved_tokens)
+        if not self._rate_limited:
+            self.pool._report_usage(self)
+        return False
+
+
+class KeyPool:
+    """Schedules requests across the API keys of one provider"""
+
+    def __init__(self, provider, clients, async_clients=None):
+        self.provider = provider
+        self._lock = threading.Lock()
+        self.usage_sink = None          # usage_sink(provider, key_index, model, prompt_tokens, completion_tokens)
+        self.usage_source = None        # usage_source(provider) -> {key_index: (requests, tokens)} today
+        self.daily_requests = 0         # Per-key budgets (0 = unlimited)
+        self.daily_tokens = 0
+        async_clients = async_clients or []
+        self.slots = [
+            KeySlot(i, client, async_clients[i] if i < len(async_clients) else None)
+            for i, client in enumerate(clients)
+        ]
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __bool__(self):
+        return bool(self.slots)
+
+    def set_budget(self, usage_source, daily_requests=0, daily_tokens=0):
+        """Prefer keys with more of their daily request/token budget left"""
+        self.usage_source = usage_source
+        self.daily_requests = daily_requests
+        self.daily_tokens = daily_tokens
+
+    def set_rate_limits(self, rpm=0, tpm=0):
+        """Per-key requests / tokens per minute (0 = unlimited)"""
+        for slot in self.slots:
+            slot.rpm = minute_bucket(rpm)
+            slot.tpm = minute_bucket(tpm)
+
+    def headroom(self):
+        """{key_index: fraction of today's budget left (the tighter of requests/tokens)}; {} without a budget"""
+        if self.usage_source is None or not (self.daily_requests or self.daily_tokens):
+            return {}
+        used = self.usage_source(self.provider)
+        headroom = {}
+        for slot in self.slots:
+            requests, tokens = used.get(slot.index, (0, 0))
+            left = 1.0
+            if self.daily_requests:
+                left = min(left, 1 - requests / self.daily_requests)
+            if self.daily_tokens:
+                left = min(left, 1 - tokens / self.daily_tokens)
+            headroom[slot.index] = max(0.0, left)
+        return headroom
+
+    def _pick(self, exclude, headroom, tokens):
+        """
+        Least-loaded healthy key with RPM/TPM room, keys with budget left before
+        spent ones; ties go to the most budget left (in 10% steps), then the
+        faster, then the least recently used key
+        """
+        now = time.monotonic()
+        healthy = [s for s in self.slots
+                   if s.index not in exclude and s.is_healthy(now) and s.rate_wait(tokens) == 0]
+        if not healthy:
+            return None
+        return min(healthy, key=lambda s: (headroom.get(s.index, 1.0) <= 0, s.in_flight,
+                                           -round(headroom.get(s.index, 1.0), 1),
+                                           s.rolling_latency(), s.last_acquired))
+
+    def leases(self, model=None, tokens=0):
+        """
+        Yield a KeyLease per attempt, best key first, never the same key twice.
+        `tokens` is the request's estimated size, taken from the key's TPM bucket.
+        """
+        tried = set()
+        while True:
+            headroom = self.headroom()  # Outside the lock - reads the usage counters
+            with self._lock:
+                slot = self._pick(tried, headroom, tokens)
+                if slot is None:
+                    return
+                if slot.rpm is not None:
+                    slot.rpm.charge(1)
+                if slot.tpm is not None:
+                    slot.tpm.charge(tokens)
+                slot.in_flight += 1
+                slot.last_acquired = time.monotonic()
+            tried.add(slot.index)
+            yield KeyLease(self, slot, model, tokens if slot.tpm is not None else 0)
+
+    def _release(self, slot, latency, ok):
+        with self._lock:
+            slot.in_flight = max(0, slot.in_flight - 1)
+            if ok:
+                slot.successes += 1
+                slot.latencies.append(latency)
+            else:
+                slot.failures += 1
+
+    def _report_usage(self, lease):
+        if self.usage_sink is None:
+            return
+        try:
+            self.usage_sink(self.provider, lease.index, lease.model,
+                            lease.prompt_tokens, lease.completion_tokens)
+        except Exception as e:
+            print(f"⚠️ {self.provider} key usage tracking error: {e}")
+
+    def _cool_down(self, slot, seconds):
+        now = time.monotonic()
+        with self._lock:
+            slot.last_429 = now
+            slot.cooldown_until = max(slot.cooldown_until, now + seconds)
+        print(f"🧊 {self.provider} key #{slot.index + 1} cooling down for {seconds:.1f}s")
+
+    def healthy_count(self):
+        """Keys not currently cooling down"""
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for s in self.slots if s.is_healthy(now))
+
+    def next_available_in(self, tokens=0):
+        """Seconds until the first benched or rate-limited key is usable (0 if one is now)"""
+        now = time.monotonic()
+        with self._lock:
+            if not self.slots:
+                return 0.0
+            return min(max(s.cooldown_until - now, s.rate_wait(tokens), 0.0) for s in self.slots)
+
+    def admission_wait(self, tokens=0):
+        """Seconds until a healthy key's RPM/TPM buckets can take this request (0 if none is healthy)"""
+        now = time.monotonic()
+        with self._lock:
+            waits = [s.rate_wait(tokens) for s in self.slots if s.is_healthy(now)]
+        return min(waits) if waits else 0.0
+
+    def exhausted_reason(self, last_error=None):
+        """Message for the 'all keys exhausted' error"""
+        if last_error is not None:
+            return str(last_error)
+        if self.healthy_count():
+            return (f"429 rate limited locally - all {len(self.slots)} key(s) at their RPM/TPM limit, "
+                    f"next in {self.next_available_in():.0f}s")
+        return f"429 rate limited - all {len(self.slots)} key(s) cooling down, next in {self.next_available_in():.0f}s"
+
+    def snapshot(self):
+        """Per-key state for debug endpoints"""
+        now = time.monotonic()
+        headroom = self.headroom()
+        with self._lock:
+            return [{
+                "key": s.index + 1,
+                "healthy": s.is_healthy(now),
+                "cooldown_remaining": round(max(0.0, s.cooldown_until - now), 1),
+                "in_flight": s.in_flight,
+                "rolling_latency_ms": round(s.rolling_latency() * 1000),
+                "successes": s.successes,
+                "failures": s.failures,
+                "seconds_since_429": None if s.last_429 is None else round(now - s.last_429, 1),
+                "budget_left": round(headroom[s.index], 3) if s.index in headroom else None,
+                "rpm_left": None if s.rpm is None else int(s.rpm.available()),
+                "tpm_left": None if s.tpm is None else int(s.tpm.available())
+            } for s in self.slots]
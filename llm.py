@@ -4,17 +4,27 @@ VERIFIED WORKING - All models tested
 """
 
 import os
+import asyncio
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from key_pool import KeyPool
+from rate_limiter import RATE_LIMIT_MAX_WAIT, RateLimited, estimate_tokens
+from response_cache import CACHE_ENABLED, make_key, response_cache
+from semantic_cache import semantic_cache
 
 # Groq
 try:
-    from groq import Groq
+    from groq import Groq, AsyncGroq
     GROQ_AVAILABLE = True
 except ImportError:
     GROQ_AVAILABLE = False
 
 # OpenAI (for OpenRouter)
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI
     OPENAI_AVAILABLE = True
 except ImportError:
     OPENAI_AVAILABLE = False
@@ -46,8 +56,9 @@ def load_api_keys(prefix):
     
     return keys
 
-# Load Groq clients
+# Load Groq clients (sync for Flask, async for the ASGI app)
 groq_clients = []
+groq_async_clients = []
 if GROQ_AVAILABLE:
     groq_keys = load_api_keys("GROQ_API_KEY")
     if groq_keys:
@@ -55,13 +66,15 @@ if GROQ_AVAILABLE:
             try:
                 client = Groq(api_key=key)
                 groq_clients.append(client)
+                groq_async_clients.append(AsyncGroq(api_key=key))
             except Exception as e:
                 print(f"⚠️ Groq key error: {e}")
         if groq_clients:
             print(f"✅ Groq configured with {len(groq_clients)} key(s)")
 
-# Load OpenRouter clients
+# Load OpenRouter clients (sync for Flask, async for the ASGI app)
 openrouter_clients = []
+openrouter_async_clients = []
 if OPENAI_AVAILABLE:
     openrouter_keys = load_api_keys("OPENROUTER_API_KEY")
     if openrouter_keys:
@@ -72,12 +85,16 @@ if OPENAI_AVAILABLE:
                     base_url="https://openrouter.ai/api/v1"
                 )
                 openrouter_clients.append(client)
+                openrouter_async_clients.append(AsyncOpenAI(
+                    api_key=key,
+                    base_url="https://openrouter.ai/api/v1"
+                ))
             except Exception as e:
                 print(f"⚠️ OpenRouter key error: {e}")
         if openrouter_clients:
             print(f"✅ OpenRouter configured with {len(openrouter_clients)} key(s)")
 
-# Load Google Gemini clients
+# Load Google Gemini clients (each client also exposes its async API via .aio)
 gemini_clients = []
 if GOOGLE_GENAI_AVAILABLE:
     gemini_keys = load_api_keys("GEMINI_API_KEY")
@@ -92,6 +109,8 @@ if GOOGLE_GENAI_AVAILABLE:
             print(f"✅ Google Gemini configured with {len(gemini_clients)} key(s)")
             
 # VERIFIED WORKING MODELS
+# "fallbacks" = ordered chain of equivalent models (mostly on other providers)
+# that router.py may use when this model's provider is exhausted or slow
 AVAILABLE_MODELS = {
     # ── Groq Models (Direct - Fastest, your own keys) ─────────────────────
         "llama-3.1-8b": {
@@ -99,35 +118,40 @@ AVAILABLE_MODELS = {
         "model_id": "llama-3.1-8b-instant",       # ✅ still active
         "name": "Llama 3.1 8B",
         "description": "Ultra-fast — Simple tasks",
-        "icon": "⚡"
+        "icon": "⚡",
+        "fallbacks": ["deepseek-chat", "gemini-2.5-pro"]
     },
     "llama-3.3-70b": {
         "provider": "groq",
         "model_id": "llama-3.3-70b-versatile",   # ✅ replaces decommissioned llama-3.1-70b-versatile
         "name": "Llama 3.3 70B",
         "description": "Fast — General tasks",
-        "icon": "🦙"
+        "icon": "🦙",
+        "fallbacks": ["deepseek-chat", "hermes-3-405b-free", "gemini-2.5-pro"]
     },
     "llama-4-scout": {
         "provider": "groq",
         "model_id": "meta-llama/llama-4-scout-17b-16e-instruct",  # ✅ replaces decommissioned llama-3.2-90b-text-preview
         "name": "Llama 4 Scout 17B",
         "description": "Powerful — Complex coding, Multimodal",
-        "icon": "🎯"
+        "icon": "🎯",
+        "fallbacks": ["deepseek-chat", "gemini-2.5-pro"]
     },
     "llama-4-maverick": {
         "provider": "groq",
         "model_id": "meta-llama/llama-4-maverick-17b-128e-instruct",  # ✅ new Llama 4 model
         "name": "Llama 4 Maverick 17B",
         "description": "Most powerful — Advanced Coding",
-        "icon": "🚀"
+        "icon": "🚀",
+        "fallbacks": ["deepseek-chat", "gemini-2.5-pro"]
     },
     "gpt-oss-120b": {
     "provider": "groq",
     "model_id": "openai/gpt-oss-120b",
     "name": "CHATGPT 120B",
     "description": "OpenAI — Built-in web & code execution",
-    "icon": "👑"
+    "icon": "👑",
+    "fallbacks": ["deepseek-r1", "gemini-2.5-pro"]
     },
 
     "qwen3-32b": {
@@ -135,7 +159,8 @@ AVAILABLE_MODELS = {
     "model_id": "qwen/qwen3-32b",
     "name": "Qwen 3 32B",
     "description": "Alibaba — Math, Chinese",
-    "icon": "🐉"
+    "icon": "🐉",
+    "fallbacks": ["deepseek-r1", "gemini-2.5-pro"]
     },
     # ── OpenRouter Free Models ─────────────────────────────────────────────
     
@@ -145,21 +170,24 @@ AVAILABLE_MODELS = {
         "model_id": "deepseek/deepseek-chat-v3-0324",
         "name": "DeepSeek Chat V3",
         "description": "Standard — General Tasks",
-        "icon": "🌊"
+        "icon": "🌊",
+        "fallbacks": ["llama-3.3-70b", "gemini-2.5-pro"]
     },
     "deepseek-r1": {
         "provider": "openrouter",
         "model_id": "deepseek/deepseek-r1",
         "name": "DeepSeek Chat R1",
         "description": "Advanced — Math & Coding",
-        "icon": "🧠"
+        "icon": "🧠",
+        "fallbacks": ["gpt-oss-120b", "gemini-2.5-pro"]
     },
     "hermes-3-405b-free": {
     "provider": "openrouter",
     "model_id": "nousresearch/hermes-3-llama-3.1-405b:free",
     "name": "Hermes 3 405B",
     "description": "Conversational, roleplay",
-    "icon": "✨"
+    "icon": "✨",
+    "fallbacks": ["llama-3.3-70b", "deepseek-chat"]
     },
     
     #google gemini models ─────────────────────────────────────────────
@@ -169,113 +197,931 @@ AVAILABLE_MODELS = {
         "model_id": "gemini-3-pro-preview",
         "name": "Gemini 3 Pro",
         "description": "Most powerful Gemini, agentic & multimodal",
-        "icon": "💎"
+        "icon": "💎",
+        "fallbacks": ["gemini-2.5-pro", "deepseek-r1", "gpt-oss-120b"]
     },
     "gemini-2.5-pro": {
         "provider": "gemini",
         "model_id": "gemini-2.5-pro",
         "name": "Gemini 2.5 Pro",
         "description": "Deep reasoning, 1M context",
-        "icon": "🔮"
+        "icon": "🔮",
+        "fallbacks": ["deepseek-r1", "gpt-oss-120b"]
     }
 }
 
 
 
-def chat_with_groq(message: str, model: str = "llama-3.3-70b-versatile") -> str:
-    """Try all Groq keys until one works"""
-    if not groq_clients:
+# Sampling params shared by every provider call (also part of the cache key)
+TEMPERATURE = 0.7
+MAX_TOKENS = 2048
+
+# ── Key pools ──────────────────────────────────────────────────────────────
+# Every provider call leases the least-loaded healthy key from its pool;
+# keys that return 429 are benched for the provider's retry window.
+
+groq_pool = KeyPool("groq", groq_clients, groq_async_clients)
+openrouter_pool = KeyPool("openrouter", openrouter_clients, openrouter_async_clients)
+gemini_pool = KeyPool("gemini", gemini_clients)
+
+KEY_POOLS = {
+    "groq": groq_pool,
+    "openrouter": openrouter_pool,
+    "gemini": gemini_pool
+}
+
+# Every attempt is counted per key and model with its token usage (usage_tracker.py).
+# Optional per-key daily budgets steer traffic to keys with headroom, e.g.
+# GROQ_KEY_DAILY_REQUESTS=1000 / GROQ_KEY_DAILY_TOKENS=500000, and per-key
+# per-minute limits are enforced before dispatch (rate_limiter.py), e.g.
+# GROQ_KEY_RPM=30 / GROQ_KEY_TPM=6000
+
+def _record_key_usage(provider, key_index, model_id, prompt_tokens, completion_tokens):
+    from usage_tracker import record_key_usage  # Lazy: usage_tracker imports app
+    record_key_usage(provider, key_index, model_id, prompt_tokens, completion_tokens)
+
+def _key_usage(provider):
+    from usage_tracker import usage_counters
+    return usage_counters.key_totals(provider)
+
+for _provider, _pool in KEY_POOLS.items():
+    _pool.usage_sink = _record_key_usage
+    _pool.set_budget(
+        _key_usage,
+        daily_requests=int(os.getenv(f"{_provider.upper()}_KEY_DAILY_REQUESTS", 0)),
+        daily_tokens=int(os.getenv(f"{_provider.upper()}_KEY_DAILY_TOKENS", 0))
+    )
+    _pool.set_rate_limits(
+        rpm=int(os.getenv(f"{_provider.upper()}_KEY_RPM", 0)),
+        tpm=int(os.getenv(f"{_provider.upper()}_KEY_TPM", 0))
+    )
+
+def _lease_tokens(lease, usage):
+    """Copy token counts from an OpenAI-style or Gemini usage object onto the lease"""
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", None)
+    if prompt is None:
+        prompt = getattr(usage, "prompt_token_count", None)
+    completion = getattr(usage, "completion_tokens", None)
+    if completion is None:
+        completion = getattr(usage, "candidates_token_count", None)
+    lease.tokens(prompt, completion)
+
+def _chunk_usage(chunk):
+    """Usage on a stream chunk - OpenAI-style final chunk, or Groq's x_groq extension"""
+    usage = getattr(chunk, "usage", None)
+    if usage is None:
+        usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+    return usage
+
+def _is_rate_limited(provider: str, error_str: str) -> bool:
+    """Does this provider error mean 'try another key'?"""
+    lowered = error_str.lower()
+    if provider == "groq":
+        return "429" in error_str or "rate_limit" in lowered
+    if provider == "openrouter":
+        return "429" in error_str or "rate_limit" in lowered
+    return "429" in error_str or "quota" in lowered or "rate" in lowered
+
+def _is_upstream_error(provider: str, error_str: str) -> bool:
+    """OpenRouter 502: the model host behind it failed, not our key - try the next key, no cooldown"""
+    return provider == "openrouter" and "502" in error_str
+
+def _chat_messages(message: str, history: list = None) -> list:
+    """OpenAI-style messages: prior turns (role/content dicts) + the new user message"""
+    messages = []
+    if history:
+        for msg in history:
+            messages.append({
+                "role": msg.get("role", "user"),
+                "content": msg.get("content", "")
+            })
+    messages.append({"role": "user", "content": message})
+    return messages
+
+def _gemini_contents(message: str, history: list = None):
+    """Gemini contents - a plain string for single-turn, role/parts list otherwise"""
+    if not history:
+        return message
+    contents = []
+    for msg in history:
+        # Gemini contents only know user/model; a system summary rides as a user turn
+        role = "model" if msg.get("role") == "assistant" else "user"
+        contents.append({"role": role, "parts": [{"text": msg.get("content", "")}]})
+    contents.append({"role": "user", "parts": [{"text": message}]})
+    return contents
+
+def chat_with_groq(message: str, model: str = "llama-3.3-70b-versatile", history: list = None) -> str:
+    """Try healthy Groq keys, least-loaded first, until one works"""
+    if not groq_pool:
         raise Exception("Groq not configured")
     
     last_error = None
-    for client in groq_clients:
-        try:
-            completion = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": message}],
-                temperature=0.7,
-                max_tokens=2048
-            )
-            return completion.choices[0].message.content
-        except Exception as e:
-            error_str = str(e)
-            if "429" in error_str or "rate_limit" in error_str.lower():
-                last_error = e
-                continue
-            else:
-                raise Exception(f"Groq API Error: {error_str}")
+    for lease in groq_pool.leases(model, estimate_tokens(message, history)):
+        with lease:
+            try:
+                completion = lease.client.chat.completions.create(
+                    model=model,
+                    messages=_chat_messages(message, history),
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_TOKENS
+                )
+                _lease_tokens(lease, completion.usage)
+                return completion.choices[0].message.content
+            except Exception as e:
+                error_str = str(e)
+                if _is_rate_limited("groq", error_str):
+                    lease.rate_limited(e)
+                    last_error = e
+                    continue
+                else:
+                    raise Exception(f"Groq API Error: {error_str}")
     
-    raise Exception(f"All Groq keys exhausted: {str(last_error)}")
+    raise Exception(f"All Groq keys exhausted: {groq_pool.exhausted_reason(last_error)}")
 
-def chat_with_openrouter(message: str, model: str = "meta-llama/llama-3.1-70b-instruct") -> str:
-    """Try all OpenRouter keys until one works"""
-    if not openrouter_clients:
+def chat_with_openrouter(message: str, model: str = "meta-llama/llama-3.1-70b-instruct", history: list = None) -> str:
+    """Try healthy OpenRouter keys, least-loaded first, until one works"""
+    if not openrouter_pool:
         raise Exception("OpenRouter not configured")
     
     last_error = None
-    for client in openrouter_clients:
-        try:
-            completion = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": message}],
-                temperature=0.7,
-                max_tokens=2048
-            )
-            return completion.choices[0].message.content
-        except Exception as e:
-            error_str = str(e)
-            if "429" in error_str or "rate_limit" in error_str.lower() or "502" in error_str:
-                last_error = e
-                continue
-            else:
-                raise Exception(f"OpenRouter API Error: {error_str}")
+    for lease in openrouter_pool.leases(model, estimate_tokens(message, history)):
+        with lease:
+            try:
+                completion = lease.client.chat.completions.create(
+                    model=model,
+                    messages=_chat_messages(message, history),
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_TOKENS
+                )
+                _lease_tokens(lease, completion.usage)
+                return completion.choices[0].message.content
+            except Exception as e:
+                error_str = str(e)
+                if _is_rate_limited("openrouter", error_str):
+                    lease.rate_limited(e)
+                    last_error = e
+                    continue
+                elif _is_upstream_error("openrouter", error_str):
+                    lease.failed()
+                    last_error = e
+                    continue
+                else:
+                    raise Exception(f"OpenRouter API Error: {error_str}")
     
-    raise Exception(f"All OpenRouter keys exhausted: {str(last_error)}")
+    raise Exception(f"All OpenRouter keys exhausted: {openrouter_pool.exhausted_reason(last_error)}")
+
+def chat_with_gemini(message: str, model: str = "gemini-2.5-flash", history: list = None) -> str:
+    """Try healthy Gemini keys, least-loaded first, until one works"""
+    if not gemini_pool:
+        raise Exception("Google Gemini not configured")
 
-# ── ADD this function alongside chat_with_groq / chat_with_openrouter ──────
+    last_error = None
+    for lease in gemini_pool.leases(model, estimate_tokens(message, history)):
+        with lease:
+            try:
+                response = lease.client.models.generate_content(
+                    model=model,
+                    contents=_gemini_contents(message, history),
+                )
+                _lease_tokens(lease, response.usage_metadata)
+                return response.text
+            except Exception as e:
+                error_str = str(e)
+                if _is_rate_limited("gemini", error_str):
+                    lease.rate_limited(e)
+                    last_error = e
+                    continue
+                else:
+                    raise Exception(f"Gemini API Error: {error_str}")
+
+    raise Exception(f"All Gemini keys exhausted: {gemini_pool.exhausted_reason(last_error)}")
+
+# ── Streaming variants ─────────────────────────────────────────────────────
+# Same key-fallback rules as above, but a key is only skipped if it fails
+# before the first delta has been yielded; after that the error propagates.
+
+def stream_with_groq(message: str, model: str = "llama-3.3-70b-versatile", history: list = None):
+    """Yield Groq completion deltas as they arrive"""
+    if not groq_pool:
+        raise Exception("Groq not configured")
+
+    last_error = None
+    for lease in groq_pool.leases(model, estimate_tokens(message, history)):
+        with lease:
+            try:
+                stream = lease.client.chat.completions.create(
+                    model=model,
+                    messages=_chat_messages(message, history),
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_TOKENS,
+                    stream=True
+                )
+                _track_attempt(lease, stream)
+                for chunk in stream:
+                    usage = _chunk_usage(chunk)
+                    if usage is not None:
+                        _lease_tokens(lease, usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        lease.first_token()
+                        yield delta
+                return
+            except Exception as e:
+                error_str = str(e)
+                if lease.first_token_at is None and _is_rate_limited("groq", error_str):
+                    lease.rate_limited(e)
+                    last_error = e
+                    continue
+                raise Exception(f"Groq API Error: {error_str}")
 
-def chat_with_gemini(message: str, model: str = "gemini-2.5-flash") -> str:
-    """Try all Gemini keys until one works"""
-    if not gemini_clients:
+    raise Exception(f"All Groq keys exhausted: {groq_pool.exhausted_reason(last_error)}")
+
+def stream_with_openrouter(message: str, model: str = "meta-llama/llama-3.1-70b-instruct", history: list = None):
+    """Yield OpenRouter completion deltas as they arrive"""
+    if not openrouter_pool:
+        raise Exception("OpenRouter not configured")
+
+    last_error = None
+    for lease in openrouter_pool.leases(model, estimate_tokens(message, history)):
+        with lease:
+            try:
+                stream = lease.client.chat.completions.create(
+                    model=model,
+                    messages=_chat_messages(message, history),
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_TOKENS,
+                    stream=True,
+                    stream_options={"include_usage": True}  # Final chunk carries token usage
+                )
+                _track_attempt(lease, stream)
+                for chunk in stream:
+                    usage = _chunk_usage(chunk)
+                    if usage is not None:
+                        _lease_tokens(lease, usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        lease.first_token()
+                        yield delta
+                return
+            except Exception as e:
+                error_str = str(e)
+                if lease.first_token_at is None and _is_rate_limited("openrouter", error_str):
+                    lease.rate_limited(e)
+                    last_error = e
+                    continue
+                if lease.first_token_at is None and _is_upstream_error("openrouter", error_str):
+                    lease.failed()
+                    last_error = e
+                    continue
+                raise Exception(f"OpenRouter API Error: {error_str}")
+
+    raise Exception(f"All OpenRouter keys exhausted: {openrouter_pool.exhausted_reason(last_error)}")
+
+def stream_with_gemini(message: str, model: str = "gemini-2.5-flash", history: list = None):
+    """Yield Gemini response text chunks as they arrive"""
+    if not gemini_pool:
         raise Exception("Google Gemini not configured")
 
     last_error = None
-    for client in gemini_clients:
-        try:
-            response = client.models.generate_content(
-                model=model,
-                contents=message,
-            )
-            return response.text
-        except Exception as e:
-            error_str = str(e)
-            if "429" in error_str or "quota" in error_str.lower() or "rate" in error_str.lower():
-                last_error = e
-                continue
-            else:
+    for lease in gemini_pool.leases(model, estimate_tokens(message, history)):
+        with lease:
+            try:
+                _track_attempt(lease)   # No socket to reach - a cancelled attempt stops at its next chunk
+                for chunk in lease.client.models.generate_content_stream(
+                    model=model,
+                    contents=_gemini_contents(message, history),
+                ):
+                    if chunk.usage_metadata is not None:
+                        _lease_tokens(lease, chunk.usage_metadata)
+                    if chunk.text:
+                        lease.first_token()
+                        yield chunk.text
+                return
+            except Exception as e:
+                error_str = str(e)
+                if lease.first_token_at is None and _is_rate_limited("gemini", error_str):
+                    lease.rate_limited(e)
+                    last_error = e
+                    continue
                 raise Exception(f"Gemini API Error: {error_str}")
 
-    raise Exception(f"All Gemini keys exhausted: {str(last_error)}")
+    raise Exception(f"All Gemini keys exhausted: {gemini_pool.exhausted_reason(last_error)}")
+
+# ── Async streaming variants (used by asgi.py) ─────────────────────────────
+
+async def astream_with_groq(message: str, model: str = "llama-3.3-70b-versatile", history: list = None):
+    """Async-yield Groq completion deltas as they arrive"""
+    if not groq_pool:
+        raise Exception("Groq not configured")
+
+    last_error = None
+    for lease in groq_pool.leases(model, estimate_tokens(message, history)):
+        with lease:
+            try:
+                stream = await lease.async_client.chat.completions.create(
+                    model=model,
+                    messages=_chat_messages(message, history),
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_TOKENS,
+                    stream=True
+                )
+                async for chunk in stream:
+                    usage = _chunk_usage(chunk)
+                    if usage is not None:
+                        _lease_tokens(lease, usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        lease.first_token()
+                        yield delta
+                return
+            except Exception as e:
+                error_str = str(e)
+                if lease.first_token_at is None and _is_rate_limited("groq", error_str):
+                    lease.rate_limited(e)
+                    last_error = e
+                    continue
+                raise Exception(f"Groq API Error: {error_str}")
 
-def llm_chat(message: str, model: str = "llama-3.3-70b") -> str:
-    """Main chat function - routes to correct provider"""
+    raise Exception(f"All Groq keys exhausted: {groq_pool.exhausted_reason(last_error)}")
+
+async def astream_with_openrouter(message: str, model: str = "meta-llama/llama-3.1-70b-instruct", history: list = None):
+    """Async-yield OpenRouter completion deltas as they arrive"""
+    if not openrouter_pool:
+        raise Exception("OpenRouter not configured")
+
+    last_error = None
+    for lease in openrouter_pool.leases(model, estimate_tokens(message, history)):
+        with lease:
+            try:
+                stream = await lease.async_client.chat.completions.create(
+                    model=model,
+                    messages=_chat_messages(message, history),
+                    temperature=TEMPERATURE,
+                    max_tokens=MAX_TOKENS,
+                    stream=True,
+                    stream_options={"include_usage": True}  # Final chunk carries token usage
+                )
+                async for chunk in stream:
+                    usage = _chunk_usage(chunk)
+                    if usage is not None:
+                        _lease_tokens(lease, usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        lease.first_token()
+                        yield delta
+                return
+            except Exception as e:
+                error_str = str(e)
+                if lease.first_token_at is None and _is_rate_limited("openrouter", error_str):
+                    lease.rate_limited(e)
+                    last_error = e
+                    continue
+                if lease.first_token_at is None and _is_upstream_error("openrouter", error_str):
+                    lease.failed()
+                    last_error = e
+                    continue
+                raise Exception(f"OpenRouter API Error: {error_str}")
+
+    raise Exception(f"All OpenRouter keys exhausted: {openrouter_pool.exhausted_reason(last_error)}")
+
+async def astream_with_gemini(message: str, model: str = "gemini-2.5-flash", history: list = None):
+    """Async-yield Gemini response text chunks as they arrive"""
+    if not gemini_pool:
+        raise Exception("Google Gemini not configured")
+
+    last_error = None
+    for lease in gemini_pool.leases(model, estimate_tokens(message, history)):
+        with lease:
+            try:
+                stream = await lease.async_client.aio.models.generate_content_stream(
+                    model=model,
+                    contents=_gemini_contents(message, history),
+                )
+                async for chunk in stream:
+                    if chunk.usage_metadata is not None:
+                        _lease_tokens(lease, chunk.usage_metadata)
+                    if chunk.text:
+                        lease.first_token()
+                        yield chunk.text
+                return
+            except Exception as e:
+                error_str = str(e)
+                if lease.first_token_at is None and _is_rate_limited("gemini", error_str):
+                    lease.rate_limited(e)
+                    last_error = e
+                    continue
+                raise Exception(f"Gemini API Error: {error_str}")
+
+    raise Exception(f"All Gemini keys exhausted: {gemini_pool.exhausted_reason(last_error)}")
+
+def _direct_chat(message: str, model: str, history: list = None) -> str:
+    """Dispatch a blocking call to the model's provider"""
     model_info = AVAILABLE_MODELS.get(model)
     if not model_info:
         print(f"⚠️ Unknown model '{model}', using llama-3.3-70b")
-        return chat_with_groq(message, "llama-3.3-70b-versatile")
+        return chat_with_groq(message, "llama-3.3-70b-versatile", history)
     
     provider = model_info["provider"]
     model_id = model_info["model_id"]
     
     if provider == "groq":
-        return chat_with_groq(message, model_id)
+        return chat_with_groq(message, model_id, history)
     elif provider == "openrouter":
-        return chat_with_openrouter(message, model_id)
+        return chat_with_openrouter(message, model_id, history)
     elif provider == "gemini":
-        return chat_with_gemini(message, model_id)
+        return chat_with_gemini(message, model_id, history)
     else:
         raise Exception(f"Unknown provider: {provider}")
 
+def _direct_stream(message: str, model: str, history: list = None):
+    """Dispatch a streaming call to the model's provider"""
+    model_info = AVAILABLE_MODELS.get(model)
+    if not model_info:
+        print(f"⚠️ Unknown model '{model}', using llama-3.3-70b")
+        return stream_with_groq(message, "llama-3.3-70b-versatile", history)
+
+    provider = model_info["provider"]
+    model_id = model_info["model_id"]
+
+    if provider == "groq":
+        return stream_with_groq(message, model_id, history)
+    elif provider == "openrouter":
+        return stream_with_openrouter(message, model_id, history)
+    elif provider == "gemini":
+        return stream_with_gemini(message, model_id, history)
+    else:
+        raise Exception(f"Unknown provider: {provider}")
+
+def _direct_astream(message: str, model: str, history: list = None):
+    """Dispatch an async streaming call to the model's provider"""
+    model_info = AVAILABLE_MODELS.get(model)
+    if not model_info:
+        print(f"⚠️ Unknown model '{model}', using llama-3.3-70b")
+        return astream_with_groq(message, "llama-3.3-70b-versatile", history)
+
+    provider = model_info["provider"]
+    model_id = model_info["model_id"]
+
+    if provider == "groq":
+        return astream_with_groq(message, model_id, history)
+    elif provider == "openrouter":
+        return astream_with_openrouter(message, model_id, history)
+    elif provider == "gemini":
+        return astream_with_gemini(message, model_id, history)
+    else:
+        raise Exception(f"Unknown provider: {provider}")
+
+# ── Hedged requests (opt-in) ───────────────────────────────────────────────
+# If the primary stream has produced no first token after the model's p90
+# TTFT, a duplicate goes to another key (same model) or the first ready
+# fallback model. Whichever produces a token first wins; the other is
+# cancelled. Each hedge is recorded against the usage_tracker budget.
+
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "0") == "1"
+HEDGE_DEFAULT_DELAY = 2.0    # Seconds, until enough TTFT samples exist
+HEDGE_MIN_DELAY = 0.5
+HEDGE_MAX_DELAY = 8.0
+HEDGE_MIN_SAMPLES = 10
+TTFT_WINDOW = 100
+
+_ttft_samples = {}
+_ttft_lock = threading.Lock()
+
+def _record_ttft(model: str, seconds: float):
+    with _ttft_lock:
+        _ttft_samples.setdefault(model, deque(maxlen=TTFT_WINDOW)).append(seconds)
+
+def hedge_delay(model: str) -> float:
+    """Adaptive hedge threshold: the model's recent p90 time-to-first-token"""
+    with _ttft_lock:
+        samples = sorted(_ttft_samples.get(model, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    p90 = samples[int(0.9 * (len(samples) - 1))]
+    return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, p90))
+
+def _hedge_target(model: str):
+    """Second key of the same model if one is free, else the first ready fallback"""
+    model_info = AVAILABLE_MODELS.get(model)
+    if not model_info:
+        return None
+    if KEY_POOLS[model_info["provider"]].healthy_count() > 1:
+        return model
+    for fallback in model_info.get("fallbacks", []):
+        fallback_info = AVAILABLE_MODELS.get(fallback)
+        if not fallback_info:
+            continue
+        pool = KEY_POOLS[fallback_info["provider"]]
+        if pool and pool.next_available_in() == 0:
+            return fallback
+    return None
+
+def _record_hedge(model: str):
+    """Count the duplicate request against the provider's daily budget"""
+    from usage_tracker import record_usage, PROVIDER_LIMITS  # Lazy: usage_tracker imports app
+    provider = AVAILABLE_MODELS.get(model, {}).get("provider")
+    print(f"🪃 Hedging with {model}")
+    if provider in PROVIDER_LIMITS:
+        try:
+            record_usage(provider)
+        except Exception as e:
+            print(f"⚠️ Hedge usage tracking error: {e}")
+
+def _timed_stream(message: str, model: str, history: list = None):
+    """Direct stream that feeds the TTFT window"""
+    started = time.monotonic()
+    first = True
+    for delta in _direct_stream(message, model, history):
+        if first:
+            first = False
+            _record_ttft(model, time.monotonic() - started)
+        yield delta
+
+async def _timed_astream(message: str, model: str, history: list = None):
+    started = time.monotonic()
+    first = True
+    async for delta in _direct_astream(message, model, history):
+        if first:
+            first = False
+            _record_ttft(model, time.monotonic() - started)
+        yield delta
+
+class _Attempt:
+    """
+    One sync hedged attempt. The provider stream functions register their
+    lease and provider stream here (via _track_attempt), so the coordinating
+    thread can shut down the loser's connection instead of waiting for its
+    thread to notice a flag between deltas.
+    """
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._open = []         # (lease, provider stream or None)
+        self._done = False
+
+    def track(self, lease, stream):
+        with self._lock:
+            self._open.append((lease, stream))
+            cancelled = self.cancelled.is_set()
+        if cancelled:
+            _abort_stream(lease, stream)
+
+    def finish(self):
+        with self._lock:
+            self._done = True
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            # A finished attempt's connection is back in the client's pool - leave it alone
+            opened = [] if self._done else list(self._open)
+        for lease, stream in opened:
+            _abort_stream(lease, stream)
+
+# The _Attempt the current thread is running, if it is a hedged attempt thread
+_attempt_local = threading.local()
+
+def _track_attempt(lease, stream=None):
+    attempt = getattr(_attempt_local, "attempt", None)
+    if attempt is not None:
+        attempt.track(lease, stream)
+
+def _abort_stream(lease, stream):
+    """Called from the coordinating thread: shutting the socket down wakes a reader blocked on it"""
+    lease.cancel()
+    response = getattr(stream, "response", None)    # openai.Stream -> httpx.Response
+    network_stream = response.extensions.get("network_stream") if response is not None else None
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass    # Already closed
+
+def _hedged_stream(message: str, model: str, history: list = None, reply=None):
+    """Sync hedging - each attempt runs in its own thread feeding one queue; reply.model is set to the winner"""
+    events = queue.Queue()
+
+    def run(slot, attempt_model):
+        attempt = attempts[slot]
+        _attempt_local.attempt = attempt
+        stream = None
+        try:
+            stream = _timed_stream(message, attempt_model, history)
+            for delta in stream:
+                if attempt.cancelled.is_set():
+                    break
+                events.put((slot, "delta", delta))
+            events.put((slot, "end", None))
+        except Exception as e:
+            events.put((slot, "error", e))
+        finally:
+            if stream is not None:
+                stream.close()  # releases the key lease
+            attempt.finish()
+            _attempt_local.attempt = None
+
+    attempts = []
+    attempt_models = []
+
+    def start(slot, attempt_model):
+        attempts.append(_Attempt())
+        attempt_models.append(attempt_model)
+        threading.Thread(target=run, args=(slot, attempt_model), daemon=True).start()
+
+    start(0, model)
+    deadline = time.monotonic() + hedge_delay(model)
+    hedged = False
+    winner = None
+    failures = 0
+    try:
+        while True:
+            timeout = None
+            if winner is None and not hedged:
+                timeout = max(0.0, deadline - time.monotonic())
+            try:
+                slot, kind, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                hedged = True
+                target = _hedge_target(model)
+                if target:
+                    _record_hedge(target)
+                    start(1, target)
+                continue
+
+            if winner is None:
+                if kind == "error":
+                    failures += 1
+                    if failures == len(attempts):
+                        raise payload
+                    continue  # the other attempt may still answer
+                winner = slot
+                if reply is not None:
+                    reply.model = attempt_models[slot]
+                for i, attempt in enumerate(attempts):
+                    if i != slot:
+                        attempt.cancel()
+            elif slot != winner:
+                continue
+
+            if kind == "delta":
+                yield payload
+            elif kind == "end":
+                return
+            else:
+                raise payload
+    finally:
+        for attempt in attempts:
+            attempt.cancel()
+
+async def _hedged_astream(message: str, model: str, history: list = None, reply=None):
+    """Async hedging - the losing attempt's task is cancelled outright; reply.model is set to the winner"""
+    events = asyncio.Queue()
+
+    async def run(slot, attempt_model):
+        stream = _timed_astream(message, attempt_model, history)
+        try:
+            async for delta in stream:
+                await events.put((slot, "delta", delta))
+            await events.put((slot, "end", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await events.put((slot, "error", e))
+        finally:
+            await stream.aclose()
+
+    tasks = [asyncio.create_task(run(0, model))]
+    attempt_models = [model]
+    deadline = time.monotonic() + hedge_delay(model)
+    hedged = False
+    winner = None
+    failures = 0
+    try:
+        while True:
+            if winner is None and not hedged:
+                try:
+                    slot, kind, payload = await asyncio.wait_for(
+                        events.get(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    hedged = True
+                    target = _hedge_target(model)
+                    if target:
+                        await asyncio.to_thread(_record_hedge, target)
+                        tasks.append(asyncio.create_task(run(1, target)))
+                        attempt_models.append(target)
+                    continue
+            else:
+                slot, kind, payload = await events.get()
+
+            if winner is None:
+                if kind == "error":
+                    failures += 1
+                    if failures == len(tasks):
+                        raise payload
+                    continue
+                winner = slot
+                if reply is not None:
+                    reply.model = attempt_models[slot]
+                for i, task in enumerate(tasks):
+                    if i != slot:
+                        task.cancel()
+            elif slot != winner:
+                continue
+
+            if kind == "delta":
+                yield payload
+            elif kind == "end":
+                return
+            else:
+                raise payload
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# ── Admission control ──────────────────────────────────────────────────────
+# Before a provider call leaves the process, wait (at most RATE_LIMIT_MAX_WAIT)
+# until one of the provider's keys has RPM/TPM room. A longer wait fails fast
+# with RateLimited, so router.py moves on to the next model in the chain
+# instead of fanning a burst out into 429s.
+
+def _model_pool(model: str):
+    return KEY_POOLS[(AVAILABLE_MODELS.get(model) or AVAILABLE_MODELS["llama-3.3-70b"])["provider"]]
+
+def _admission_wait(model: str, tokens: int, deadline: float) -> float:
+    """Seconds to queue before dispatch (0 = go now); raises RateLimited past the deadline"""
+    pool = _model_pool(model)
+    wait = pool.admission_wait(tokens)
+    if wait > deadline - time.monotonic():
+        raise RateLimited(
+            f"429 rate limited locally - {pool.provider} keys are at their RPM/TPM limit, "
+            f"retry in {wait:.1f}s", wait)
+    return wait
+
+def _admit(model: str, tokens: int):
+    deadline = time.monotonic() + RATE_LIMIT_MAX_WAIT
+    while True:
+        wait = _admission_wait(model, tokens, deadline)
+        if not wait:
+            return
+        time.sleep(wait)
+
+async def _aadmit(model: str, tokens: int):
+    deadline = time.monotonic() + RATE_LIMIT_MAX_WAIT
+    while True:
+        wait = _admission_wait(model, tokens, deadline)
+        if not wait:
+            return
+        await asyncio.sleep(wait)
+
+def _admitted_stream(model: str, tokens: int, stream):
+    """Queue for a key when iteration starts, then pass the deltas through"""
+    _admit(model, tokens)
+    yield from stream
+
+async def _admitted_astream(model: str, tokens: int, stream):
+    await _aadmit(model, tokens)
+    async for delta in stream:
+        yield delta
+
+# ── Response cache ─────────────────────────────────────────────────────────
+
+# Exact-match tier first, then the semantic (near-duplicate) tier. Each tier
+# has its own switch (RESPONSE_CACHE / SEMANTIC_CACHE); either one alone works.
+# Follow-ups depend on their context, so only first turns go to the semantic tier.
+
+def _model_id(model: str) -> str:
+    return (AVAILABLE_MODELS.get(model) or AVAILABLE_MODELS["llama-3.3-70b"])["model_id"]
+
+def _cache_key(message: str, model: str, cache: bool, history: list = None):
+    """Cache key for this call, or None when no tier applies to it"""
+    if not cache or not (CACHE_ENABLED or (not history and semantic_cache.eligible(message))):
+        return None
+    params = {"temperature": TEMPERATURE, "max_tokens": MAX_TOKENS}
+    if history:
+        params["history"] = [[msg.get("role"), msg.get("content")] for msg in history]
+    return make_key(message, _model_id(model), **params)
+
+def _cache_get(key: str, message: str, model: str, history: list = None):
+    cached = response_cache.get(key) if CACHE_ENABLED else None
+    if cached is None and not history:
+        cached = semantic_cache.get(message, _model_id(model))
+        if cached is not None and CACHE_ENABLED:
+            response_cache.put(key, cached)
+    return cached
+
+def _cache_put(key: str, message: str, model: str, response: str, history: list = None):
+    if CACHE_ENABLED:
+        response_cache.put(key, response)
+    if not history:
+        semantic_cache.put(message, _model_id(model), response)
+
+def _answered_key(key: str, message: str, model: str, history: list, reply):
+    """Cache under the model that answered - a hedge may have gone to a fallback"""
+    if reply.model == model:
+        return key
+    return _cache_key(message, reply.model, True, history)
+
+def _caching_stream(key: str, message: str, model: str, history: list, stream, reply):
+    """Pass deltas through and cache the full text once the stream completes"""
+    chunks = []
+    for delta in stream:
+        chunks.append(delta)
+        yield delta
+    _cache_put(_answered_key(key, message, model, history, reply), message, reply.model, "".join(chunks), history)
+
+async def _caching_astream(key: str, message: str, model: str, history: list, stream, reply):
+    chunks = []
+    async for delta in stream:
+        chunks.append(delta)
+        yield delta
+    _cache_put(_answered_key(key, message, model, history, reply), message, reply.model, "".join(chunks), history)
+
+class CachedReply:
+    """Replay of a cached response (sync or async) - no provider call was made"""
+
+    def __init__(self, text: str, model: str):
+        self.text = text
+        self.model = model
+
+    def __iter__(self):
+        yield self.text
+
+    async def __aiter__(self):
+        yield self.text
+
+class ModelReply:
+    """
+    Deltas from a provider call (sync or async). .model is the model
+    answering - the requested one, or a hedge's fallback once it wins.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.stream = None
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def __aiter__(self):
+        return self.stream.__aiter__()
+
+def llm_chat(message: str, model: str = "llama-3.3-70b", cache: bool = True, history: list = None) -> str:
+    """Main chat function - serves from the response cache or routes to the provider"""
+    key = _cache_key(message, model, cache, history)
+    if key:
+        cached = _cache_get(key, message, model, history)
+        if cached is not None:
+            return cached
+    _admit(model, estimate_tokens(message, history))
+    response = _direct_chat(message, model, history)
+    if key:
+        _cache_put(key, message, model, response, history)
+    return response
+
+def llm_chat_stream(message: str, model: str = "llama-3.3-70b", hedge: bool = None, cache: bool = True, history: list = None):
+    """Streaming counterpart of llm_chat - an iterable of text deltas with .model (the model answering)"""
+    key = _cache_key(message, model, cache, history)
+    if key:
+        cached = _cache_get(key, message, model, history)
+        if cached is not None:
+            return CachedReply(cached, model)
+    reply = ModelReply(model)
+    if HEDGING_ENABLED if hedge is None else hedge:
+        stream = _hedged_stream(message, model, history, reply)
+    else:
+        stream = _timed_stream(message, model, history)
+    stream = _admitted_stream(model, estimate_tokens(message, history), stream)
+    reply.stream = _caching_stream(key, message, model, history, stream, reply) if key else stream
+    return reply
+
+def llm_chat_astream(message: str, model: str = "llama-3.3-70b", hedge: bool = None, cache: bool = True, history: list = None):
+    """Async counterpart of llm_chat_stream - an async iterable of deltas with .model"""
+    key = _cache_key(message, model, cache, history)
+    if key:
+        cached = _cache_get(key, message, model, history)
+        if cached is not None:
+            return CachedReply(cached, model)
+    reply = ModelReply(model)
+    if HEDGING_ENABLED if hedge is None else hedge:
+        stream = _hedged_astream(message, model, history, reply)
+    else:
+        stream = _timed_astream(message, model, history)
+    stream = _admitted_astream(model, estimate_tokens(message, history), stream)
+    reply.stream = _caching_astream(key, message, model, history, stream, reply) if key else stream
+    return reply
+
 def get_available_models():
     """Return available models for the frontend"""
     providers = {}
@@ -1,12 +1,155 @@
-chat_history = []
+"""
+Conversation Memory - bounded, thread-safe per-conversation turn store
+Each conversation keeps its recent turns in a deque(maxlen=MAX_HISTORY_LENGTH).
+Idle conversations are evicted LRU-first when either the conversation count
+or the total content size passes its cap. The context builder reads warm
+conversations from here without touching the database.
+"""
 
-def save_memory(user, bot):
-    chat_history.append({"role": "user", "content": user})
-    chat_history.append({"role": "assistant", "content": bot})
+import os
+import threading
+from collections import OrderedDict, deque
 
-    if len(chat_history) > 10:
-        chat_history.pop(0)
-        chat_history.pop(0)
+from config import Config
 
-def get_memory():
-    return chat_history
+MAX_CONVERSATIONS = int(os.getenv("MEMORY_MAX_CONVERSATIONS", 512))
+MAX_BYTES = int(os.getenv("MEMORY_MAX_BYTES", 32 * 1024 * 1024))
+
+
+class Turn:
+    """One stored message; token estimates are filled in lazily per model family"""
+    __slots__ = ("id", "role", "content", "size", "tokens")
+
+    def __init__(self, id, role, content):
+        self.id = id
+        self.role = role
+        self.content = content
+        self.size = len(content.encode("utf-8"))
+        self.tokens = {}
+
+
+class _Conversation:
+    __slots__ = ("turns", "bytes", "last_id", "summary", "summary_through")
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.bytes = 0
+        self.last_id = 0
+        self.summary = None
+        self.summary_through = 0
+
+    def push(self, turn):
+        if len(self.turns) == self.turns.maxlen:
+            self.bytes -= self.turns[0].size
+        self.turns.append(turn)
+        self.bytes += turn.size
+        self.last_id = max(self.last_id, turn.id)
+
+
+class ConversationMemory:
+    """LRU map of conversation_id -> recent turns, capped by count and bytes"""
+
+    def __init__(self, max_conversations=MAX_CONVERSATIONS, max_bytes=MAX_BYTES,
+                 max_turns=Config.MAX_HISTORY_LENGTH):
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self._conversations = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self, keep):
+        """Drop least recently used conversations until under both caps (lock held)"""
+        while (len(self._conversations) > self.max_conversations or self._bytes > self.max_bytes) \
+                and len(self._conversations) > 1:
+            conversation_id, conversation = next(iter(self._conversations.items()))
+            if conversation_id == keep:
+                self._conversations.move_to_end(conversation_id)
+                continue
+            del self._conversations[conversation_id]
+            self._bytes -= conversation.bytes
+            self.evictions += 1
+
+    def snapshot(self, conversation_id):
+        """(summary, summary_through, turns) for a warm conversation, else None"""
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conversations.move_to_end(conversation_id)
+            return conversation.summary, conversation.summary_through, list(conversation.turns)
+
+    def load(self, conversation_id, rows, summary=None, summary_through=0):
+        """Warm a conversation from (id, role, content) rows, oldest first"""
+        conversation = _Conversation(self.max_turns)
+        conversation.summary = summary
+        conversation.summary_through = conversation.last_id = summary_through
+        for row_id, role, content in rows:
+            conversation.push(Turn(row_id, role, content))
+        with self._lock:
+            old = self._conversations.pop(conversation_id, None)
+            if old:
+                self._bytes -= old.bytes
+            self._conversations[conversation_id] = conversation
+            self._bytes += conversation.bytes
+            self._evict(keep=conversation_id)
+
+    def append(self, conversation_id, turn_id, role, content):
+        """Record a freshly saved message; cold conversations are left to load()"""
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                return
+            if turn_id <= conversation.last_id:
+                # Out-of-order write (two tabs racing) - reload from the DB next time
+                del self._conversations[conversation_id]
+                self._bytes -= conversation.bytes
+                return
+            before = conversation.bytes
+            conversation.push(Turn(turn_id, role, content))
+            self._bytes += conversation.bytes - before
+            self._conversations.move_to_end(conversation_id)
+            self._evict(keep=conversation_id)
+
+    def set_summary(self, conversation_id, summary, through_id):
+        """Swap turns up to through_id for the new summary"""
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                return
+            conversation.summary = summary
+            conversation.summary_through = through_id
+            while conversation.turns and conversation.turns[0].id <= through_id:
+                dropped = conversation.turns.popleft()
+                conversation.bytes -= dropped.size
+                self._bytes -= dropped.size
+
+    def invalidate(self, conversation_id=None):
+        """Forget one conversation (or all of them)"""
+        with self._lock:
+            if conversation_id is None:
+                self._conversations.clear()
+                self._bytes = 0
+                return
+            conversation = self._conversations.pop(conversation_id, None)
+            if conversation:
+                self._bytes -= conversation.bytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "conversations": len(self._conversations),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+conversation_memory = ConversationMemory()
@@ -1,47 +1,44 @@
 """
 Database Migration Script
-Adds UsageTracking table to existing database without losing data
-Run this ONCE after deploying the new code
+Creates missing tables, then applies pending versioned migrations
+(see migrations.py) to the existing database without losing data
+Safe to run any time - already-applied migrations are skipped
 """
 
-from flask import Flask
+from sqlalchemy import create_engine, func, select
+
+from db_engine import tune_engine
+from migrations import DATABASE_PATH, MIGRATIONS, current_version, upgrade
 from models import db, UsageTracking, Conversation, Message
-from datetime import datetime, timezone
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chat_history.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+def migrate():
+    """Create missing tables and bring the schema up to date"""
+    engine = tune_engine(create_engine(f"sqlite:///{DATABASE_PATH}"))
+    print("🔄 Starting migration...")
+
+    # Create all tables (new tables only - existing ones are left alone)
+    db.metadata.create_all(engine)
+    applied = upgrade(engine)
 
-db.init_app(app)
+    print("✅ Migration complete!")
+    print(f"📦 Schema version {current_version(engine)} / {MIGRATIONS[-1][0]} ({len(applied)} applied now)")
 
-def migrate():
-    """Add UsageTracking table to database"""
-    with app.app_context():
-        print("🔄 Starting migration...")
-        
-        # Create all tables (this will add UsageTracking if it doesn't exist)
-        db.create_all()
-        
-        print("✅ Migration complete!")
-        print("📊 Database tables:")
-        print("  - conversations")
-        print("  - messages")
-        print("  - usage_tracking (NEW)")
-        
-        # Verify existing data
-        conv_count = Conversation.query.count()
-        msg_count = Message.query.count()
-        usage_count = UsageTracking.query.count()
-        
-        print(f"\n📈 Current data:")
-        print(f"  - Conversations: {conv_count}")
-        print(f"  - Messages: {msg_count}")
-        print(f"  - Usage records: {usage_count}")
-        
-        if conv_count > 0:
-            print("\n✅ Your existing conversations are safe!")
-        
-        print("\n🎉 You can now restart your server with the new code.")
+    # Verify existing data
+    with engine.connect() as conn:
+        conv_count = conn.execute(select(func.count()).select_from(Conversation.__table__)).scalar()
+        msg_count = conn.execute(select(func.count()).select_from(Message.__table__)).scalar()
+        usage_count = conn.execute(select(func.count()).select_from(UsageTracking.__table__)).scalar()
+    engine.dispose()
+
+    print(f"\n📈 Current data:")
+    print(f"  - Conversations: {conv_count}")
+    print(f"  - Messages: {msg_count}")
+    print(f"  - Usage records: {usage_count}")
+
+    if conv_count > 0:
+        print("\n✅ Your existing conversations are safe!")
+
+    print("\n🎉 You can now restart your server with the new code.")
 
 if __name__ == "__main__":
-    migrate()
\ No newline at end of file
+    migrate()
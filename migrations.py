@@ -0,0 +1,283 @@
+"""
+Migrations - versioned schema changes for chat_history.db
+db.create_all() only creates missing tables; it cannot add columns or
+indexes to tables that already exist. Each migration here runs once, in
+order, inside its own transaction, and is recorded in schema_version.
+Steps are idempotent (IF NOT EXISTS / column checks) so they are also safe
+on a fresh database that create_all() just built from models.py.
+
+Run with:  python migrations.py [status|upgrade]
+App startup calls upgrade() automatically.
+
+The FTS sync triggers come in two variants (install_fts_triggers). Until a
+message body is stored compressed they read messages.content directly, so
+any SQLite client (sqlite3 CLI, backup/restore tools) can write to
+messages; once compression is on or a compressed row exists they read
+through message_body(), which only connections set up by db_engine.py have.
+"""
+
+import os
+import sys
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+
+from compression import COMPRESSION
+from models import db, Conversation, Message
+
+DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "chat_history.db")
+
+
+# ── Helpers ─────────────────────────────────────────────────────────────────
+
+def has_column(conn, table, column):
+    rows = conn.exec_driver_sql(f"PRAGMA table_info({table})").all()
+    return any(row[1] == column for row in rows)
+
+
+def add_column(conn, table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN unless it is already there (ddl = type + constraints)"""
+    if not has_column(conn, table, column):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def create_index(conn, name, table, columns, unique=False):
+    unique_sql = "UNIQUE " if unique else ""
+    conn.exec_driver_sql(
+        f"CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+    )
+
+
+# ── Migrations ──────────────────────────────────────────────────────────────
+# Append only - never renumber or edit one that has shipped.
+
+def _messages_history_index(conn):
+    # Serves history pages and the sidebar's per-conversation COUNT
+    create_index(conn, "ix_messages_conversation_timestamp_id", "messages",
+                 ["conversation_id", "timestamp", "id"])
+
+
+def _conversations_updated_at_index(conn):
+    # Sidebar ordering / keyset cursor
+    create_index(conn, "ix_conversations_updated_at_id", "conversations", ["updated_at", "id"])
+
+
+def _messages_fts(conn):
+    # External-content FTS5 index over messages.content, kept current by triggers
+    # (so write-behind batches, bulk deletes and imports all stay in sync)
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "content, content='messages', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+        "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END"
+    )
+    # Index whatever history already exists
+    conn.exec_driver_sql("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+
+def _compressed_message_bodies(conn):
+    # Bodies may now live compressed in content_z; the FTS index reads plain
+    # text through a view using message_body() (registered by db_engine.py)
+    add_column(conn, "messages", "content_z", "BLOB")
+    for trigger in ("messages_fts_insert", "messages_fts_delete", "messages_fts_update"):
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.exec_driver_sql("DROP TABLE IF EXISTS messages_fts")
+    conn.exec_driver_sql(
+        "CREATE VIEW IF NOT EXISTS messages_plain AS "
+        "SELECT id, message_body(content, content_z) AS content FROM messages"
+    )
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE messages_fts USING fts5("
+        "content, content='messages_plain', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts(rowid, content) VALUES (new.id, message_body(new.content, new.content_z)); END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, content) "
+        "VALUES ('delete', old.id, message_body(old.content, old.content_z)); END"
+    )
+    conn.exec_driver_sql(
+        # Re-compressing a body leaves its text alone - skip the FTS delete + re-insert
+        "CREATE TRIGGER messages_fts_update AFTER UPDATE OF content, content_z ON messages "
+        "WHEN message_body(old.content, old.content_z) IS NOT message_body(new.content, new.content_z) BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, content) "
+        "VALUES ('delete', old.id, message_body(old.content, old.content_z)); "
+        "INSERT INTO messages_fts(rowid, content) VALUES (new.id, message_body(new.content, new.content_z)); END"
+    )
+    conn.exec_driver_sql("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+
+def _autoincrement_ids(conn):
+    # Plain INTEGER PRIMARY KEY hands out max(id) + 1, so once archive.py has
+    # moved the newest conversations out their ids come back and collide with
+    # the archived ones. Rebuild both tables with AUTOINCREMENT, keeping every
+    # id (messages_fts is keyed on messages.id). The view and triggers reading
+    # messages are dropped first - the rename re-checks the schema - and put
+    # back afterwards.
+    conn.exec_driver_sql("DROP VIEW IF EXISTS messages_plain")
+    for trigger in ("messages_fts_insert", "messages_fts_delete", "messages_fts_update"):
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+    for table in (Conversation.__table__, Message.__table__):
+        ddl = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)).scalar()
+        if "AUTOINCREMENT" in ddl.upper():
+            continue
+        columns = ", ".join(column.name for column in table.columns)
+        create_sql = str(CreateTable(table).compile(dialect=conn.dialect))
+        conn.exec_driver_sql(create_sql.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {table.name}_new ", 1))
+        conn.exec_driver_sql(f"INSERT INTO {table.name}_new ({columns}) SELECT {columns} FROM {table.name}")
+        conn.exec_driver_sql(f"DROP TABLE {table.name}")
+        conn.exec_driver_sql(f"ALTER TABLE {table.name}_new RENAME TO {table.name}")
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    conn.exec_driver_sql(
+        "CREATE VIEW messages_plain AS "
+        "SELECT id, message_body(content, content_z) AS content FROM messages"
+    )
+    install_fts_triggers(conn, _wants_message_body(conn))
+
+
+# ── FTS sync triggers ───────────────────────────────────────────────────────
+
+def _fts_trigger_sql(use_message_body):
+    if use_message_body:
+        new_body = "message_body(new.content, new.content_z)"
+        old_body = "message_body(old.content, old.content_z)"
+        # Re-compressing a body leaves its text alone - skip the FTS delete + re-insert
+        update_on = f"UPDATE OF content, content_z ON messages WHEN {old_body} IS NOT {new_body}"
+    else:
+        new_body, old_body = "new.content", "old.content"
+        update_on = "UPDATE OF content ON messages"
+    return [
+        "CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN "
+        f"INSERT INTO messages_fts(rowid, content) VALUES (new.id, {new_body}); END",
+        "CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN "
+        f"INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, {old_body}); END",
+        f"CREATE TRIGGER messages_fts_update AFTER {update_on} BEGIN "
+        f"INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, {old_body}); "
+        f"INSERT INTO messages_fts(rowid, content) VALUES (new.id, {new_body}); END",
+    ]
+
+
+def install_fts_triggers(conn, use_message_body):
+    """(Re)create the FTS sync triggers in the wanted variant; returns True if they changed"""
+    current = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'messages_fts_insert'").scalar()
+    if current is not None and ("message_body" in current) == use_message_body:
+        return False
+    for trigger in ("messages_fts_insert", "messages_fts_delete", "messages_fts_update"):
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+    for sql in _fts_trigger_sql(use_message_body):
+        conn.exec_driver_sql(sql)
+    return True
+
+
+def _wants_message_body(conn):
+    return COMPRESSION != "off" or bool(conn.exec_driver_sql(
+        "SELECT EXISTS (SELECT 1 FROM messages WHERE content_z IS NOT NULL)").scalar())
+
+
+def sync_fts_triggers(engine):
+    """
+    message_body() triggers only while compression is on or compressed rows
+    exist (deleting one needs its plain text); plain-content triggers otherwise
+    """
+    with engine.begin() as conn:
+        if not conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'").scalar():
+            return
+        use_message_body = _wants_message_body(conn)
+        if install_fts_triggers(conn, use_message_body):
+            print(f"🔧 FTS triggers now read {'message_body()' if use_message_body else 'messages.content'}")
+
+
+MIGRATIONS = [
+    (1, "messages (conversation_id, timestamp, id) index", _messages_history_index),
+    (2, "conversations (updated_at, id) index", _conversations_updated_at_index),
+    (3, "messages_fts full-text index + sync triggers", _messages_fts),
+    (4, "messages.content_z compressed bodies; FTS reads messages_plain", _compressed_message_bodies),
+    (5, "conversations / messages ids never reused (AUTOINCREMENT)", _autoincrement_ids),
+]
+
+
+# ── Runner ──────────────────────────────────────────────────────────────────
+
+def _ensure_version_table(conn):
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, applied_at DATETIME NOT NULL)"
+    )
+
+
+def current_version(engine):
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return conn.exec_driver_sql("SELECT COALESCE(MAX(version), 0) FROM schema_version").scalar()
+
+
+def pending(engine):
+    version = current_version(engine)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def upgrade(engine):
+    """Apply every pending migration, then pick the FTS trigger variant; returns the versions applied"""
+    applied = []
+    for version, name, step in pending(engine):
+        try:
+            with engine.begin() as conn:
+                step(conn)
+                conn.execute(
+                    text("INSERT INTO schema_version (version, name, applied_at) VALUES (:v, :n, :t)"),
+                    {"v": version, "n": name, "t": datetime.now(timezone.utc).replace(tzinfo=None)}
+                )
+        except IntegrityError:
+            # Another worker process applied it first
+            continue
+        print(f"🔧 Migration {version}: {name}")
+        applied.append(version)
+    sync_fts_triggers(engine)
+    return applied
+
+
+def main():
+    # Plain engine on the app's DB file - importing app would upgrade on startup
+    from db_engine import tune_engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    engine = tune_engine(create_engine(f"sqlite:///{DATABASE_PATH}"))
+    if command == "status":
+        print(f"📦 Schema version {current_version(engine)} / {MIGRATIONS[-1][0]}")
+        for version, name, _ in pending(engine):
+            print(f"  pending {version}: {name}")
+    elif command == "upgrade":
+        os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+        db.metadata.create_all(engine)
+        upgrade(engine)
+        print(f"✅ Schema at version {current_version(engine)}")
+    else:
+        print("Usage: python migrations.py [status|upgrade]")
+        sys.exit(1)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.hybrid import hybrid_property
 from datetime import datetime, timezone
 
+from compression import compress_body, message_body
+
 db = SQLAlchemy()
 
 class Conversation(db.Model):
@@ -14,6 +17,14 @@ class Conversation(db.Model):
     
     # Relationship to messages
     messages = db.relationship('Message', backref='conversation', lazy=True, cascade='all, delete-orphan')
+    summary = db.relationship('ConversationSummary', backref='conversation', uselist=False, lazy=True, cascade='all, delete-orphan')
+    
+    # Sidebar pages are read newest-first by (updated_at, id). AUTOINCREMENT: ids of
+    # archived (deleted) conversations must never be handed out again (archive.py)
+    __table_args__ = (
+        db.Index('ix_conversations_updated_at_id', 'updated_at', 'id'),
+        {'sqlite_autoincrement': True},
+    )
     
     def __repr__(self):
         return f'<Conversation {self.id}: {self.title}>'
@@ -26,13 +37,54 @@ class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
-    content = db.Column(db.Text, nullable=False)
+    # Plain body, or '' when the body is stored compressed in content_z (see compression.py)
+    _content = db.Column('content', db.Text, nullable=False)
+    content_z = db.Column(db.LargeBinary, nullable=True)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     
+    @hybrid_property
+    def content(self):
+        return message_body(self._content, self.content_z)
+    
+    @content.setter
+    def content(self, text):
+        blob = compress_body(text)
+        self._content = "" if blob is not None else text
+        self.content_z = blob
+    
+    @content.expression
+    def content(cls):
+        # SQL function registered on every connection by db_engine.py
+        return db.func.message_body(cls._content, cls.content_z)
+    
+    # History pages are read newest-first by (timestamp, id) within one conversation
+    __table_args__ = (
+        db.Index('ix_messages_conversation_timestamp_id', 'conversation_id', 'timestamp', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+    
     def __repr__(self):
         return f'<Message {self.id}: {self.role}>'
 
 
+class ConversationSummary(db.Model):
+    """
+    Rolling summary of a conversation's older turns
+    Written by summarizer.py off the request path; the context builder
+    sends it in place of every message up to covers_through_id
+    """
+    __tablename__ = 'conversation_summaries'
+    
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), primary_key=True)
+    summary = db.Column(db.Text, nullable=False)
+    covers_through_id = db.Column(db.Integer, nullable=False)  # Last Message.id folded into the summary
+    model = db.Column(db.String(50))  # Model that wrote it
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    
+    def __repr__(self):
+        return f'<ConversationSummary {self.conversation_id} through {self.covers_through_id}>'
+
+
 class UsageTracking(db.Model):
     """
     API Usage Tracking - Persistent across server restarts
@@ -47,4 +99,31 @@ class UsageTracking(db.Model):
     updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     
     def __repr__(self):
-        return f'<UsageTracking {self.provider}: {self.count} on {self.date}>'
\ No newline at end of file
+        return f'<UsageTracking {self.provider}: {self.count} on {self.date}>'
+
+
+class KeyUsage(db.Model):
+    """
+    Daily usage per API key and model
+    Request and token counts from the provider's usage fields, written by
+    usage_tracker.py; one row per (provider, key_index, model_id, date)
+    """
+    __tablename__ = 'key_usage'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(50), nullable=False)
+    key_index = db.Column(db.Integer, nullable=False)  # 0-based position in the provider's KeyPool
+    model_id = db.Column(db.String(100), nullable=False)  # Provider model id, e.g. 'llama-3.3-70b-versatile'
+    date = db.Column(db.Date, nullable=False)  # UTC day
+    requests = db.Column(db.Integer, default=0, nullable=False)
+    prompt_tokens = db.Column(db.Integer, default=0, nullable=False)
+    completion_tokens = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        db.UniqueConstraint('provider', 'key_index', 'model_id', 'date', name='uq_key_usage'),
+        db.Index('ix_key_usage_date', 'date'),
+    )
+    
+    def __repr__(self):
+        return f'<KeyUsage {self.provider} #{self.key_index + 1} {self.model_id}: {self.requests} on {self.date}>'
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""
+Queries - keyset-paginated statements behind the sidebar and history views
+Built as plain SELECTs so app.py executes them and bench_query_plans.py can
+EXPLAIN exactly the same SQL.
+"""
+
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, func, or_, select
+
+from models import Conversation, Message
+
+
+def parse_timestamp(value):
+    """ISO-8601 (a page cursor or an imported row) -> naive UTC datetime, how SQLite stores our timestamps"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def keyset(sort_column, id_column, before, before_id):
+    """Rows strictly after the (before, before_id) cursor in DESC order"""
+    if before_id is None:
+        return sort_column < before
+    return or_(sort_column < before, and_(sort_column == before, id_column < before_id))
+
+
+def conversation_page(before=None, before_id=None, limit=50):
+    """Sidebar page, newest first, with message counts (fetch limit + 1 to detect more)"""
+    message_count = (select(func.count(Message.id))
+                     .where(Message.conversation_id == Conversation.id)
+                     .correlate(Conversation)
+                     .scalar_subquery())
+    stmt = (select(Conversation.id, Conversation.title, Conversation.created_at,
+                   Conversation.updated_at, message_count.label("message_count"))
+            .order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+            .limit(limit + 1))
+    if before is not None:
+        stmt = stmt.where(keyset(Conversation.updated_at, Conversation.id, before, before_id))
+    return stmt
+
+
+def message_page(conversation_id, before=None, before_id=None, limit=50):
+    """History page of one conversation, newest first (fetch limit + 1 to detect more)"""
+    stmt = (select(Message)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(limit + 1))
+    if before is not None:
+        stmt = stmt.where(keyset(Message.timestamp, Message.id, before, before_id))
+    return stmt
@@ -0,0 +1,146 @@
+"""
+Rate Limiter - token buckets consulted before a request leaves the process
+Without these we only learn about a limit from a provider 429, after a
+wasted round-trip. Two kinds of bucket:
+
+- per provider key: requests and tokens per minute (<PROVIDER>_KEY_RPM /
+  <PROVIDER>_KEY_TPM, 0 = unlimited). KeyPool skips keys whose buckets
+  can't cover a request; llm.py waits up to RATE_LIMIT_MAX_WAIT seconds for
+  one to refill and otherwise raises RateLimited.
+- per end user: Config.RATE_LIMIT requests per hour, checked by app.py and
+  asgi.py before anything else. Over the limit is rejected straight away.
+  Off by default: users are told apart by IP, and behind a proxy (Render)
+  every request arrives from the proxy unless TRUSTED_PROXY_HOPS is set, so
+  the whole site would share one bucket.
+
+Buckets refill continuously and are only touched by the requests that use
+them - no background thread.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 5))       # Seconds a request may queue for a key
+COMPLETION_TOKENS_ESTIMATE = int(os.getenv("RATE_LIMIT_COMPLETION_TOKENS", 512))
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", 0))         # Proxies in front of the app (for X-Forwarded-For)
+MAX_TRACKED_USERS = 10000       # Least recently seen users beyond this are forgotten
+CHARS_PER_TOKEN = 3.5           # Same default ratio as context_builder
+
+
+class RateLimited(Exception):
+    """A request refused before dispatch; retry_after is in seconds"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """`capacity` units, refilled evenly over `period` seconds"""
+
+    def __init__(self, capacity, period):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _wait(self, amount):
+        # More than a full bucket can never fit - wait for a full one instead
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def wait_time(self, amount=1):
+        """Seconds until `amount` units are available (0 = now)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._wait(amount)
+
+    def take(self, amount=1):
+        """Take `amount` units if available now; returns the seconds to wait otherwise (0 = taken)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = self._wait(amount)
+            if wait == 0:
+                self.level -= amount
+            return wait
+
+    def charge(self, amount):
+        """Adjust by a correction (negative refunds); the level may go below zero"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level - amount)
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, self.level)
+
+
+def minute_bucket(per_minute):
+    """Bucket for a per-minute limit, or None when the limit is 0 (unlimited)"""
+    return TokenBucket(per_minute, 60.0) if per_minute > 0 else None
+
+
+def estimate_tokens(message, history=None, completion=COMPLETION_TOKENS_ESTIMATE):
+    """Rough prompt + completion tokens for a request, reserved against TPM until the real usage is known"""
+    chars = len(message) + sum(len(msg.get("content", "")) for msg in history or ())
+    return int(chars / CHARS_PER_TOKEN) + completion
+
+
+# ── Per-user limit ──────────────────────────────────────────────────────────
+
+class UserLimiter:
+    """One hourly bucket per end user, kept for the MAX_TRACKED_USERS most recent users"""
+
+    def __init__(self, per_hour, max_users=MAX_TRACKED_USERS):
+        self.per_hour = per_hour
+        self.max_users = max_users
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, user):
+        """Count one request for `user`; returns 0 if admitted, else seconds until it would be"""
+        if self.per_hour <= 0:
+            return 0.0
+        with self._lock:
+            bucket = self._buckets.get(user)
+            if bucket is None:
+                bucket = self._buckets[user] = TokenBucket(self.per_hour, 3600.0)
+                if len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(user)
+        return bucket.take()
+
+    def stats(self):
+        with self._lock:
+            return {"per_hour": self.per_hour, "tracked_users": len(self._buckets)}
+
+
+user_limiter = UserLimiter(Config.RATE_LIMIT)
+if user_limiter.per_hour > 0 and not TRUSTED_PROXY_HOPS:
+    print(f"⚠️ RATE_LIMIT={user_limiter.per_hour}/hour is keyed on the peer address with TRUSTED_PROXY_HOPS=0 - "
+          "behind a proxy every user shares one bucket")
+
+
+def client_id(remote_addr, forwarded_for=None):
+    """End-user key: the peer address, or the client seen by the outermost of TRUSTED_PROXY_HOPS proxies"""
+    if TRUSTED_PROXY_HOPS and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return remote_addr or "unknown"
+
+
+def user_limit_message(retry_after):
+    return (f"⏳ You've reached the limit of {user_limiter.per_hour} messages per hour. "
+            f"Please try again in {max(1, round(retry_after))}s.")
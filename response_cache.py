@@ -0,0 +1,160 @@
+"""
+Response Cache - exact-match cache for LLM completions
+Keyed on normalized prompt + model_id + sampling params. In-memory LRU with
+TTL and a byte cap, plus an optional SQLite tier (RESPONSE_CACHE_DB) so hot
+answers like the suggestion chips survive restarts.
+
+Opt-in (RESPONSE_CACHE=1): completions are sampled at TEMPERATURE > 0, so
+a cached one replays a single sample - a resend would get the exact same
+answer. Clients can also skip it per request ("cache": false in /api/chat).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "0") == "1"
+CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600))                  # seconds
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB")                          # unset = memory only
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Canonical form for cache keys - whitespace noise only, case and indentation kept"""
+    text = unicodedata.normalize("NFC", prompt).replace("\r\n", "\n")
+    return "\n".join(line.rstrip() for line in text.strip().split("\n"))
+
+
+def make_key(prompt: str, model_id: str, **params) -> str:
+    payload = json.dumps([normalize_prompt(prompt), model_id, params], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU + TTL cache with a byte cap and optional SQLite tier"""
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES,
+                 max_bytes=CACHE_MAX_BYTES, db_path=CACHE_DB_PATH):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        self._db_path = db_path
+        if db_path:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS response_cache ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+
+    def _connect(self):
+        return sqlite3.connect(self._db_path, timeout=5)
+
+    # ── memory tier ────────────────────────────────────────────────────────
+
+    def _store(self, key, value, expires_at):
+        """Insert into memory tier and evict down to the caps (lock held)"""
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old:
+            self._bytes -= old[2]
+        self._entries[key] = (value, expires_at, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                value, expires_at, size = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self._bytes -= size
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._store(key, value, now + self.ttl)
+        return value
+
+    def put(self, key, value):
+        if not value:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, value, expires_at)
+        self._disk_put(key, value, expires_at)
+
+    # ── SQLite tier ────────────────────────────────────────────────────────
+
+    def _disk_get(self, key, now):
+        if not self._db_path:
+            return None
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"⚠️ Response cache read error: {e}")
+            return None
+
+    def _disk_put(self, key, value, expires_at):
+        if not self._db_path:
+            return
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            print(f"⚠️ Response cache write error: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": CACHE_ENABLED,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "persistent": bool(self._db_path)
+            }
+
+
+response_cache = ResponseCache()
@@ -1,4 +1,222 @@
-from llm import llm_chat
+"""
+Router - picks which model actually serves a request
+Each model in AVAILABLE_MODELS has an ordered "fallbacks" chain. The
+requested model is kept while it is healthy; otherwise (or when a chain
+member is clearly faster) the best member by recent p50 latency and success
+rate is used, and the rest of the chain is tried if it fails.
+"""
 
-def route_message(message: str, model: str = "openai/gpt-oss-120b"):
-    return llm_chat(message, model=model)
+import statistics
+import threading
+import time
+from collections import deque
+
+from llm import AVAILABLE_MODELS, KEY_POOLS, CachedReply, llm_chat, llm_chat_stream, llm_chat_astream
+
+STATS_WINDOW = 50            # Recent outcomes kept per model
+MIN_SUCCESS_RATE = 0.5       # Below this the requested model is considered unhealthy
+LATENCY_SWITCH_RATIO = 2.0   # Switch away from a healthy model only if another is this much faster
+
+
+class ModelStats:
+    """Rolling latency / success window for one model"""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=STATS_WINDOW)
+        self.outcomes = deque(maxlen=STATS_WINDOW)
+
+    def record(self, ok, latency=None):
+        self.outcomes.append(ok)
+        if ok and latency is not None:
+            self.latencies.append(latency)
+
+    def p50(self):
+        return statistics.median(self.latencies) if self.latencies else None
+
+    def success_rate(self):
+        if not self.outcomes:
+            return 1.0
+        return sum(self.outcomes) / len(self.outcomes)
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(model, ok, latency=None):
+    with _stats_lock:
+        _stats.setdefault(model, ModelStats()).record(ok, latency)
+
+
+def _provider_ready(model):
+    """Configured and at least one key not cooling down"""
+    info = AVAILABLE_MODELS.get(model)
+    if not info:
+        return False
+    pool = KEY_POOLS.get(info["provider"])
+    return bool(pool) and pool.next_available_in() == 0
+
+
+def _score(model):
+    """Lower is better: p50 latency inflated by the failure rate (no data sorts last)"""
+    with _stats_lock:
+        stats = _stats.get(model)
+        p50 = stats.p50() if stats else None
+        rate = stats.success_rate() if stats else 1.0
+    if p50 is None:
+        return float("inf")
+    return p50 / max(rate, 0.05)
+
+
+def fallback_chain(model):
+    """Requested model followed by its configured fallbacks"""
+    if model not in AVAILABLE_MODELS:
+        model = "llama-3.3-70b"
+    chain = [model]
+    for candidate in AVAILABLE_MODELS[model].get("fallbacks", []):
+        if candidate in AVAILABLE_MODELS and candidate not in chain:
+            chain.append(candidate)
+    return chain
+
+
+def plan_route(model):
+    """Order the fallback chain for this request"""
+    chain = fallback_chain(model)
+    requested = chain[0]
+    ready = [m for m in chain if _provider_ready(m)]
+    if not ready:
+        # Nothing has a free key right now - try the chain as-is and let it fail fast
+        return chain
+
+    # sorted() is stable, so models without data keep their configured chain order
+    others = sorted((m for m in ready if m != requested), key=_score)
+    if requested not in ready:
+        return others
+
+    with _stats_lock:
+        stats = _stats.get(requested)
+        healthy = stats is None or stats.success_rate() >= MIN_SUCCESS_RATE
+        requested_p50 = stats.p50() if stats else None
+
+    if healthy and others:
+        with _stats_lock:
+            best = _stats.get(others[0])
+            best_p50 = best.p50() if best else None
+        if requested_p50 is not None and best_p50 is not None \
+                and best_p50 * LATENCY_SWITCH_RATIO < requested_p50:
+            healthy = False
+
+    if healthy:
+        return [requested] + others
+    return others + [requested]
+
+
+def route_message(message: str, model: str = "openai/gpt-oss-120b", history: list = None, cache: bool = True):
+    last_error = None
+    for candidate in plan_route(model):
+        started = time.monotonic()
+        try:
+            response = llm_chat(message, model=candidate, cache=cache, history=history)
+        except Exception as e:
+            _record(candidate, False)
+            print(f"↪️ {candidate} failed, trying next in chain: {e}")
+            last_error = e
+            continue
+        _record(candidate, True, time.monotonic() - started)
+        return response
+    raise last_error
+
+
+class RoutedStream:
+    """
+    Iterable of text deltas that walks the fallback chain.
+    A model is only abandoned if it fails before its first delta.
+    After iteration, .model is the model that actually answered and
+    .cached is True if it came from the response cache.
+    """
+
+    def __init__(self, message, model, hedge=None, history=None, cache=True):
+        self.message = message
+        self.requested = model
+        self.hedge = hedge
+        self.history = history
+        self.cache = cache
+        self.model = None
+        self.cached = False
+
+    def _first_delta(self, candidate, stream, started):
+        self.model = stream.model   # A hedge may have answered with a fallback model
+        self.cached = isinstance(stream, CachedReply)
+        if not self.cached:
+            _record(candidate, True, time.monotonic() - started)
+
+    def __iter__(self):
+        last_error = None
+        for candidate in plan_route(self.requested):
+            started = time.monotonic()
+            first = True
+            try:
+                stream = llm_chat_stream(self.message, model=candidate, hedge=self.hedge, cache=self.cache, history=self.history)
+                for delta in stream:
+                    if first:
+                        first = False
+                        self._first_delta(candidate, stream, started)
+                    yield delta
+            except Exception as e:
+                if not first:
+                    raise
+                _record(candidate, False)
+                print(f"↪️ {candidate} failed, trying next in chain: {e}")
+                last_error = e
+                continue
+            if first:
+                # Empty but successful completion
+                self.model = stream.model
+                _record(candidate, True, time.monotonic() - started)
+            return
+        raise last_error
+
+    async def __aiter__(self):
+        last_error = None
+        for candidate in plan_route(self.requested):
+            started = time.monotonic()
+            first = True
+            try:
+                stream = llm_chat_astream(self.message, model=candidate, hedge=self.hedge, cache=self.cache, history=self.history)
+                async for delta in stream:
+                    if first:
+                        first = False
+                        self._first_delta(candidate, stream, started)
+                    yield delta
+            except Exception as e:
+                if not first:
+                    raise
+                _record(candidate, False)
+                print(f"↪️ {candidate} failed, trying next in chain: {e}")
+                last_error = e
+                continue
+            if first:
+                self.model = stream.model
+                _record(candidate, True, time.monotonic() - started)
+            return
+        raise last_error
+
+
+def route_message_stream(message: str, model: str = "openai/gpt-oss-120b", hedge=None, history=None, cache=True):
+    return RoutedStream(message, model, hedge=hedge, history=history, cache=cache)
+
+
+def route_message_astream(message: str, model: str = "openai/gpt-oss-120b", hedge=None, history=None, cache=True):
+    return RoutedStream(message, model, hedge=hedge, history=history, cache=cache)
+
+
+def get_routing_stats():
+    """Recent p50 latency and success rate per model"""
+    with _stats_lock:
+        return {
+            model: {
+                "p50_ms": None if stats.p50() is None else round(stats.p50() * 1000),
+                "success_rate": round(stats.success_rate(), 3),
+                "samples": len(stats.outcomes)
+            } for model, stats in _stats.items()
+        }
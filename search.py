@@ -0,0 +1,141 @@
+"""
+Search - full-text search over chat history (SQLite FTS5)
+messages_fts indexes the plain message text through the messages_plain view
+(migrations 3 and 4, kept in sync by triggers), so compressed bodies are
+searchable and snippet() reads them back decompressed. User input is
+reduced to quoted terms so FTS5 syntax in a query can never raise; a
+trailing * on a term makes it a prefix match.
+
+bm25 needs each term's document count, which FTS5 gets by walking the
+term's whole doclist - fine for selective queries, ~40 ms per common word
+at a million messages. So queries with at most RANK_WINDOW matches are
+ranked by bm25; broader ones return the newest matches first, paged
+through the full match set (pages past the first window read it again
+with an OFFSET).
+Snippets are only built for the rows on the page.
+Must be called inside a Flask app context.
+"""
+
+import html
+import re
+
+from sqlalchemy import bindparam, text
+
+from models import db
+
+MAX_TERMS = 12
+RANK_WINDOW = 2000      # Largest match set that still gets bm25-ranked
+SNIPPET_TOKENS = 16
+
+_TERM_RE = re.compile(r"(\w+)(\*?)", re.UNICODE)
+
+# Private-use markers survive html.escape and become <mark> afterwards
+_OPEN, _CLOSE = "\ue000", "\ue001"
+
+_CONVERSATION_FILTER = "AND rowid IN (SELECT id FROM messages WHERE conversation_id = :conversation_id)"
+
+# Newest matches first - FTS5 walks doclists in rowid order, so this stops early
+_CANDIDATES_SQL = """
+    SELECT rowid FROM messages_fts
+    WHERE messages_fts MATCH :query {conversation_filter}
+    ORDER BY rowid DESC LIMIT :window
+"""
+
+# Pages of "recent" results beyond the candidate window
+_RECENT_SQL = """
+    SELECT rowid FROM messages_fts
+    WHERE messages_fts MATCH :query {conversation_filter}
+    ORDER BY rowid DESC LIMIT :limit OFFSET :offset
+"""
+
+_RANKED_SQL = """
+    SELECT rowid, bm25(messages_fts) AS rank FROM messages_fts
+    WHERE messages_fts MATCH :query {conversation_filter}
+    ORDER BY rank LIMIT :limit OFFSET :offset
+"""
+
+_PAGE_SQL = f"""
+    SELECT m.id, m.conversation_id, c.title, m.role, m.timestamp,
+           snippet(messages_fts, 0, '{_OPEN}', '{_CLOSE}', '…', {SNIPPET_TOKENS}) AS snippet
+    FROM messages_fts
+    JOIN messages m ON m.id = messages_fts.rowid
+    JOIN conversations c ON c.id = m.conversation_id
+    WHERE messages_fts MATCH :query AND messages_fts.rowid IN :ids
+"""
+
+
+def to_fts_query(raw: str):
+    """'pyth* flask app' -> '"pyth"* AND "flask" AND "app"'; None when nothing searchable"""
+    terms = []
+    for word, star in _TERM_RE.findall(raw or "")[:MAX_TERMS]:
+        terms.append(f'"{word}"{star}')
+    return " AND ".join(terms) if terms else None
+
+
+def _highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(_OPEN, "<mark>").replace(_CLOSE, "</mark>")
+
+
+def search_messages(raw_query, limit=20, offset=0, conversation_id=None):
+    """
+    One page of hits as (results, has_more, ranking) where ranking is
+    "bm25" or "recent" (newest first, for queries matching too much to rank)
+    """
+    query = to_fts_query(raw_query)
+    if query is None:
+        return [], False, "bm25"
+
+    conversation_filter = _CONVERSATION_FILTER if conversation_id else ""
+    params = {"query": query}
+    if conversation_id:
+        params["conversation_id"] = conversation_id
+
+    candidates = db.session.execute(
+        text(_CANDIDATES_SQL.format(conversation_filter=conversation_filter)),
+        {**params, "window": RANK_WINDOW + 1}
+    ).scalars().all()
+
+    if len(candidates) <= RANK_WINDOW:
+        ranking = "bm25"
+        rows = db.session.execute(
+            text(_RANKED_SQL.format(conversation_filter=conversation_filter)),
+            {**params, "limit": limit + 1, "offset": offset}
+        ).all()
+        ranks = {row.rowid: row.rank for row in rows}
+        page = [row.rowid for row in rows]
+    else:
+        ranking = "recent"
+        ranks = {}
+        if offset + limit + 1 <= len(candidates):
+            page = candidates[offset:offset + limit + 1]
+        else:
+            page = db.session.execute(
+                text(_RECENT_SQL.format(conversation_filter=conversation_filter)),
+                {**params, "limit": limit + 1, "offset": offset}
+            ).scalars().all()
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    if not page:
+        return [], False, ranking
+
+    stmt = (text(_PAGE_SQL)
+            .bindparams(bindparam("ids", expanding=True))
+            .columns(timestamp=db.DateTime))
+    found = {row.id: row for row in db.session.execute(stmt, {"query": query, "ids": page})}
+
+    results = []
+    for message_id in page:
+        row = found.get(message_id)
+        if row is None:
+            continue
+        results.append({
+            "message_id": row.id,
+            "conversation_id": row.conversation_id,
+            "conversation_title": row.title,
+            "role": row.role,
+            "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+            "snippet": _highlight(row.snippet),
+            "rank": round(ranks[message_id], 4) if message_id in ranks else None
+        })
+    return results, has_more, ranking
@@ -0,0 +1,160 @@
+"""
+Semantic Cache - near-duplicate prompt matching for LLM completions
+Prompts are embedded locally (CPU only) as signed, hashed word, word-bigram
+and character trigram vectors and compared by cosine similarity against a
+float32 matrix per model. Catches "what is AI?" vs "what is ai" style
+repeats that the exact-match cache misses; the bigrams keep word order, so
+"is java faster than python" doesn't match its reverse.
+Opt-in (SEMANTIC_CACHE=1) - a fuzzy match can still serve a wrong answer.
+Requires NumPy; disabled without it.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+SEMANTIC_CACHE_ENABLED = NUMPY_AVAILABLE and os.getenv("SEMANTIC_CACHE", "0") == "1"
+EMBED_DIM = 512
+CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 3600))        # seconds
+CAPACITY_PER_MODEL = int(os.getenv("SEMANTIC_CACHE_CAPACITY", 1024))
+MAX_PROMPT_CHARS = 300          # Longer prompts (pasted code etc.) are too risky to match fuzzily
+DEFAULT_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92))
+
+# Stricter matching for models used on math / code where small wording changes matter
+MODEL_THRESHOLDS = {
+    "deepseek/deepseek-r1": 0.96,
+    "qwen/qwen3-32b": 0.96,
+    "openai/gpt-oss-120b": 0.95,
+}
+
+_WORD_RE = re.compile(r"\w+")
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def _bucket(feature: str):
+    """Stable bucket index and sign for a feature"""
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % EMBED_DIM, 1.0 if (value >> 63) & 1 else -1.0
+
+
+def embed(text: str):
+    """L2-normalised float32 vector of hashed word unigrams, word bigrams and char trigrams"""
+    vector = np.zeros(EMBED_DIM, dtype=np.float32)
+    words = _WORD_RE.findall(text.lower())
+    for word in words:
+        index, sign = _bucket("w:" + word)
+        vector[index] += sign * 2.0
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            index, sign = _bucket("c:" + padded[i:i + 3])
+            vector[index] += sign
+    # Adjacent word pairs (with start/end markers) carry the word order
+    for first, second in zip(["^"] + words, words + ["$"]):
+        index, sign = _bucket(f"b:{first} {second}")
+        vector[index] += sign * 2.0
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def _numbers(text: str):
+    """Numbers must match exactly - '2+3' and '2+4' embed almost identically"""
+    return tuple(_NUMBER_RE.findall(text))
+
+
+class _ModelIndex:
+    """Fixed-capacity ring of embeddings + answers for one model"""
+
+    def __init__(self, capacity):
+        self.vectors = np.zeros((capacity, EMBED_DIM), dtype=np.float32)
+        self.expires = np.zeros(capacity, dtype=np.float64)
+        self.responses = [None] * capacity
+        self.numbers = [None] * capacity
+        self.size = 0
+        self.next = 0
+
+    def add(self, vector, numbers, response, expires_at):
+        slot = self.next
+        self.vectors[slot] = vector
+        self.expires[slot] = expires_at
+        self.responses[slot] = response
+        self.numbers[slot] = numbers
+        self.next = (slot + 1) % len(self.responses)
+        self.size = min(self.size + 1, len(self.responses))
+
+    def best(self, vector, numbers, now):
+        if self.size == 0:
+            return None, 0.0
+        sims = self.vectors[:self.size] @ vector
+        sims[self.expires[:self.size] <= now] = -1.0
+        # Best few candidates, first one whose numbers match wins
+        for slot in np.argsort(-sims)[:5]:
+            slot = int(slot)
+            if self.numbers[slot] == numbers:
+                return slot, float(sims[slot])
+        return None, 0.0
+
+
+class SemanticCache:
+    """Thread-safe per-model semantic cache"""
+
+    def __init__(self, ttl=CACHE_TTL, capacity=CAPACITY_PER_MODEL):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def eligible(prompt: str) -> bool:
+        return SEMANTIC_CACHE_ENABLED and 0 < len(prompt.strip()) <= MAX_PROMPT_CHARS
+
+    def get(self, prompt: str, model_id: str):
+        if not self.eligible(prompt):
+            return None
+        vector = embed(prompt)
+        threshold = MODEL_THRESHOLDS.get(model_id, DEFAULT_THRESHOLD)
+        with self._lock:
+            index = self._indexes.get(model_id)
+            slot, score = (None, 0.0) if index is None else index.best(vector, _numbers(prompt), time.time())
+            if slot is None or score < threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return index.responses[slot]
+
+    def put(self, prompt: str, model_id: str, response: str):
+        if not response or not self.eligible(prompt):
+            return
+        vector = embed(prompt)
+        with self._lock:
+            index = self._indexes.get(model_id)
+            if index is None:
+                index = self._indexes[model_id] = _ModelIndex(self.capacity)
+            index.add(vector, _numbers(prompt), response, time.time() + self.ttl)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": SEMANTIC_CACHE_ENABLED,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": sum(index.size for index in self._indexes.values()),
+                "bytes": sum(index.vectors.nbytes for index in self._indexes.values())
+            }
+
+
+semantic_cache = SemanticCache()
@@ -15,9 +15,21 @@ class AddOnChtHistryDBCpyBtn {
         this.searchStartTime = null;
         this.searchTimerInterval = null;
         this.currentAbortController = null;
+        this.lastSentMessage = null;
         this.isSearching = false;
         this.userScrolled = false;
 
+        this.conversationPageSize = 30;
+        this.conversationCursor = null;
+        this.hasMoreConversations = false;
+        this.loadingConversations = false;
+        this.loadMoreItem = null;
+
+        this.messagePageSize = 50;
+        this.messageCursor = null;
+        this.hasOlderMessages = false;
+        this.loadingOlderMessages = false;
+
         this.initializeElements();
         this.attachEventListeners();
         this.loadConversations();
@@ -46,11 +58,21 @@ class AddOnChtHistryDBCpyBtn {
         this.selectedModelName = document.getElementById('selectedModelName');
         this.scrollBtn = this.createScrollButton();
 
+        // Sidebar: pull the next page of conversations near the bottom
+        const historyScroller = this.historyItems?.closest('.chat-history');
+        if (historyScroller) {
+            historyScroller.addEventListener('scroll', () => {
+                const el = historyScroller;
+                if (el.scrollHeight - el.scrollTop - el.clientHeight < 120) this.loadMoreConversations();
+            });
+        }
+
         if (this.messagesDiv) {
             this.messagesDiv.addEventListener('scroll', () => {
                 const el = this.messagesDiv;
                 const distanceFromBottom = el.scrollHeight - el.scrollTop - el.clientHeight;
                 this.userScrolled = distanceFromBottom > 1;
+                if (el.scrollTop < 150) this.loadOlderMessages();
             });
         }
     }
@@ -280,17 +302,60 @@ class AddOnChtHistryDBCpyBtn {
     }
 
     async loadConversations() {
+        // First page only - older conversations load as the sidebar scrolls
+        this.conversationCursor = null;
+        this.hasMoreConversations = false;
         try {
-            const response = await fetch('/api/conversations');
+            const response = await fetch(`/api/conversations?limit=${this.conversationPageSize}`);
             if (!response.ok) throw new Error('Failed to load conversations');
             const data = await response.json();
             this.renderConversationHistory(data.conversations || []);
+            this.setConversationCursor(data);
             console.log(`📋 Loaded ${data.conversations?.length || 0} conversations`);
         } catch (error) {
             console.error('❌ Error loading conversations:', error);
         }
     }
 
+    async loadMoreConversations() {
+        if (!this.hasMoreConversations || this.loadingConversations) return;
+        this.loadingConversations = true;
+        try {
+            const params = new URLSearchParams({
+                limit: this.conversationPageSize,
+                before: this.conversationCursor.before,
+                before_id: this.conversationCursor.beforeId
+            });
+            const response = await fetch(`/api/conversations?${params}`);
+            if (!response.ok) throw new Error('Failed to load conversations');
+            const data = await response.json();
+            (data.conversations || []).forEach(conv => this.appendConversationItem(conv));
+            this.setConversationCursor(data);
+            console.log(`📋 Loaded ${data.conversations?.length || 0} more conversations`);
+        } catch (error) {
+            console.error('❌ Error loading more conversations:', error);
+        } finally {
+            this.loadingConversations = false;
+        }
+    }
+
+    setConversationCursor(data) {
+        this.hasMoreConversations = !!data.has_more;
+        this.conversationCursor = data.has_more
+            ? { before: data.next_before, beforeId: data.next_before_id }
+            : null;
+        this.loadMoreItem?.remove();
+        this.loadMoreItem = null;
+        if (this.hasMoreConversations && this.historyItems) {
+            // Fallback for when the first page doesn't fill the sidebar enough to scroll
+            this.loadMoreItem = document.createElement('div');
+            this.loadMoreItem.className = 'history-item load-more-item';
+            this.loadMoreItem.innerHTML = `<i class="fas fa-chevron-down"></i><span>Load more</span>`;
+            this.loadMoreItem.addEventListener('click', () => this.loadMoreConversations());
+            this.historyItems.appendChild(this.loadMoreItem);
+        }
+    }
+
     renderConversationHistory(conversations) {
         if (!this.historyItems) return;
         
@@ -303,39 +368,51 @@ class AddOnChtHistryDBCpyBtn {
         this.historyItems.appendChild(newChatItem);
         
         if (conversations && conversations.length > 0) {
-            conversations.forEach(conv => {
-                const item = document.createElement('div');
-                item.className = 'history-item';
-                if (conv.id === this.currentConversationId) item.classList.add('active');
-                
-                item.innerHTML = `
-                    <i class="fas fa-message"></i>
-                    <span class="conversation-title" data-id="${conv.id}">${this.escapeHtml(conv.title)}</span>
-                    <button class="delete-chat-btn" data-id="${conv.id}" title="Delete">
-                        <i class="fas fa-trash"></i>
-                    </button>
-                `;
-                
-                item.addEventListener('click', (e) => {
-                    if (!e.target.closest('.delete-chat-btn')) this.loadConversation(conv.id);
-                });
-                
-                const deleteBtn = item.querySelector('.delete-chat-btn');
-                if (deleteBtn) {
-                    deleteBtn.addEventListener('click', (e) => {
-                        e.stopPropagation();
-                        this.deleteConversation(conv.id);
-                    });
-                }
-                
-                this.historyItems.appendChild(item);
+            conversations.forEach(conv => this.appendConversationItem(conv));
+        }
+    }
+
+    appendConversationItem(conv) {
+        const item = document.createElement('div');
+        item.className = 'history-item';
+        if (conv.id === this.currentConversationId) item.classList.add('active');
+        
+        // Archived by the retention policy - still readable, sending to it restores it
+        if (conv.archived) item.title = 'Archived';
+        
+        item.innerHTML = `
+            <i class="fas ${conv.archived ? 'fa-box-archive' : 'fa-message'}"></i>
+            <span class="conversation-title" data-id="${conv.id}">${this.escapeHtml(conv.title)}</span>
+            <button class="delete-chat-btn" data-id="${conv.id}" title="Delete">
+                <i class="fas fa-trash"></i>
+            </button>
+        `;
+        
+        item.addEventListener('click', (e) => {
+            if (!e.target.closest('.delete-chat-btn')) this.loadConversation(conv.id);
+        });
+        
+        const deleteBtn = item.querySelector('.delete-chat-btn');
+        if (deleteBtn) {
+            deleteBtn.addEventListener('click', (e) => {
+                e.stopPropagation();
+                this.deleteConversation(conv.id);
             });
         }
+        
+        if (this.loadMoreItem) {
+            this.historyItems.insertBefore(item, this.loadMoreItem);
+        } else {
+            this.historyItems.appendChild(item);
+        }
     }
 
     async loadConversation(conversationId) {
+        // Latest page only - older messages load when scrolled to the top
+        this.messageCursor = null;
+        this.hasOlderMessages = false;
         try {
-            const response = await fetch(`/api/conversations/${conversationId}/messages`);
+            const response = await fetch(`/api/conversations/${conversationId}/messages?limit=${this.messagePageSize}`);
             if (!response.ok) throw new Error('Failed to load messages');
             
             const data = await response.json();
@@ -348,6 +425,7 @@ class AddOnChtHistryDBCpyBtn {
             if (data.messages && data.messages.length > 0) {
                 data.messages.forEach(msg => this.displayMessage(msg.content, msg.role, false));
             }
+            this.setMessageCursor(data);
             
             this.updateSidebarActiveState();
             this.scrollToBottom();
@@ -357,6 +435,43 @@ class AddOnChtHistryDBCpyBtn {
         }
     }
 
+    async loadOlderMessages() {
+        if (!this.hasOlderMessages || this.loadingOlderMessages || !this.messagesDiv) return;
+        const conversationId = this.currentConversationId;
+        this.loadingOlderMessages = true;
+        try {
+            const params = new URLSearchParams({
+                limit: this.messagePageSize,
+                before: this.messageCursor.before,
+                before_id: this.messageCursor.beforeId
+            });
+            const response = await fetch(`/api/conversations/${conversationId}/messages?${params}`);
+            if (!response.ok) throw new Error('Failed to load messages');
+            const data = await response.json();
+            if (conversationId !== this.currentConversationId) return;  // switched chats meanwhile
+            
+            // Prepend the page and keep the viewport on the message the user was reading
+            const el = this.messagesDiv;
+            const previousHeight = el.scrollHeight;
+            const anchor = el.firstChild;
+            (data.messages || []).forEach(msg => this.displayMessage(msg.content, msg.role, false, anchor));
+            el.scrollTop += el.scrollHeight - previousHeight;
+            this.setMessageCursor(data);
+            console.log(`📜 Loaded ${data.messages?.length || 0} older messages`);
+        } catch (error) {
+            console.error('❌ Error loading older messages:', error);
+        } finally {
+            this.loadingOlderMessages = false;
+        }
+    }
+
+    setMessageCursor(data) {
+        this.hasOlderMessages = !!data.has_more;
+        this.messageCursor = data.has_more
+            ? { before: data.next_before, beforeId: data.next_before_id }
+            : null;
+    }
+
     updateSidebarActiveState() {
         document.querySelectorAll('.history-item').forEach(item => item.classList.remove('active'));
         
@@ -385,6 +500,8 @@ class AddOnChtHistryDBCpyBtn {
 
     createNewChat() {
         this.currentConversationId = null;
+        this.messageCursor = null;
+        this.hasOlderMessages = false;
         if (this.messagesDiv) this.messagesDiv.innerHTML = '';
         if (this.welcomeScreen) this.welcomeScreen.style.display = 'none';
         if (this.messagesContainer) this.messagesContainer.style.display = 'flex';
@@ -429,7 +546,10 @@ class AddOnChtHistryDBCpyBtn {
         this.showTypingIndicator();
 
         try {
-            await this.fetchBotResponseStreaming(fullMessage);
+            // Sending the same text again asks for a fresh answer, not a cached replay
+            const resend = fullMessage === this.lastSentMessage;
+            this.lastSentMessage = fullMessage;
+            await this.fetchBotResponseStreaming(fullMessage, resend);
         } catch (error) {
             this.hideTypingIndicator();
             this.hideStreamingState();
@@ -442,7 +562,7 @@ class AddOnChtHistryDBCpyBtn {
 
     // ── fetchBotResponseStreaming is patched by logo.js ──
     // ── This fallback runs only if logo.js fails to load ──
-    async fetchBotResponseStreaming(message) {
+    async fetchBotResponseStreaming(message, resend = false) {
         this.currentAbortController = new AbortController();
         this.showStreamingState();
 
@@ -454,7 +574,8 @@ class AddOnChtHistryDBCpyBtn {
                 body: JSON.stringify({
                     message: message,
                     conversation_id: this.currentConversationId,
-                    model: this.selectedModel
+                    model: this.selectedModel,
+                    cache: !resend
                 }),
                 signal: this.currentAbortController.signal,
             });
@@ -695,7 +816,7 @@ class AddOnChtHistryDBCpyBtn {
 
     // ── displayMessage is patched by logo.js ──
     // ── This fallback runs only if logo.js fails to load ──
-    displayMessage(content, role, shouldScroll = true) {
+    displayMessage(content, role, shouldScroll = true, insertBefore = null) {
         if (!this.messagesDiv) return;
         
         const messageDiv = document.createElement('div');
@@ -733,7 +854,11 @@ class AddOnChtHistryDBCpyBtn {
 
         messageDiv.appendChild(avatar);
         messageDiv.appendChild(contentWrapper);
-        this.messagesDiv.appendChild(messageDiv);
+        if (insertBefore) {
+            this.messagesDiv.insertBefore(messageDiv, insertBefore);
+        } else {
+            this.messagesDiv.appendChild(messageDiv);
+        }
 
         if (shouldScroll) this.scrollToBottom();
     }
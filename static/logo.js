@@ -53,7 +53,7 @@ document.addEventListener('DOMContentLoaded', function() {
         // ═══════════════════════════════════════════════════════════════
         // PATCH 1: displayMessage — injects animated logo into history msgs
         // ═══════════════════════════════════════════════════════════════
-        window.xeerGPT.displayMessage = function(content, role, shouldScroll = true) {
+        window.xeerGPT.displayMessage = function(content, role, shouldScroll = true, insertBefore = null) {
             if (!this.messagesDiv) return;
 
             const messageDiv = document.createElement('div');
@@ -92,7 +92,11 @@ document.addEventListener('DOMContentLoaded', function() {
 
             messageDiv.appendChild(avatar);
             messageDiv.appendChild(contentWrapper);
-            this.messagesDiv.appendChild(messageDiv);
+            if (insertBefore) {
+                this.messagesDiv.insertBefore(messageDiv, insertBefore);
+            } else {
+                this.messagesDiv.appendChild(messageDiv);
+            }
 
             if (shouldScroll) this.scrollToBottom();
         };
@@ -100,7 +104,7 @@ document.addEventListener('DOMContentLoaded', function() {
         // ═══════════════════════════════════════════════════════════════
         // PATCH 2: fetchBotResponseStreaming — animated logo while streaming
         // ═══════════════════════════════════════════════════════════════
-        window.xeerGPT.fetchBotResponseStreaming = async function(message) {
+        window.xeerGPT.fetchBotResponseStreaming = async function(message, resend = false) {
             this.currentAbortController = new AbortController();
             this.showStreamingState();
 
@@ -112,7 +116,8 @@ document.addEventListener('DOMContentLoaded', function() {
                     body: JSON.stringify({
                         message: message,
                         conversation_id: this.currentConversationId,
-                        model: this.selectedModel
+                        model: this.selectedModel,
+                        cache: !resend
                     }),
                     signal: this.currentAbortController.signal,
                 });
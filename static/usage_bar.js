@@ -1,6 +1,8 @@
 /**
  * XeerGPT Usage Bar
- * Polls /api/usage every 30s, ticks countdown every second
+ * Live updates pushed over /api/usage/stream (SSE, served by asgi.py), ticks countdown every second.
+ * Falls back to polling /api/usage every 30s where EventSource is unavailable or the
+ * server has no stream (plain Flask/WSGI answers 404); the browser revalidates with the ETag.
  */
 
 class UsageBar {
@@ -8,6 +10,7 @@ class UsageBar {
         this.stats = null;
         this.pollingInterval = null;
         this.countdownInterval = null;
+        this.stream = null;
         this.panel = null;
 
         this.init();
@@ -15,8 +18,12 @@ class UsageBar {
 
     async init() {
         this.injectPanel();
-        await this.fetchAndRender();
-        this.startPolling();
+        if (window.EventSource) {
+            this.startStream();
+        } else {
+            await this.fetchAndRender();
+            this.startPolling();
+        }
         this.startCountdown();
     }
 
@@ -91,6 +98,7 @@ class UsageBar {
         providers.forEach(([key, s], index) => {
             const pct = s.percent_used;
             const barWidth = Math.max(0, Math.min(100, pct));
+            const resetIn = this.secondsUntilReset(s);
 
             html += `
                 <div class="usage-provider" data-provider="${key}">
@@ -110,7 +118,7 @@ class UsageBar {
                         </span>
                         <span class="usage-reset" title="Resets at ${s.reset_time_local}">
                             <i class="fas fa-clock"></i>
-                            Resets in <span class="countdown-timer" data-seconds="${s.reset_in_seconds}">${s.reset_countdown}</span>
+                            Resets in <span class="countdown-timer" data-seconds="${resetIn}">${this.formatCountdown(resetIn)}</span>
                         </span>
                     </div>
                 </div>
@@ -134,6 +142,31 @@ class UsageBar {
         }
     }
 
+    startStream() {
+        // First event is a full snapshot, then only the providers whose count moved.
+        // EventSource reconnects on its own and gets a fresh snapshot.
+        this.stream = new EventSource('/api/usage/stream');
+        this.stream.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            if (data.type === 'snapshot') {
+                this.stats = data.stats;
+            } else if (data.type === 'delta') {
+                this.stats = Object.assign({}, this.stats, data.stats);
+            }
+            this.render();
+        };
+        this.stream.onerror = () => {
+            if (this.stream.readyState === EventSource.CLOSED) {
+                // Refused (e.g. 404 under WSGI) - EventSource won't retry, so poll instead
+                this.stream = null;
+                this.fetchAndRender();
+                this.startPolling();
+            } else if (!this.stats) {
+                this.fetchAndRender();
+            }
+        };
+    }
+
     startPolling() {
         // Refresh every 30 seconds
         this.pollingInterval = setInterval(() => {
@@ -150,8 +183,8 @@ class UsageBar {
                 if (isNaN(seconds) || seconds <= 0) {
                     el.textContent = '0s';
                     el.dataset.seconds = 0;
-                    // Trigger a fresh fetch when a timer hits 0
-                    this.fetchAndRender();
+                    // Trigger a fresh fetch when a timer hits 0 (the stream pushes the reset itself)
+                    if (!this.stream) this.fetchAndRender();
                     return;
                 }
                 seconds -= 1;
@@ -161,6 +194,12 @@ class UsageBar {
         }, 1000);
     }
 
+    secondsUntilReset(s) {
+        // Stats are cached server-side, so reset_in_seconds may be old - reset_at is exact
+        if (!s.reset_at) return s.reset_in_seconds;
+        return Math.max(0, Math.round((Date.parse(s.reset_at) - Date.now()) / 1000));
+    }
+
     formatCountdown(seconds) {
         const h = Math.floor(seconds / 3600);
         const m = Math.floor((seconds % 3600) / 60);
@@ -178,6 +217,7 @@ class UsageBar {
     destroy() {
         clearInterval(this.pollingInterval);
         clearInterval(this.countdownInterval);
+        if (this.stream) this.stream.close();
     }
 }
 
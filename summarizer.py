@@ -0,0 +1,140 @@
+"""
+Summarizer - rolling compaction of long conversations
+Once a conversation's unsummarized turns pass SUMMARIZE_AFTER_TOKENS, a
+worker thread folds everything except the last KEEP_RECENT_MESSAGES
+messages into ConversationSummary using the cheapest configured model.
+Runs entirely off the request path.
+"""
+
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from context_builder import context_builder, count_tokens
+from llm import AVAILABLE_MODELS, KEY_POOLS, llm_chat
+from models import db, Conversation, ConversationSummary, Message
+
+SUMMARIZE_AFTER_TOKENS = int(os.getenv("SUMMARIZE_AFTER_TOKENS", 2000))
+KEEP_RECENT_MESSAGES = 6
+MAX_SUMMARY_INPUT_CHARS = 24000     # Cap one compaction pass; the rest waits for the next one
+
+# Cheapest first - the first one with a configured provider is used
+SUMMARY_MODELS = ["llama-3.1-8b", "deepseek-chat", "gemini-2.5-pro"]
+
+SUMMARY_PROMPT = """You maintain a running summary of a chat between a user and an AI assistant.
+Update the summary with the new messages below. Keep names, facts, decisions,
+code identifiers and open questions. Write at most 200 words, no preamble.
+
+Current summary:
+{summary}
+
+New messages:
+{transcript}
+
+Updated summary:"""
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summarizer")
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def summary_model():
+    """Cheapest model whose provider has keys configured"""
+    for model in SUMMARY_MODELS:
+        info = AVAILABLE_MODELS.get(model)
+        if info and KEY_POOLS.get(info["provider"]):
+            return model
+    return None
+
+
+def maybe_schedule(conversation_id):
+    """Queue a compaction pass if the conversation has grown past the threshold"""
+    if conversation_id is None:
+        return False
+    if context_builder.unsummarized_tokens(conversation_id) < SUMMARIZE_AFTER_TOKENS:
+        return False
+    with _pending_lock:
+        if conversation_id in _pending:
+            return False
+        _pending.add(conversation_id)
+    _executor.submit(_run, conversation_id)
+    return True
+
+
+def _run(conversation_id):
+    from app import app  # Import here to avoid circular dependency
+
+    try:
+        with app.app_context():
+            summarize_conversation(conversation_id)
+    except Exception as e:
+        print(f"⚠️ Summarizer error for conversation {conversation_id}: {e}")
+        traceback.print_exc()
+    finally:
+        with _pending_lock:
+            _pending.discard(conversation_id)
+
+
+def summarize_conversation(conversation_id):
+    """Fold older turns into the stored summary (needs an app context)"""
+    model = summary_model()
+    if model is None:
+        return None
+
+    stored = db.session.get(ConversationSummary, conversation_id)
+    through_id = stored.covers_through_id if stored else 0
+
+    rows = (Message.query
+            .filter(Message.conversation_id == conversation_id, Message.id > through_id)
+            .order_by(Message.id)
+            .with_entities(Message.id, Message.role, Message.content)
+            .all())
+    older = rows[:-KEEP_RECENT_MESSAGES]
+    if not older or sum(count_tokens(r.content) for r in rows) < SUMMARIZE_AFTER_TOKENS:
+        return None
+
+    lines = []
+    used = 0
+    for row in older:
+        line = f"{row.role.upper()}: {row.content}"
+        if lines and used + len(line) > MAX_SUMMARY_INPUT_CHARS:
+            break
+        lines.append(line)
+        used += len(line)
+        through_id = row.id
+
+    prompt = SUMMARY_PROMPT.format(
+        summary=stored.summary if stored else "(none yet)",
+        transcript="\n\n".join(lines)
+    )
+    summary = llm_chat(prompt, model=model, cache=False).strip()
+    _record_usage(model)
+
+    # The conversation may have been deleted while the model was writing
+    if db.session.get(Conversation, conversation_id) is None:
+        return None
+
+    if stored is None:
+        stored = ConversationSummary(conversation_id=conversation_id)
+        db.session.add(stored)
+    stored.summary = summary
+    stored.covers_through_id = through_id
+    stored.model = model
+    db.session.commit()
+
+    context_builder.set_summary(conversation_id, summary, through_id)
+    print(f"🗜️ Summarized conversation {conversation_id} through message {through_id} with {model}")
+    return summary
+
+
+def _record_usage(model):
+    """Summaries spend the same daily budget as chats"""
+    from usage_tracker import record_usage, PROVIDER_LIMITS
+
+    provider = AVAILABLE_MODELS[model]["provider"]
+    if provider in PROVIDER_LIMITS:
+        try:
+            record_usage(provider)
+        except Exception as e:
+            print(f"⚠️ Summary usage tracking error: {e}")
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_engine import tune_engine
+from migrations import upgrade
+from models import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Flask app on a fresh, fully migrated chat_history.db in tmp_path"""
+    flask_app = Flask(__name__)
+    flask_app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'chat_history.db'}"
+    db.init_app(flask_app)
+    with flask_app.app_context():
+        tune_engine(db.engine)
+        db.create_all()
+        upgrade(db.engine)
+        yield flask_app
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,177 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import archive
+import chat_transfer
+from db_engine import tune_engine
+from migrations import upgrade
+from models import db, Conversation, Message
+
+OLD = datetime(2020, 1, 1)
+
+
+@pytest.fixture
+def archive_db(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DATABASE_PATH", str(tmp_path / "chat_archive.db"))
+    monkeypatch.setattr(archive, "_engine", None)
+    yield
+    if archive._engine is not None:
+        archive._engine.dispose()
+
+
+def add_conversation(title, *contents, updated_at=OLD):
+    conversation = Conversation(title=title, created_at=updated_at, updated_at=updated_at)
+    db.session.add(conversation)
+    db.session.flush()
+    for i, content in enumerate(contents):
+        db.session.add(Message(conversation_id=conversation.id, role="user" if i % 2 == 0 else "assistant",
+                               content=content, timestamp=updated_at + timedelta(seconds=i)))
+    db.session.commit()
+    return conversation.id
+
+
+def archived_contents(conversation_id):
+    return [message["content"] for message in reversed(archive.archived_message_page(conversation_id))]
+
+
+def test_archive_moves_old_conversations(archive_db):
+    old_id = add_conversation("old", "hello", "hi there")
+    recent_id = add_conversation("recent", "still here", updated_at=datetime.utcnow())
+
+    conversations, messages, _ = archive.archive_old_conversations(days=30)
+
+    assert (conversations, messages) == (1, 2)
+    assert db.session.get(Conversation, old_id) is None
+    assert db.session.get(Conversation, recent_id) is not None
+    assert archived_contents(old_id) == ["hello", "hi there"]
+
+
+def test_ids_are_not_reused_after_archiving(archive_db):
+    first_id = add_conversation("first", "first chat")
+    archive.archive_old_conversations(days=30)
+
+    second_id = add_conversation("second", "second chat")
+    archive.archive_old_conversations(days=30)
+
+    assert second_id > first_id
+    assert archived_contents(first_id) == ["first chat"]
+    assert archived_contents(second_id) == ["second chat"]
+
+
+def test_id_collision_is_skipped_not_replaced(archive_db):
+    conversation_id = add_conversation("hot", "newer chat")
+    # An archived conversation that got the same id before ids were AUTOINCREMENT
+    with archive.archive_engine().begin() as conn:
+        conn.execute(text(
+            "INSERT INTO archived_conversations (id, title, created_at, updated_at, archived_at, "
+            "message_count, messages_z) VALUES (:id, 'archived', :created, :created, :created, 1, :blob)"
+        ), {"id": conversation_id, "created": OLD - timedelta(days=100),
+            "blob": archive.pack_text('[[1, "user", "older chat", "2019-09-23T00:00:00"]]')})
+
+    conversations, _, _ = archive.archive_old_conversations(days=30)
+
+    assert conversations == 0
+    assert db.session.get(Conversation, conversation_id) is not None
+    assert archived_contents(conversation_id) == ["older chat"]
+
+
+def test_stale_copy_from_a_crash_is_replaced(archive_db):
+    conversation_id = add_conversation("chat", "hello")
+    archive.archive_old_conversations(days=30)
+    # Put the hot rows back as if the run had crashed after the archive commit
+    assert archive.restore_archived(conversation_id)
+    with archive.archive_engine().begin() as conn:
+        conn.execute(text(
+            "INSERT INTO archived_conversations (id, title, created_at, updated_at, archived_at, "
+            "message_count, messages_z) VALUES (:id, 'chat', :created, :created, :created, 0, :blob)"
+        ), {"id": conversation_id, "created": OLD, "blob": archive.pack_text("[]")})
+
+    conversations, _, _ = archive.archive_old_conversations(days=30)
+
+    assert conversations == 1
+    assert archived_contents(conversation_id) == ["hello"]
+
+
+def test_restore_brings_a_conversation_back(archive_db):
+    conversation_id = add_conversation("chat", "question", "answer")
+    archive.archive_old_conversations(days=30)
+
+    assert archive.restore_archived(conversation_id)
+
+    conversation = db.session.get(Conversation, conversation_id)
+    assert conversation.title == "chat"
+    assert [m.content for m in sorted(conversation.messages, key=lambda m: m.id)] == ["question", "answer"]
+    assert archive.archived_message_page(conversation_id) is None
+    assert not archive.restore_archived(conversation_id)
+
+
+def test_reserve_archived_ids_moves_the_sequence_past_the_archive(archive_db):
+    with archive.archive_engine().begin() as conn:
+        conn.execute(text(
+            "INSERT INTO archived_conversations (id, title, created_at, updated_at, archived_at, "
+            "message_count, messages_z) VALUES (41, 'archived', :t, :t, :t, 0, :blob)"
+        ), {"t": OLD, "blob": archive.pack_text("[]")})
+
+    archive.reserve_archived_ids()
+
+    assert add_conversation("new") == 42
+
+
+def test_migration_rebuilds_legacy_tables_keeping_ids(tmp_path):
+    engine = tune_engine(create_engine(f"sqlite:///{tmp_path / 'legacy.db'}"))
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE conversations (id INTEGER NOT NULL, title VARCHAR(200) NOT NULL, "
+            "created_at DATETIME, updated_at DATETIME, PRIMARY KEY (id))")
+        conn.exec_driver_sql(
+            "CREATE TABLE messages (id INTEGER NOT NULL, conversation_id INTEGER NOT NULL, "
+            "role VARCHAR(20) NOT NULL, content TEXT NOT NULL, timestamp DATETIME, PRIMARY KEY (id), "
+            "FOREIGN KEY(conversation_id) REFERENCES conversations (id))")
+        conn.exec_driver_sql("INSERT INTO conversations VALUES (7, 'kept', NULL, NULL)")
+        conn.exec_driver_sql("INSERT INTO messages VALUES (9, 7, 'user', 'quokka', NULL)")
+    db.metadata.create_all(engine)
+
+    upgrade(engine)
+
+    with engine.begin() as conn:
+        for table in ("conversations", "messages"):
+            ddl = conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).scalar()
+            assert "AUTOINCREMENT" in ddl
+        assert conn.exec_driver_sql(
+            "SELECT rowid FROM messages_fts WHERE messages_fts MATCH 'quokka'").scalar() == 9
+        conn.exec_driver_sql("DELETE FROM messages WHERE id = 9")
+        conn.exec_driver_sql("INSERT INTO messages (conversation_id, role, content) VALUES (7, 'user', 'x')")
+        assert conn.exec_driver_sql("SELECT MAX(id) FROM messages").scalar() == 10
+    engine.dispose()
+
+
+def test_archived_page_uses_the_sidebar_cursor(archive_db):
+    for day in range(1, 6):
+        add_conversation(f"day {day}", "hi", updated_at=OLD + timedelta(days=day))
+    archive.archive_old_conversations(days=30)
+
+    first = archive.archived_conversation_page(limit=2)
+    last = first[1]
+    second = archive.archived_conversation_page(last["updated_at"], last["id"], limit=2)
+
+    assert [row["title"] for row in first] == ["day 5", "day 4", "day 3"]
+    assert [row["title"] for row in second] == ["day 3", "day 2", "day 1"]
+    assert first[0]["message_count"] == 1
+
+
+def test_export_includes_archived_conversations(archive_db):
+    archived_id = add_conversation("archived", "old question", "old answer")
+    archive.archive_old_conversations(days=30)
+    add_conversation("hot", "new question", updated_at=datetime.utcnow())
+
+    lines = [json.loads(line) for line in chat_transfer.export_ndjson()]
+
+    assert lines[0]["archived_conversations"] == 1
+    conversations = {line["title"]: line for line in lines if line["type"] == "conversation"}
+    assert conversations["archived"].get("archived") and not conversations["hot"].get("archived")
+    assert [line["content"] for line in lines
+            if line["type"] == "message" and line["conversation_id"] == archived_id] == ["old question", "old answer"]
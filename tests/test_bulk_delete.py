@@ -0,0 +1,67 @@
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import bulk_delete
+from models import db, Conversation, Message
+
+
+@pytest.fixture
+def jobs(app, monkeypatch):
+    # ClearJob.run does `from app import app`; point it at the test app
+    monkeypatch.setitem(sys.modules, "app", SimpleNamespace(app=app))
+    monkeypatch.setattr(bulk_delete, "_jobs", {})
+    return bulk_delete._jobs
+
+
+def finished_job(seconds_ago):
+    job = bulk_delete.ClearJob()
+    job.status = "done"
+    job.finished_at = datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)
+    return job
+
+
+def test_clear_job_deletes_everything(jobs):
+    for _ in range(3):
+        conversation = Conversation(title="chat")
+        db.session.add(conversation)
+        db.session.flush()
+        db.session.add(Message(conversation_id=conversation.id, role="user", content="hi"))
+    db.session.commit()
+
+    job = bulk_delete.ClearJob()
+    job.run()
+
+    assert job.to_dict()["status"] == "done"
+    assert (job.conversations_deleted, job.messages_deleted) == (3, 3)
+    assert db.session.query(Conversation).count() == 0
+
+
+def test_finished_jobs_are_evicted_after_the_ttl(jobs):
+    recent = finished_job(10)
+    expired = finished_job(bulk_delete.FINISHED_JOB_TTL + 10)
+    running = bulk_delete.ClearJob()
+    running.status = "running"
+    jobs.update({job.id: job for job in (recent, expired, running)})
+
+    assert bulk_delete.get_clear_job(expired.id) is None
+    assert bulk_delete.get_clear_job(recent.id) is recent
+    assert bulk_delete.get_clear_job(running.id) is running
+    assert set(jobs) == {recent.id, running.id}
+
+
+def test_starting_a_job_evicts_expired_ones(jobs):
+    expired = finished_job(bulk_delete.FINISHED_JOB_TTL + 10)
+    jobs[expired.id] = expired
+
+    job = bulk_delete.start_clear_job()
+
+    assert expired.id not in jobs
+    assert bulk_delete.get_clear_job(job.id) is job
+    deadline = time.monotonic() + 5
+    while job.finished_at is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.status == "done"
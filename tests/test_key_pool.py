@@ -0,0 +1,77 @@
+import pytest
+
+from key_pool import KeyPool, retry_after_from_error
+
+
+@pytest.fixture
+def pool():
+    pool = KeyPool("groq", ["client 0", "client 1"])
+    pool.set_rate_limits(rpm=100, tpm=1000)
+    return pool
+
+
+def tpm_left(pool, index):
+    return pool.snapshot()[index]["tpm_left"]
+
+
+def test_rate_limited_attempt_refunds_its_estimate(pool):
+    leases = pool.leases("model", tokens=300)
+    with next(leases) as lease:
+        lease.rate_limited(Exception("429 Please try again in 30s"))
+
+    assert tpm_left(pool, lease.index) == 1000
+    assert not pool.snapshot()[lease.index]["healthy"]
+
+
+def test_failed_attempt_refunds_its_estimate(pool):
+    with pytest.raises(RuntimeError):
+        with next(pool.leases("model", tokens=300)) as lease:
+            raise RuntimeError("upstream 500")
+
+    assert tpm_left(pool, lease.index) == 1000
+
+
+def test_estimate_is_corrected_to_the_real_usage(pool):
+    with next(pool.leases("model", tokens=300)) as lease:
+        lease.tokens(100, 50)
+
+    assert tpm_left(pool, lease.index) == 850
+
+
+def test_successful_attempt_without_usage_keeps_its_estimate(pool):
+    with next(pool.leases("model", tokens=300)) as lease:
+        pass
+
+    assert tpm_left(pool, lease.index) == 700
+
+
+def test_keys_without_tpm_room_are_skipped(pool):
+    first = next(pool.leases("model", tokens=900))
+    with first:
+        # The other key is the only one with room for a second request this size
+        second = next(pool.leases("model", tokens=900))
+        assert second.index != first.index
+        with second:
+            assert next(pool.leases("model", tokens=900), None) is None
+        first.tokens(900, 0)
+
+
+def test_leases_never_repeat_a_key(pool):
+    indexes = []
+    for lease in pool.leases("model"):
+        with lease:
+            lease.rate_limited(Exception("rate limit"))
+            indexes.append(lease.index)
+
+    assert sorted(indexes) == [0, 1]
+    assert pool.healthy_count() == 0
+
+
+@pytest.mark.parametrize("message, seconds", [
+    ("Please try again in 7.66s", 7.66),
+    ("try again in 1m30.5s", 90.5),
+    ('"retryDelay": "30s"', 30.0),
+    ("quota exceeded", 60.0),
+])
+def test_retry_after_from_error(message, seconds):
+    assert retry_after_from_error(Exception(message)) == pytest.approx(seconds)
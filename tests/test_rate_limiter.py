@@ -0,0 +1,58 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import TokenBucket, UserLimiter, client_id, estimate_tokens
+
+
+def test_bucket_takes_until_empty_then_reports_the_wait():
+    bucket = TokenBucket(2, 60.0)
+
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(30.0, abs=0.1)
+
+
+def test_bucket_refund_is_capped_at_capacity():
+    bucket = TokenBucket(100, 60.0)
+    bucket.charge(150)
+    assert bucket.available() == 0
+    assert bucket.wait_time(10) > 0
+
+    bucket.charge(-500)
+
+    assert bucket.available() == 100
+
+
+def test_user_limiter_is_per_user():
+    limiter = UserLimiter(per_hour=1)
+
+    assert limiter.check("alice") == 0
+    assert limiter.check("alice") > 0
+    assert limiter.check("bob") == 0
+
+
+def test_user_limiter_forgets_the_least_recent_user():
+    limiter = UserLimiter(per_hour=1, max_users=2)
+    limiter.check("alice")
+    limiter.check("bob")
+    limiter.check("carol")
+
+    assert limiter.stats()["tracked_users"] == 2
+    assert limiter.check("alice") == 0
+
+
+def test_user_limiter_off_at_zero():
+    limiter = UserLimiter(per_hour=0)
+    assert all(limiter.check("alice") == 0 for _ in range(10))
+
+
+def test_client_id_trusts_only_the_configured_hops(monkeypatch):
+    assert client_id("10.0.0.1", "1.2.3.4, 10.0.0.2") == "10.0.0.1"
+
+    monkeypatch.setattr(rate_limiter, "TRUSTED_PROXY_HOPS", 1)
+    assert client_id("10.0.0.1", "6.6.6.6, 1.2.3.4") == "1.2.3.4"
+    assert client_id("10.0.0.1", None) == "10.0.0.1"
+
+
+def test_estimate_counts_history_and_completion():
+    assert estimate_tokens("a" * 35, [{"content": "b" * 35}], completion=100) == 120
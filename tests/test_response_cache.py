@@ -0,0 +1,73 @@
+import importlib
+import time
+from itertools import count
+
+import pytest
+
+import llm
+import response_cache
+import router
+from response_cache import ResponseCache
+
+MODEL = "llama-3.3-70b"
+FALLBACK = "llama-4-scout"
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """Opt the cache in, with a fake provider that answers differently every call"""
+    monkeypatch.setattr(llm, "CACHE_ENABLED", True)
+    monkeypatch.setattr(llm, "response_cache", ResponseCache(db_path=None))
+    monkeypatch.setattr(llm, "_admit", lambda model, tokens: None)
+    calls = count(1)
+    monkeypatch.setattr(llm, "_direct_chat", lambda message, model, history: f"sample {next(calls)}")
+
+
+def test_repeat_is_served_from_cache(provider):
+    assert llm.llm_chat("hello", MODEL) == "sample 1"
+    assert llm.llm_chat("hello", MODEL) == "sample 1"
+
+
+def test_resend_bypasses_cache(provider):
+    assert llm.llm_chat("hello", MODEL) == "sample 1"
+    assert llm.llm_chat("hello", MODEL, cache=False) == "sample 2"
+
+
+def test_off_unless_opted_in(monkeypatch):
+    monkeypatch.delenv("RESPONSE_CACHE", raising=False)
+    try:
+        assert not importlib.reload(response_cache).CACHE_ENABLED
+    finally:
+        importlib.reload(response_cache)
+
+
+@pytest.fixture
+def hedge_to_fallback(provider, monkeypatch):
+    """The requested model stalls past the hedge delay; the hedge goes to FALLBACK and wins"""
+    def timed_stream(message, model, history=None):
+        if model == MODEL:
+            time.sleep(0.3)
+        yield f"{model} answer"
+
+    monkeypatch.setattr(llm, "_timed_stream", timed_stream)
+    monkeypatch.setattr(llm, "hedge_delay", lambda model: 0.01)
+    monkeypatch.setattr(llm, "_hedge_target", lambda model: FALLBACK)
+    monkeypatch.setattr(llm, "_record_hedge", lambda model: None)
+
+
+def test_hedge_answer_is_cached_under_the_model_that_answered(hedge_to_fallback):
+    reply = llm.llm_chat_stream("hello", MODEL, hedge=True)
+    assert list(reply) == [f"{FALLBACK} answer"]
+    assert reply.model == FALLBACK
+
+    assert not isinstance(llm.llm_chat_stream("hello", MODEL, hedge=False), llm.CachedReply)
+    cached = llm.llm_chat_stream("hello", FALLBACK)
+    assert isinstance(cached, llm.CachedReply) and list(cached) == [f"{FALLBACK} answer"]
+
+
+def test_routed_stream_reports_the_hedge_winner(hedge_to_fallback, monkeypatch):
+    monkeypatch.setattr(router, "plan_route", lambda model: [model])
+    stream = router.route_message_stream("hello", MODEL, hedge=True)
+
+    assert list(stream) == [f"{FALLBACK} answer"]
+    assert stream.model == FALLBACK
@@ -0,0 +1,55 @@
+import importlib
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import semantic_cache
+from semantic_cache import SemanticCache
+
+MODEL = "llama-3.3-70b-versatile"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_ENABLED", True)
+    return SemanticCache()
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("convert 30 celsius to fahrenheit", "convert 30 fahrenheit to celsius"),
+    ("is python faster than java", "is java faster than python"),
+    ("dog bites man", "man bites dog"),
+])
+def test_order_swapped_prompt_misses(cache, cached, asked):
+    cache.put(cached, MODEL, "cached answer")
+    assert cache.get(asked, MODEL) is None
+
+
+def test_case_and_punctuation_repeat_hits(cache):
+    cache.put("what is AI?", MODEL, "cached answer")
+    assert cache.get("what is ai", MODEL) == "cached answer"
+
+
+def test_off_unless_opted_in(monkeypatch):
+    monkeypatch.delenv("SEMANTIC_CACHE", raising=False)
+    try:
+        assert not importlib.reload(semantic_cache).SEMANTIC_CACHE_ENABLED
+    finally:
+        monkeypatch.undo()
+        importlib.reload(semantic_cache)
+
+
+def test_works_without_the_exact_match_cache(monkeypatch):
+    import llm
+    from itertools import count
+
+    monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(llm, "CACHE_ENABLED", False)
+    monkeypatch.setattr(llm, "semantic_cache", SemanticCache())
+    monkeypatch.setattr(llm, "_admit", lambda model, tokens: None)
+    calls = count(1)
+    monkeypatch.setattr(llm, "_direct_chat", lambda message, model, history: f"sample {next(calls)}")
+
+    assert llm.llm_chat("what is AI?", "llama-3.3-70b") == "sample 1"
+    assert llm.llm_chat("what is ai", "llama-3.3-70b") == "sample 1"
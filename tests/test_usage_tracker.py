@@ -0,0 +1,77 @@
+import sys
+import threading
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import usage_tracker
+from models import db, UsageTracking
+from usage_tracker import UsageCounters
+
+
+@pytest.fixture
+def counters(app, monkeypatch):
+    # flush() does `from app import app`; point it at the test app
+    monkeypatch.setitem(sys.modules, "app", SimpleNamespace(app=app))
+    counters = UsageCounters(interval=60, flush_every=10 ** 9)
+    yield counters
+    counters.stop()
+
+
+def stored(provider_key):
+    db.session.expire_all()
+    usage = UsageTracking.query.filter_by(provider=provider_key).one()
+    return usage.date, usage.count
+
+
+def test_first_flush_of_a_new_day_starts_over(counters, monkeypatch):
+    today = usage_tracker._get_today_date()
+    yesterday = today - timedelta(days=1)
+
+    monkeypatch.setattr(usage_tracker, "_get_today_date", lambda: yesterday)
+    counters.increment("groq", 3)
+    counters.flush()
+    assert stored("groq") == (yesterday, 3)
+
+    monkeypatch.setattr(usage_tracker, "_get_today_date", lambda: today)
+    counters.increment("groq", 2)
+    counters.flush()
+    assert stored("groq") == (today, 2)
+    assert counters.current("groq") == 2
+
+
+def test_late_deltas_from_yesterday_do_not_roll_today_back(counters, monkeypatch):
+    today = usage_tracker._get_today_date()
+    counters.increment("groq", 2)
+    counters.flush()
+
+    monkeypatch.setattr(usage_tracker, "_get_today_date", lambda: today - timedelta(days=1))
+    counters.increment("groq", 5)
+    counters.flush()
+
+    assert stored("groq") == (today, 2)
+
+
+def test_concurrent_increments_are_not_lost(counters):
+    threads, per_thread = 8, 500
+    start = threading.Barrier(threads + 1)
+
+    def worker():
+        start.wait()
+        for _ in range(per_thread):
+            counters.increment("openrouter")
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    # Flush while the shards are still being incremented
+    while any(thread.is_alive() for thread in workers):
+        counters.flush()
+    for thread in workers:
+        thread.join()
+    counters.flush()
+
+    assert stored("openrouter")[1] == threads * per_thread
+    assert counters.current("openrouter") == threads * per_thread
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import write_behind
+from models import db, Conversation, Message
+from write_behind import WriteBehindQueue
+
+
+@pytest.fixture
+def writer(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(write_behind, "DEAD_LETTER_PATH", str(tmp_path / "dead_letter.ndjson"))
+    queue = WriteBehindQueue(interval=0.2)
+    queue.init_app(app)
+    yield queue
+    queue.stop()
+
+
+def add_conversation():
+    conversation = Conversation(title="chat")
+    db.session.add(conversation)
+    db.session.commit()
+    return conversation.id
+
+
+def saved_contents(conversation_id):
+    db.session.expire_all()
+    return [m.content for m in db.session.scalars(
+        db.select(Message).where(Message.conversation_id == conversation_id).order_by(Message.id))]
+
+
+def test_batch_is_committed_in_order(writer):
+    conversation_id = add_conversation()
+    for i in range(5):
+        writer.save_message(conversation_id, "user" if i % 2 == 0 else "assistant", f"message {i}")
+    writer.touch_conversation(conversation_id)
+
+    assert writer.wait_for(conversation_id)
+
+    assert saved_contents(conversation_id) == [f"message {i}" for i in range(5)]
+    assert writer.stats() == {"pending": 0, "batches": 1, "writes": 6, "failures": 0}
+
+
+def test_poisoned_op_is_dead_lettered_and_the_rest_commit(writer, tmp_path):
+    conversation_id = add_conversation()
+    writer.save_message(conversation_id, "user", "before")
+    writer.save_message(conversation_id, None, "poisoned")    # role is NOT NULL
+    writer.save_message(conversation_id, "assistant", "after")
+
+    assert writer.flush()
+
+    assert saved_contents(conversation_id) == ["before", "after"]
+    assert writer.stats()["failures"] == 1
+    with open(tmp_path / "dead_letter.ndjson", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [(r["op"], r["conversation_id"], r["content"]) for r in records] == \
+        [("message", conversation_id, "poisoned")]
+
+
+def test_flush_drains_before_returning(writer):
+    conversation_ids = [add_conversation() for _ in range(3)]
+    for conversation_id in conversation_ids:
+        writer.save_message(conversation_id, "user", f"hello {conversation_id}")
+    assert writer.stats()["pending"] == 3
+
+    assert writer.flush()
+
+    assert writer.stats()["pending"] == 0
+    for conversation_id in conversation_ids:
+        assert saved_contents(conversation_id) == [f"hello {conversation_id}"]
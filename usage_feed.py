@@ -0,0 +1,136 @@
+"""
+Usage Feed - server-push usage updates for the usage bar (/api/usage/stream,
+served by asgi.py only - a never-ending stream would pin a WSGI worker thread
+per open tab, so under app.py alone the bar polls /api/usage instead)
+record_usage() only marks the feed dirty. One publisher thread coalesces
+changes for USAGE_PUSH_INTERVAL_MS, reads the in-memory counters once and
+encodes one SSE delta event (the providers whose count moved). Every open
+stream then just writes that pre-built string, so the work per counter
+change doesn't grow with the number of open tabs - no DB query, no stats
+rebuild per client.
+
+A new stream, or one that fell more than one version behind, gets a full
+snapshot built from the last published counts. The publisher also wakes
+at the daily reset so the bars drop back to zero without a request.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import traceback
+
+from usage_tracker import PROVIDER_LIMITS, provider_stats, usage_counters
+
+PUSH_INTERVAL = float(os.getenv("USAGE_PUSH_INTERVAL_MS", 250)) / 1000
+KEEPALIVE = 15.0    # Seconds between comment lines on an idle stream (keeps proxies from closing it)
+_KEEPALIVE_EVENT = ": keepalive\n\n"
+
+
+def _event(kind, version, stats):
+    return f"data: {json.dumps({'type': kind, 'version': version, 'stats': stats})}\n\n"
+
+
+class UsageFeed:
+    """Latest usage state, encoded once per change and shared by every stream"""
+
+    def __init__(self, interval=PUSH_INTERVAL):
+        self.interval = interval
+        self.version = 0
+        self._counts = {}           # provider -> count as last published
+        self._delta = None          # SSE event: version - 1 -> version
+        self._reset_at = 0.0        # monotonic time of the next daily reset
+        self._dirty = threading.Event()
+        self._lock = threading.Lock()
+        self._futures = {}          # asyncio loop -> future resolved on the next publish
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.publishes = 0
+
+    def changed(self):
+        """usage_counters hook - O(1), wakes the publisher only"""
+        if not self._dirty.is_set():
+            self._dirty.set()
+
+    def _publish(self):
+        counts = {provider_key: usage_counters.current(provider_key) for provider_key in PROVIDER_LIMITS}
+        day_rolled = time.monotonic() >= self._reset_at
+        if counts == self._counts and not day_rolled:
+            return
+        stats = {provider_key: provider_stats(provider_key, count) for provider_key, count in counts.items()}
+        delta = {provider_key: entry for provider_key, entry in stats.items()
+                 if day_rolled or self._counts.get(provider_key) != entry["used"]}
+        with self._lock:
+            self.version += 1
+            self._delta = _event("delta", self.version, delta)
+            self._counts = counts
+            self._reset_at = time.monotonic() + min(entry["reset_in_seconds"] for entry in stats.values())
+        for loop in list(self._futures):
+            loop.call_soon_threadsafe(self._wake_loop, loop)
+        self.publishes += 1
+
+    def _wake_loop(self, loop):
+        future = self._futures.get(loop)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def _run(self):
+        while True:
+            # Also wake just after midnight UTC, when every count drops to zero
+            if self._dirty.wait(max(0.0, self._reset_at - time.monotonic()) + 1):
+                time.sleep(self.interval)   # Coalesce a burst into one push
+            self._dirty.clear()
+            try:
+                self._publish()
+            except Exception as e:
+                print(f"⚠️ Usage feed publish failed: {e}")
+                traceback.print_exc()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._publish()     # First snapshot, before any stream waits on it
+                self._thread = threading.Thread(target=self._run, name="usage-feed", daemon=True)
+                self._thread.start()
+
+    def _next(self, sent):
+        """(version, event) to send after version `sent`: the shared delta, or a snapshot if further behind"""
+        with self._lock:
+            if self.version == sent + 1:
+                return self.version, self._delta
+            version, counts = self.version, self._counts
+        stats = {provider_key: provider_stats(provider_key, count) for provider_key, count in counts.items()}
+        return version, _event("snapshot", version, stats)
+
+    async def aevents(self):
+        """SSE strings for one client: a snapshot, then deltas as counters change. Streams on one loop share one future"""
+        await asyncio.to_thread(self._ensure_started)
+        loop = asyncio.get_running_loop()
+        sent, event = self._next(-1)
+        yield event
+        while True:
+            # Take the future before checking the version, so a publish in between still wakes us
+            future = self._futures.get(loop)
+            if future is None or future.done():
+                future = self._futures[loop] = loop.create_future()
+            if self.version == sent:
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield _KEEPALIVE_EVENT
+                    continue
+                if self.version == sent:
+                    continue
+            sent, event = self._next(sent)
+            yield event
+
+    def stats(self):
+        return {"version": self.version, "publishes": self.publishes,
+                "push_interval_ms": round(self.interval * 1000)}
+
+
+usage_feed = UsageFeed()
+usage_counters.on_change = usage_feed.changed
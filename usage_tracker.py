@@ -2,10 +2,37 @@
 Usage Tracker - DATABASE-BACKED VERSION
 FIXED: Uses database instead of JSON file for persistent storage
 Survives server restarts and deployments
+
+record_usage() only bumps an in-memory counter (sharded by thread, so chat
+threads rarely share a lock). A background thread flushes the deltas every
+USAGE_FLUSH_INTERVAL_MS or USAGE_FLUSH_EVERY increments as one
+INSERT ... ON CONFLICT DO UPDATE SET count = count + ? per provider, which
+is atomic in SQLite - no read-modify-write, no lost updates across workers.
+Pending counts are flushed on shutdown (atexit) and included in the stats.
+get_usage_stats() / get_key_usage() are memoized until the next change
+(usage_counters.changes) or the daily reset.
+
+Each provider call is also counted per (provider, key_index, model_id, date)
+in KeyUsage - requests plus the prompt/completion tokens from the response's
+usage fields (recorded by the KeyPool lease in llm.py). key_totals() gives
+the key picker today's per-key load without touching the DB.
 """
 
+import atexit
+import itertools
+import os
+import threading
+import traceback
 from datetime import datetime, timezone, timedelta
-from models import db, UsageTracking
+
+from sqlalchemy import case
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, KeyUsage, UsageTracking
+
+FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL_MS", 500)) / 1000
+FLUSH_EVERY = int(os.getenv("USAGE_FLUSH_EVERY", 50))
+COUNTER_SHARDS = 8
 
 # Provider limits (adjust these to match your actual plan)
 PROVIDER_LIMITS = {
@@ -65,10 +92,313 @@ def _format_countdown(seconds):
     else:
         return f"{secs}s"
 
+class _Shard:
+    __slots__ = ("lock", "counts", "keys")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}    # (provider, date) -> increments not yet flushed
+        self.keys = {}      # (provider, key_index, model_id, date) -> [requests, prompt, completion]
+
+
+def _add_into(target, key, values):
+    current = target.get(key)
+    target[key] = list(values) if current is None else [a + b for a, b in zip(current, values)]
+
+
+class UsageCounters:
+    """
+    Daily counters in memory, flushed in the background: per provider to
+    UsageTracking, per (provider, key, model) with token counts to KeyUsage
+    """
+
+    def __init__(self, interval=FLUSH_INTERVAL, flush_every=FLUSH_EVERY, shards=COUNTER_SHARDS):
+        self.interval = interval
+        self.flush_every = flush_every
+        self._shards = [_Shard() for _ in range(shards)]
+        self._ticks = itertools.count(1)    # next() is atomic under the GIL
+        self._flushed_at_tick = 0
+        self._flushed = {}                  # (provider, date) -> count in the DB after our last flush
+        self._inflight = {}                 # Drained deltas the running flush hasn't committed yet
+        self._key_flushed = {}              # (provider, key_index, model_id, date) -> DB [requests, prompt, completion]
+        self._key_inflight = {}
+        self._key_loaded = set()            # (provider, date) whose KeyUsage rows are in _key_flushed
+        self._key_wanted = set()            # ... and those key_totals() asked the flusher to load
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.flushes = 0
+        self.failures = 0
+        self.on_change = None               # on_change() after every provider count change - must be O(1)
+        self._change_ticks = itertools.count(1)
+        self.changes = 0                    # Moves on every change to the counts (memo version)
+
+    def _changed(self):
+        self.changes = next(self._change_ticks)
+        if self.on_change is not None:
+            self.on_change()
+
+    def increment(self, provider_key, amount=1):
+        """Hot path: one uncontended shard lock, no DB"""
+        self._ensure_started()
+        key = (provider_key, _get_today_date())
+        shard = self._shards[threading.get_ident() % len(self._shards)]
+        with shard.lock:
+            shard.counts[key] = shard.counts.get(key, 0) + amount
+        if next(self._ticks) - self._flushed_at_tick >= self.flush_every:
+            self._wake.set()
+        self._changed()
+
+    def record_key(self, provider_key, key_index, model_id, prompt_tokens=0, completion_tokens=0):
+        """One request on one API key, with the provider-reported token counts"""
+        self._ensure_started()
+        key = (provider_key, key_index, model_id or "unknown", _get_today_date())
+        shard = self._shards[threading.get_ident() % len(self._shards)]
+        with shard.lock:
+            _add_into(shard.keys, key, (1, prompt_tokens or 0, completion_tokens or 0))
+        if next(self._ticks) - self._flushed_at_tick >= self.flush_every:
+            self._wake.set()
+        self.changes = next(self._change_ticks)
+
+    def key_totals(self, provider_key):
+        """
+        Today's {key_index: (requests, tokens)} for one provider, from memory
+        only (cheap enough for key selection). DB rows written by other
+        workers are loaded by the flusher the first time a provider is asked for.
+        """
+        today = _get_today_date()
+        if (provider_key, today) not in self._key_loaded and (provider_key, today) not in self._key_wanted:
+            self._key_wanted.add((provider_key, today))
+            self._wake.set()
+        sources = [self._key_flushed, self._key_inflight] + [shard.keys for shard in self._shards]
+        totals = {}
+        for source in sources:
+            for (provider, key_index, _, day), (requests, prompt, completion) in list(source.items()):
+                if provider == provider_key and day == today:
+                    current = totals.get(key_index, (0, 0))
+                    totals[key_index] = (current[0] + requests, current[1] + prompt + completion)
+        return totals
+
+    def pending_keys(self, day=None):
+        """Per-key deltas for day (default today) not yet in the DB"""
+        day = day or _get_today_date()
+        pending = {}
+        for shard in self._shards:
+            for key, values in list(shard.keys.items()):
+                if key[3] == day:
+                    _add_into(pending, key, values)
+        return pending
+
+    def pending(self, provider_key, day=None):
+        """Increments for provider on day (default today) not yet in the DB"""
+        key = (provider_key, day or _get_today_date())
+        return sum(shard.counts.get(key, 0) for shard in self._shards)
+
+    def current(self, provider_key):
+        """Today's count: last flushed DB value + in-flight + pending (loads the DB values once a day)"""
+        key = (provider_key, _get_today_date())
+        if key not in self._flushed:
+            for loaded_key, count in _load_counts(key[1]).items():
+                self._flushed.setdefault(loaded_key, count)
+            self._flushed.setdefault(key, 0)
+        return self._flushed[key] + self._inflight.get(key, 0) + self.pending(provider_key)
+
+    def consistent(self):
+        """Lock to hold while reading the DB + pending(), so a flush can't land in between"""
+        return self._flush_lock
+
+    def discard(self, provider_key):
+        """Drop pending increments and the cached count (manual reset)"""
+        with self._flush_lock:
+            for shard in self._shards:
+                with shard.lock:
+                    for key in [k for k in shard.counts if k[0] == provider_key]:
+                        del shard.counts[key]
+            for key in [k for k in self._flushed if k[0] == provider_key]:
+                del self._flushed[key]
+        self._changed()
+
+    # ── flushing ───────────────────────────────────────────────────────────
+
+    def _drain(self):
+        deltas, key_deltas = {}, {}
+        for shard in self._shards:
+            with shard.lock:
+                counts, shard.counts = shard.counts, {}
+                keys, shard.keys = shard.keys, {}
+            for key, amount in counts.items():
+                deltas[key] = deltas.get(key, 0) + amount
+            for key, values in keys.items():
+                _add_into(key_deltas, key, values)
+        return deltas, key_deltas
+
+    def _restore(self, deltas, key_deltas):
+        shard = self._shards[0]
+        with shard.lock:
+            for key, amount in deltas.items():
+                shard.counts[key] = shard.counts.get(key, 0) + amount
+            for key, values in key_deltas.items():
+                _add_into(shard.keys, key, values)
+
+    def _load_keys(self, provider_key, day):
+        for row in KeyUsage.query.filter_by(provider=provider_key, date=day):
+            self._key_flushed[(row.provider, row.key_index, row.model_id, row.date)] = [
+                row.requests, row.prompt_tokens, row.completion_tokens]
+        self._key_loaded.add((provider_key, day))
+
+    def _upsert_key(self, key, values, now):
+        provider_key, key_index, model_id, day = key
+        requests, prompt_tokens, completion_tokens = values
+        stmt = sqlite_insert(KeyUsage).values(
+            provider=provider_key, key_index=key_index, model_id=model_id, date=day,
+            requests=requests, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            updated_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[KeyUsage.provider, KeyUsage.key_index, KeyUsage.model_id, KeyUsage.date],
+            set_={
+                "requests": KeyUsage.requests + stmt.excluded.requests,
+                "prompt_tokens": KeyUsage.prompt_tokens + stmt.excluded.prompt_tokens,
+                "completion_tokens": KeyUsage.completion_tokens + stmt.excluded.completion_tokens,
+                "updated_at": stmt.excluded.updated_at,
+            }
+        ).returning(KeyUsage.requests, KeyUsage.prompt_tokens, KeyUsage.completion_tokens)
+        self._key_flushed[key] = list(db.session.execute(stmt).one())
+
+    def flush(self):
+        """Write pending increments in one transaction; returns rows upserted"""
+        with self._flush_lock:
+            self._flushed_at_tick = next(self._ticks)
+            deltas, key_deltas = self._drain()
+            to_load = {(key[0], key[3]) for key in key_deltas} | self._key_wanted
+            to_load -= self._key_loaded
+            if not deltas and not key_deltas and not to_load:
+                return 0
+            self._inflight, self._key_inflight = deltas, key_deltas
+            from app import app  # Import here to avoid circular dependency
+            now = datetime.now(timezone.utc)
+            try:
+                with app.app_context():
+                    # Other workers' rows first, so the upserts below land on top of them
+                    for provider_key, day in to_load:
+                        self._load_keys(provider_key, day)
+                    for key, values in key_deltas.items():
+                        self._upsert_key(key, values, now)
+                    for (provider_key, day), amount in sorted(deltas.items(), key=lambda item: item[0][1]):
+                        stmt = sqlite_insert(UsageTracking).values(
+                            provider=provider_key, date=day, count=amount, updated_at=now)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=[UsageTracking.provider],
+                            set_={
+                                # Same day: add; first flush of a new day: start over
+                                "count": case((UsageTracking.date == stmt.excluded.date,
+                                               UsageTracking.count + stmt.excluded.count),
+                                              else_=stmt.excluded.count),
+                                "date": stmt.excluded.date,
+                                "updated_at": stmt.excluded.updated_at,
+                            },
+                            # Late deltas from yesterday must not roll today's row back
+                            where=stmt.excluded.date >= UsageTracking.date
+                        ).returning(UsageTracking.count)
+                        count = db.session.execute(stmt).scalar()
+                        if count is not None:
+                            self._flushed[(provider_key, day)] = count
+                    db.session.commit()
+                    db.session.remove()
+            except Exception as e:
+                self._restore(deltas, key_deltas)
+                self._inflight, self._key_inflight = {}, {}
+                # Cached DB values may include upserts that just rolled back - reload them
+                self._flushed.clear()
+                self._key_flushed.clear()
+                self._key_loaded.clear()
+                self.failures += 1
+                print(f"❌ Usage flush failed, will retry: {e}")
+                traceback.print_exc()
+                return 0
+            self._inflight, self._key_inflight = {}, {}
+            self._key_wanted -= self._key_loaded
+            # Forget past days
+            for key in [k for k in self._flushed if k[1] < now.date()]:
+                del self._flushed[key]
+            for key in [k for k in self._key_flushed if k[3] < now.date()]:
+                del self._key_flushed[key]
+            self._key_loaded = {k for k in self._key_loaded if k[1] >= now.date()}
+            self.flushes += 1
+        # The upserts return totals that include other workers' requests
+        self._changed()
+        return len(deltas) + len(key_deltas)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None and not self._stopping:
+                self._thread = threading.Thread(target=self._run, name="usage-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Usage flusher error: {e}")
+
+    def stop(self):
+        """Final flush on shutdown"""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(5)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        return {
+            "pending": sum(sum(shard.counts.values()) + len(shard.keys) for shard in self._shards),
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "flush_interval_ms": round(self.interval * 1000),
+            "flush_every": self.flush_every
+        }
+
+
+usage_counters = UsageCounters()
+atexit.register(usage_counters.stop)
+
+
+def _load_counts(day):
+    """{(provider, day): count} persisted for `day`, every provider in one query"""
+    from app import app  # Import here to avoid circular dependency
+
+    with app.app_context():
+        counts = {(usage.provider, day): usage.count
+                  for usage in UsageTracking.query.filter_by(date=day)}
+        db.session.remove()
+        return counts
+
+
+_memo = {}      # name -> ((usage_counters.changes, day), value)
+
+
+def _memoized(name, build):
+    """build() once per counter change and day; the cached value is shared, don't mutate it"""
+    version = (usage_counters.changes, _get_today_date())
+    cached = _memo.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    value = build()
+    _memo[name] = (version, value)  # Read the version first - a change during build() just forces a rebuild
+    return value
+
+
 def record_usage(provider_key: str):
     """
     Record one API call for the given provider
-    FIXED: Uses database for persistence
+    In-memory increment; persisted by the usage_counters flusher
     
     Args:
         provider_key: Provider identifier ('groq', 'openrouter', etc.)
@@ -76,94 +406,96 @@ def record_usage(provider_key: str):
     Returns:
         int: Current usage count for today
     """
+    usage_counters.increment(provider_key)
+    return usage_counters.current(provider_key)
+
+def record_key_usage(provider_key: str, key_index: int, model_id: str,
+                     prompt_tokens: int = 0, completion_tokens: int = 0):
+    """Count one provider call on one API key (in-memory; flushed with the rest)"""
+    usage_counters.record_key(provider_key, key_index, model_id, prompt_tokens, completion_tokens)
+
+
+def get_key_usage():
+    """
+    Today's usage per provider, key and model (DB + unflushed)
+    Memoized until the next counter change or the daily reset
+    
+    Returns:
+        dict: provider -> list of {key, model_id, requests, prompt_tokens, completion_tokens, total_tokens}
+    """
+    return _memoized("keys", _build_key_usage)
+
+
+def _build_key_usage():
     from app import app  # Import here to avoid circular dependency
     
+    today = _get_today_date()
     with app.app_context():
-        today = _get_today_date()
-        
-        # Get or create usage record for this provider
-        usage = UsageTracking.query.filter_by(provider=provider_key).first()
-        
-        if usage is None:
-            # First time tracking this provider
-            usage = UsageTracking(
-                provider=provider_key,
-                date=today,
-                count=0
-            )
-            db.session.add(usage)
-            print(f"🆕 Created usage tracking for {provider_key}")
-        
-        # Check if we need to reset (new day)
-        if usage.date != today:
-            print(f"🔄 New day detected for {provider_key}: {usage.date} → {today}")
-            usage.date = today
-            usage.count = 0
-        
-        # Increment count
-        old_count = usage.count
-        usage.count += 1
-        
-        # CRITICAL: Commit to database
-        try:
-            db.session.commit()
-            print(f"📈 {provider_key}: {old_count} → {usage.count} (saved to DB)")
-        except Exception as e:
-            print(f"❌ Database error: {e}")
-            db.session.rollback()
-            raise
-        
-        return usage.count
+        with usage_counters.consistent():
+            rows = {(row.provider, row.key_index, row.model_id, row.date):
+                    [row.requests, row.prompt_tokens, row.completion_tokens]
+                    for row in KeyUsage.query.filter_by(date=today)}
+            for key, values in usage_counters.pending_keys(today).items():
+                _add_into(rows, key, values)
+    
+    usage = {}
+    for (provider_key, key_index, model_id, _), (requests, prompt, completion) in sorted(rows.items()):
+        usage.setdefault(provider_key, []).append({
+            "key": key_index + 1,
+            "model_id": model_id,
+            "requests": requests,
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": prompt + completion
+        })
+    return usage
+
 
 def get_usage_stats():
     """
     Return full usage stats for all providers
-    FIXED: Reads from database
+    Built from the in-memory counters (DB values are loaded once a day and
+    refreshed by every flush), memoized until the next counter change or
+    the daily reset
     
     Returns:
         dict: Usage statistics for each provider
     """
-    from app import app  # Import here to avoid circular dependency
-    
-    stats = {}
-    
-    with app.app_context():
-        today = _get_today_date()
-        
-        for provider_key, provider_info in PROVIDER_LIMITS.items():
-            # Get usage from database
-            usage = UsageTracking.query.filter_by(provider=provider_key).first()
-            
-            # Check if data is from today
-            if usage is None or usage.date != today:
-                # No data or stale data - count is 0
-                count = 0
-                if usage and usage.date != today:
-                    print(f"🔄 Stale data for {provider_key}: {usage.date} → {today}")
-            else:
-                count = usage.count
-            
-            limit = provider_info["daily_limit"]
-            remaining = max(0, limit - count)
-            percent_used = min(100, round((count / limit) * 100, 1))
-            seconds_left = _seconds_until_reset(provider_key)
-            
-            stats[provider_key] = {
-                "display_name": provider_info["display_name"],
-                "icon": provider_info["icon"],
-                "color": provider_info["color"],
-                "used": count,
-                "limit": limit,
-                "remaining": remaining,
-                "percent_used": percent_used,
-                "percent_remaining": round(100 - percent_used, 1),
-                "reset_in_seconds": seconds_left,
-                "reset_countdown": _format_countdown(seconds_left),
-                "reset_time_local": _get_reset_time_local(provider_key),
-                "status": _get_status(percent_used)
-            }
+    return _memoized("stats", _build_usage_stats)
+
+def _build_usage_stats():
+    # Hold the flush lock so a flush can't move counts from pending to the DB in between
+    with usage_counters.consistent():
+        counts = {provider_key: usage_counters.current(provider_key) for provider_key in PROVIDER_LIMITS}
+    return {provider_key: provider_stats(provider_key, count) for provider_key, count in counts.items()}
+
+def provider_stats(provider_key, count):
+    """
+    Usage bar entry for one provider with `count` requests today.
+    reset_in_seconds / reset_countdown are as of when the entry was built
+    (entries are memoized); count down to reset_at instead.
+    """
+    provider_info = PROVIDER_LIMITS[provider_key]
+    limit = provider_info["daily_limit"]
+    remaining = max(0, limit - count)
+    percent_used = min(100, round((count / limit) * 100, 1))
+    seconds_left = _seconds_until_reset(provider_key)
     
-    return stats
+    return {
+        "display_name": provider_info["display_name"],
+        "icon": provider_info["icon"],
+        "color": provider_info["color"],
+        "used": count,
+        "limit": limit,
+        "remaining": remaining,
+        "percent_used": percent_used,
+        "percent_remaining": round(100 - percent_used, 1),
+        "reset_at": _get_reset_time(provider_key).isoformat(),
+        "reset_in_seconds": seconds_left,
+        "reset_countdown": _format_countdown(seconds_left),
+        "reset_time_local": _get_reset_time_local(provider_key),
+        "status": _get_status(percent_used)
+    }
 
 def _get_status(percent_used):
     """Return status label based on usage percent"""
@@ -204,6 +536,8 @@ def reset_provider(provider_key: str):
             db.session.add(usage)
             db.session.commit()
             print(f"🆕 Created and reset {provider_key}")
+    # After the commit, so the next current() reloads the zeroed row
+    usage_counters.discard(provider_key)
 
 def get_debug_info():
     """Get debug information about usage tracking"""
@@ -215,6 +549,7 @@ def get_debug_info():
         debug = {
             "storage": "database (SQLite)",
             "current_utc_date": str(today),
+            "counters": usage_counters.stats(),
             "providers": {}
         }
         
@@ -223,6 +558,7 @@ def get_debug_info():
             debug["providers"][usage.provider] = {
                 "date": str(usage.date),
                 "count": usage.count,
+                "pending": usage_counters.pending(usage.provider, usage.date),
                 "is_today": usage.date == today,
                 "updated_at": str(usage.updated_at)
             }
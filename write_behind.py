@@ -0,0 +1,261 @@
+"""
+Write-Behind Queue - chat persistence off the streaming path
+Message inserts and Conversation.updated_at bumps are queued and written by
+one background thread in grouped transactions every few milliseconds.
+- Durability: pending writes are drained on graceful shutdown (atexit)
+- Read-your-writes: wait_for(conversation_id) blocks until that
+  conversation's queued writes are committed
+- A failing batch is retried with backoff, then written one op per
+  transaction; an op that still fails is appended to DEAD_LETTER_PATH
+  (NDJSON) and logged instead of being dropped silently
+The Flask app is handed over with init_app(app) - the writer thread never
+imports app.py itself.
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import update
+
+from migrations import DATABASE_PATH
+from models import db, Conversation, Message
+
+FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", 5)) / 1000
+MAX_BATCH = 500
+WAIT_TIMEOUT = 5.0      # Seconds a reader waits for its writes before reading anyway
+RETRY_BACKOFF = (0.05, 0.2, 1.0)    # Seconds before each retry of a failed batch
+DEAD_LETTER_PATH = os.getenv(
+    "WRITE_BEHIND_DEAD_LETTER", os.path.join(os.path.dirname(DATABASE_PATH), "write_behind_dead_letter.ndjson"))
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Single writer thread batching chat writes into one transaction per tick"""
+
+    def __init__(self, interval=FLUSH_INTERVAL, max_batch=MAX_BATCH):
+        self.interval = interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._pending = {}      # conversation_id -> queued ops not yet committed
+        self._cond = threading.Condition()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._listeners = []
+        self.app = None
+        self.batches = 0
+        self.writes = 0
+        self.failures = 0
+
+    # ── producer side ──────────────────────────────────────────────────────
+
+    def init_app(self, app):
+        """Flask app whose context the writer thread runs in"""
+        self.app = app
+
+    def add_listener(self, callback):
+        """callback(conversation_id, message_id, role, content) after each message commits (once per callback)"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def _put(self, op):
+        self._ensure_started()
+        with self._cond:
+            self._pending[op[1]] = self._pending.get(op[1], 0) + 1
+        self._queue.put(op)
+
+    def save_message(self, conversation_id, role, content):
+        """Queue a Message insert; its timestamp is taken now, not at flush time"""
+        self._put(("message", conversation_id, role, content, datetime.now(timezone.utc)))
+
+    def touch_conversation(self, conversation_id):
+        """Queue a Conversation.updated_at bump"""
+        self._put(("touch", conversation_id, datetime.now(timezone.utc)))
+
+    def wait_for(self, conversation_id, timeout=WAIT_TIMEOUT):
+        """Block until this conversation's queued writes are committed"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending.get(conversation_id):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def flush(self, timeout=WAIT_TIMEOUT):
+        """Block until everything queued so far is committed"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # ── writer thread ──────────────────────────────────────────────────────
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        if self.app is None:
+            raise Exception("write_behind.init_app(app) must be called before queueing writes")
+        app = self.app
+
+        stopping = False
+        while not stopping:
+            op = self._queue.get()
+            if op is _STOP:
+                break
+            batch = [op]
+            # Gather whatever else arrives within one interval
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    op = self._queue.get(timeout=max(0.0, remaining)) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if op is _STOP:
+                    stopping = True
+                    # Drain the rest before exiting
+                    while True:
+                        try:
+                            batch.append(self._queue.get_nowait())
+                        except queue.Empty:
+                            break
+                    break
+                batch.append(op)
+
+            with app.app_context():
+                self._write(batch)
+
+    def _commit(self, ops):
+        """Write ops in one transaction; returns the saved (conversation_id, message_id, role, content)"""
+        pending_messages = []
+        touches = {}
+        for op in ops:
+            if op[0] == "message":
+                pending_messages.append(op[1:])
+            else:
+                _, conversation_id, timestamp = op
+                touches[conversation_id] = max(timestamp, touches.get(conversation_id, timestamp))
+
+        messages = [Message(conversation_id=conversation_id, role=role,
+                            content=content, timestamp=timestamp)
+                    for conversation_id, role, content, timestamp in pending_messages]
+        db.session.add_all(messages)
+        db.session.flush()
+        # Ids are assigned by the flush; read them now, not after commit expires the rows
+        saved = [(conversation_id, message.id, role, content)
+                 for message, (conversation_id, role, content, _) in zip(messages, pending_messages)]
+        for conversation_id, timestamp in touches.items():
+            db.session.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation_id)
+                .values(updated_at=timestamp)
+            )
+        db.session.commit()
+        return saved
+
+    def _commit_with_retry(self, ops, backoff=RETRY_BACKOFF):
+        """_commit() with a retry after each delay in backoff; returns (saved or None, last error)"""
+        error = None
+        for delay in (0.0,) + tuple(backoff):
+            time.sleep(delay)
+            try:
+                return self._commit(ops), None
+            except Exception as e:
+                db.session.rollback()
+                error = e
+        return None, error
+
+    def _dead_letter(self, op, error):
+        """Keep an op that can't be written, so it can be replayed by hand"""
+        self.failures += 1
+        record = {"op": op[0], "conversation_id": op[1], "error": str(error)}
+        if op[0] == "message":
+            record.update(role=op[2], content=op[3], timestamp=op[4].isoformat())
+        else:
+            record.update(timestamp=op[2].isoformat())
+        print(f"☠️ Write-behind dropped {op[0]} for conversation {op[1]}: {error} "
+              f"(kept in {DEAD_LETTER_PATH})")
+        try:
+            with open(DEAD_LETTER_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"❌ Dead letter write failed, lost: {json.dumps(record, ensure_ascii=False)} ({e})")
+
+    def _write(self, batch):
+        batch = [op for op in batch if op is not _STOP]
+
+        saved, error = self._commit_with_retry(batch)
+        if saved is None:
+            print(f"❌ Write-behind batch of {len(batch)} failed after {len(RETRY_BACKOFF) + 1} attempts: "
+                  f"{error} - writing ops one by one")
+            # One transaction per op, so a single bad row can't take the rest down with it
+            saved = []
+            written = 0
+            for op in batch:
+                rows, op_error = self._commit_with_retry([op], backoff=RETRY_BACKOFF[:1])
+                if rows is None:
+                    self._dead_letter(op, op_error)
+                else:
+                    saved.extend(rows)
+                    written += 1
+        else:
+            written = len(batch)
+
+        self.batches += 1
+        self.writes += written
+        for row in saved:
+            for callback in self._listeners:
+                try:
+                    callback(*row)
+                except Exception as e:
+                    print(f"⚠️ Write-behind listener error: {e}")
+        db.session.remove()
+
+        with self._cond:
+            for op in batch:
+                conversation_id = op[1]
+                left = self._pending.get(conversation_id, 0) - 1
+                if left > 0:
+                    self._pending[conversation_id] = left
+                else:
+                    self._pending.pop(conversation_id, None)
+            self._cond.notify_all()
+
+    def stop(self, timeout=WAIT_TIMEOUT):
+        """Drain and stop the writer (graceful shutdown)"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        with self._cond:
+            pending = sum(self._pending.values())
+        return {
+            "pending": pending,
+            "batches": self.batches,
+            "writes": self.writes,
+            "failures": self.failures
+        }
+
+
+write_behind = WriteBehindQueue()
+atexit.register(write_behind.stop)